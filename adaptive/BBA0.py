@@ -1,59 +1,57 @@
 from .abr import BasicABR
+import bisect
 import json
 
 class BBA0(BasicABR):
-    def __init__(self, manifestData):
-        super(BBA0, self).__init__(manifestData)
+    def __init__(self, manifestData, predictor=None):
+        super(BBA0, self).__init__(manifestData, predictor)
         self.reservoir = 8
         self.cushion = 46
         self.ratePrev = 0
         # self.buffer = 0
-    
-    def getCurrentBuffer(self, currBuffer, step, rateMap):
+        self.compileRateMap()
+
+    def compileRateMap(self):
+        # the rate map is linear over the cushion, one sorted bitrate every
+        # step seconds starting at the reservoir. It only depends on the
+        # manifest, so it is built once and looked up by arithmetic.
+        self.bitrates = sorted(self.getBitrateList())
+        self.step = self.cushion / (len(self.bitrates) - 1)
+        self.rMin = self.bitrates[0]
+        self.rMax = self.bitrates[-1]
+
+    def getCurrentBuffer(self, currBuffer):
         if currBuffer <= self.cushion + self.reservoir and currBuffer >= self.reservoir:
-            return rateMap[round((currBuffer-self.reservoir)/step)*step + self.reservoir]
+            return self.bitrates[round((currBuffer - self.reservoir) / self.step)]
         elif currBuffer > self.cushion + self.reservoir :
-            return rateMap[self.cushion + self.reservoir]
+            return self.rMax
         else:
-            return rateMap[self.reservoir]
-    
-    def NextSegmentQualityIndex(self, playerStats):
-        currBuffer = 70
-        #currBuffer = playerStats["currBuffer"]
-        bitrates = self.getBitrateList()
-        bitrates = sorted(bitrates)
-        rateMap = {}
-
-        step = self.cushion / (len(bitrates) - 1)
+            return self.rMin
 
-        for i in range(len(bitrates)):
-            rateMap[self.reservoir + i * step] = bitrates[i]
+    def replaceLastQuality(self, quality):
+        self.ratePrev = int(self.manifestData.bitrates_kbps[quality])
 
-        rMax = bitrates[-1]
-        rMin = bitrates[0]
-        ratePlus = None
-        rateMinus = None
+    def NextSegmentQualityIndex(self, playerStats):
+        currBuffer = playerStats["currBuffer"]
+        bitrates = self.bitrates
+        rMax = self.rMax
+        rMin = self.rMin
 
         if self.ratePrev < rMin:
             self.ratePrev = rMin
-        
+
+        # next bitrate above and below the previous one
         if self.ratePrev == rMax:
             ratePlus = rMax
         else:
-            for i in range(len(bitrates)):
-                if bitrates[i] > self.ratePrev:
-                    ratePlus = bitrates[i]
-                    break
+            ratePlus = bitrates[bisect.bisect_right(bitrates, self.ratePrev)]
 
         if self.ratePrev == rMin:
             rateMinus = rMin
         else:
-            for i in range(len(bitrates) - 1, -1, -1):
-                if bitrates[i] < self.ratePrev:
-                    rateMinus = bitrates[i]
-                    break
-        
-        funCurrBuffer = self.getCurrentBuffer(currBuffer, step, rateMap)
+            rateMinus = bitrates[bisect.bisect_left(bitrates, self.ratePrev) - 1]
+
+        funCurrBuffer = self.getCurrentBuffer(currBuffer)
 
         rateNext = None
 
@@ -62,15 +60,11 @@ class BBA0(BasicABR):
         elif currBuffer >= self.reservoir + self.cushion:
             rateNext = rMax
         elif funCurrBuffer >= ratePlus:
-            for i in range(len(bitrates) - 1 , -1 , -1):
-                if bitrates[i] < funCurrBuffer:
-                    rateNext = bitrates[i]
-                    break
+            # highest bitrate below f(B)
+            rateNext = bitrates[bisect.bisect_left(bitrates, funCurrBuffer) - 1]
         elif funCurrBuffer <= rateMinus:
-            for i in range(len(bitrates)):
-                if bitrates[i] >= funCurrBuffer:
-                    rateNext = bitrates[i]
-                    break
+            # lowest bitrate at or above f(B)
+            rateNext = bitrates[bisect.bisect_left(bitrates, funCurrBuffer)]
         else:
             rateNext = self.ratePrev
         self.ratePrev = rateNext
@@ -83,4 +77,4 @@ class BBA0(BasicABR):
 #     manifest = json.load(f)
 #     a = BBA(manifest)
 #     q = a.NextSegmentQualityIndex(60)
-#     print(q)
\ No newline at end of file
+#     print(q)
@@ -1,43 +1,56 @@
 from .abr import BasicABR
+from .manifest import RowBuffer
+import bisect
 # import json
 
+import numpy as np
+
 BBA2_STEADY_STATE = 'steady'
 BBA2_STARTUP_STATE = 'startup'
 X = 60
 
 
 class BBA2(BasicABR):
-    def __init__(self, manifestData):
-        super(BBA2, self).__init__(manifestData)
+    def __init__(self, manifestData, predictor=None):
+        super(BBA2, self).__init__(manifestData, predictor)
         self.reservoir = 8
         self.normal_reservoir = 8
         self.cushion = 46
-        self.manifestData = manifestData
-        self.chunksizeMin, self.chunksizeMax = self.findMinMaxChunkSize(self.manifestData['segment_size_bytes'])
-        self.k = (self.chunksizeMax - self.chunksizeMin) // self.cushion
         self.state = BBA2_STARTUP_STATE
         self.segmentNumber = 0
         self.bitrates = sorted(self.getBitrateList())
         self.ratePrev = self.bitrates[0]
         self.prevBuffer = 0
+        self.compileChunkMap()
+
+    def compileChunkMap(self):
+        # per segment chunk map: the sizes of every segment sorted ascending,
+        # column i going with the i-th lowest bitrate, and the representation
+        # index of every bitrate. Built once per manifest.
+        self.chunkRows = RowBuffer(np.sort(self.segmentSizes.sizes, axis=1))
+        self.chunkMap = self.chunkRows.rows
+        self.rateQuality = [self.GetCorrespondingQualityIndex(b) for b in self.bitrates]
+        self.chunksizeMin, self.chunksizeMax = self.findMinMaxChunkSize(self.chunkMap)
+        self.k = (self.chunksizeMax - self.chunksizeMin) // self.cushion
 
-    def findMinMaxChunkSize(self, chunkSize):
-        minSize = chunkSize[0][0]
-        maxSize = chunkSize[0][0]
-
-        for seg in chunkSize:
-            for c in seg:
-                minSize = min(c, minSize)
-                maxSize = max(c, maxSize)
+    def extendSegments(self, segment_size_bytes):
+        super(BBA2, self).extendSegments(segment_size_bytes)
+        chunks = np.sort(np.asarray(segment_size_bytes, dtype=np.float64), axis=1)
+        if not len(chunks):
+            return
+        self.chunkMap = self.chunkRows.extend(chunks)
+        chunksizeMin, chunksizeMax = self.findMinMaxChunkSize(chunks)
+        self.chunksizeMin = min(self.chunksizeMin, chunksizeMin)
+        self.chunksizeMax = max(self.chunksizeMax, chunksizeMax)
+        self.k = (self.chunksizeMax - self.chunksizeMin) // self.cushion
 
-        return minSize, maxSize
+    def findMinMaxChunkSize(self, chunkSize):
+        return int(chunkSize.min()), int(chunkSize.max())
 
     def getNextBetterRate(self, rate):
         # return next bigger bitrate than rate
-        for b in self.bitrates:
-            if b > rate:
-                return b
-        return self.bitrates[-1]
+        i = bisect.bisect_right(self.bitrates, rate)
+        return self.bitrates[min(i, len(self.bitrates) - 1)]
 
     def checkPhase(self, currBuffer, segIdx):
         #  return phase for startup algorithm from paper.
@@ -51,12 +64,8 @@ class BBA2(BasicABR):
 
     def adjustingReservoir(self, segIdx):
         expected_size_consumption = X * self.bitrates[0]
-        real_size_consumption = 0
         segments_in_X = int(X / self.GetSegmentDuration())
-
-        for i in range(segIdx, segIdx + segments_in_X):
-            if i < self.GetTotalSegments():
-                real_size_consumption += self.manifestData['segment_size_bytes'][i][0]
+        real_size_consumption = self.segmentSizes.total(segIdx, segments_in_X)[self.rateQuality[0]]
 
         adjusted = self.normal_reservoir + \
             ((real_size_consumption * 8) -
@@ -73,20 +82,22 @@ class BBA2(BasicABR):
         else:
             return (currBuffer - self.reservoir) * self.k + self.chunksizeMin
 
+    def replaceLastQuality(self, quality):
+        self.ratePrev = int(self.manifestData.bitrates_kbps[quality])
+
     def NextSegmentQualityIndex(self, playerStats):
         # currBuffer = 0
         # segIdx = -1
         currBuffer = playerStats['currBuffer']
         segIdx = playerStats['segment_Idx']
+        tput = self.estimateThroughput(playerStats)
 
         if self.state == BBA2_STARTUP_STATE and self.segmentNumber != 0:
             phase = self.checkPhase(currBuffer, segIdx)
-            print('phase:',phase)
 
             segDuration = self.GetSegmentDuration()
-            tput = playerStats['lastTput_kbps']
-            repID = self.GetCorrespondingQualityIndex(self.ratePrev) - 1 # -1 coz repid starts from 1.
-            segSize = self.manifestData['segment_size_bytes'][segIdx][repID]
+            repID = self.GetCorrespondingQualityIndex(self.ratePrev)
+            segSize = self.segmentSizes.sizes[segIdx, repID]
             deltaB = segDuration - ((segSize * 0.008) / tput)
 
             if (phase == 0 and deltaB >= 0.875 * segDuration) or (phase == 1 and deltaB >= 0.5 * segDuration):
@@ -100,7 +111,7 @@ class BBA2(BasicABR):
                 self.ratePrev = rateNext
                 self.prevBuffer = currBuffer
                 self.segmentNumber += 1
-                return rateNext
+                return self.GetCorrespondingQualityIndex(rateNext)
 
         rateNext = self.getRateFromChunkMap(currBuffer, segIdx)
         self.ratePrev = rateNext
@@ -117,23 +128,17 @@ class BBA2(BasicABR):
         if self.ratePrev == rMax:
             ratePlus = rMax
         else:
-            for i in range(len(self.bitrates)):
-                if self.bitrates[i] > self.ratePrev:
-                    ratePlus = self.bitrates[i]
-                    break
+            ratePlus = self.bitrates[bisect.bisect_right(self.bitrates, self.ratePrev)]
         if self.ratePrev == rMin:
             rateMinus = rMin
         else:
-            for i in range(len(self.bitrates) -1, -1, -1):
-                if self.bitrates[i] < self.ratePrev:
-                    rateMinus = self.bitrates[i]
-                    break
+            rateMinus = self.bitrates[bisect.bisect_left(self.bitrates, self.ratePrev) - 1]
         funCurrBuffer = self.fCurrBuffer(currBuffer)
-		# print('{}, minus:{}, plus:{}, buffer:{}, corrSize:{}'.format(segIdx, rateMinus, ratePlus, currBuffer, funCurrBuffer))
         rateNext = None
 
-        ratePlusSize = self.manifestData['segment_size_bytes'][segIdx][self.GetCorrespondingQualityIndex(ratePlus)-1]
-        rateMinusSize = self.manifestData['segment_size_bytes'][segIdx][self.GetCorrespondingQualityIndex(rateMinus)-1]
+        sizes = self.segmentSizes.sizes[segIdx]
+        ratePlusSize = sizes[self.GetCorrespondingQualityIndex(ratePlus)]
+        rateMinusSize = sizes[self.GetCorrespondingQualityIndex(rateMinus)]
 
         if currBuffer <= self.reservoir:
             rateNext = rMin
@@ -149,16 +154,12 @@ class BBA2(BasicABR):
         return rateNext
 
     def chunkSizeToRate(self, chunkSize, segIdx):
-        minDiff = abs(self.manifestData['segment_size_bytes'][segIdx][0] - chunkSize)
-        minDiffIdx = 0
-
-        for i, s in enumerate(self.manifestData['segment_size_bytes'][segIdx]):
-            d = abs(s - chunkSize)
-            if d < minDiff:
-                minDiff = d
-                minDiffIdx = i
-        
-        return self.bitrates[minDiffIdx]
+        # bitrate whose chunk is closest in size, the lower one on a tie
+        chunks = self.chunkMap[segIdx]
+        i = int(np.searchsorted(chunks, chunkSize))
+        if i == len(chunks) or (i > 0 and chunkSize - chunks[i - 1] <= chunks[i] - chunkSize):
+            i -= 1
+        return self.bitrates[i]
 
 
 # if __name__ == "__main__":
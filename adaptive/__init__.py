@@ -0,0 +1,38 @@
+import logging
+
+from .abr import BasicABR
+from .manifest import Manifest
+from .mpc import MPC, MPC_SOLVER_DP, dp_look_ahead_segments
+from .fastmpc import FastMPC
+from .bola import Bola
+from .BBA0 import BBA0
+from .BBA2 import BBA2
+
+logger = logging.getLogger("ABR")
+
+# names accepted by --abr
+ABR_RULES = ['tputRule', 'BBA0', 'BBA2', 'Bola', 'Bola-E', 'MPC', 'MPC-DP', 'FastMPC']
+
+
+def select_abr_algorithm(manifest_data, args):
+    manifest_data = Manifest.coerce(manifest_data)
+    predictor = getattr(args, 'predictor', None)
+    if args.abr == "BBA0":
+        return BBA0(manifest_data, predictor)
+    elif args.abr == 'Bola':
+        return Bola(manifest_data, predictor)
+    elif args.abr == 'Bola-E':
+        return Bola(manifest_data, predictor, placeholder=True)
+    elif args.abr == 'tputRule':
+        return BasicABR(manifest_data, predictor)
+    elif args.abr == 'MPC':
+        return MPC(manifest_data, predictor=predictor)
+    elif args.abr == 'MPC-DP':
+        return MPC(manifest_data, look_ahead=dp_look_ahead_segments, solver=MPC_SOLVER_DP, predictor=predictor)
+    elif args.abr == 'FastMPC':
+        return FastMPC(manifest_data, getattr(args, 'fastmpc_table', None), predictor)
+    elif args.abr == 'BBA2':
+        return BBA2(manifest_data, predictor)
+    else:
+        logger.error("Error!! No right rule specified")
+        return
@@ -1,17 +1,86 @@
 # super class for adaptive alogorithms
 # This class implements basic throughput rule
 
+import numpy as np
+
+from .manifest import Manifest, RowBuffer
+from .throughput import make_predictor
+
+
+class SegmentSizeIndex:
+    '''
+    The manifest segment sizes as one (segments x representations) array, along
+    with per-representation prefix sums, built once per manifest. A window of
+    sizes is a slice of the array and the total size of a window is the
+    difference of two prefix sum rows, neither walks the nested lists.
+    '''
+    def __init__(self, segment_size_bytes):
+        self._sizes = RowBuffer(np.asarray(segment_size_bytes, dtype=np.float64))
+        self.sizes = self._sizes.rows
+        cum_sizes = np.zeros((len(self.sizes) + 1, self.sizes.shape[1]), dtype=np.float64)
+        np.cumsum(self.sizes, axis=0, out=cum_sizes[1:])
+        self._cum_sizes = RowBuffer(cum_sizes)
+        self.cum_sizes = self._cum_sizes.rows
+
+    def extend(self, segment_size_bytes):
+        # segments published after the last one, for live manifests
+        sizes = np.asarray(segment_size_bytes, dtype=np.float64)
+        self.sizes = self._sizes.extend(sizes)
+        self.cum_sizes = self._cum_sizes.extend(self.cum_sizes[-1] + np.cumsum(sizes, axis=0))
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def _clamp(self, segment_idx, count):
+        # windows running past the last segment are cut short
+        start = min(max(segment_idx, 0), len(self.sizes))
+        return start, min(start + max(count, 0), len(self.sizes))
+
+    def window(self, segment_idx, count):
+        # sizes of segments segment_idx .. segment_idx + count - 1, one row per segment
+        start, end = self._clamp(segment_idx, count)
+        return self.sizes[start:end]
+
+    def total(self, segment_idx, count):
+        # per representation sum of the sizes of the window
+        start, end = self._clamp(segment_idx, count)
+        return self.cum_sizes[end] - self.cum_sizes[start]
+
 
 class BasicABR:
-    def __init__(self, manifestData):
-        self.manifestData = manifestData
+    # throughput predictor used when none is asked for, see adaptive/throughput.py
+    default_predictor = 'last'
+
+    def __init__(self, manifestData, predictor=None):
+        # a Manifest, or the manifest dict as parsed from JSON
+        self.manifestData = Manifest.coerce(manifestData)
+        self.segmentSizes = SegmentSizeIndex(self.manifestData.segment_size_bytes)
+        self.predictor = make_predictor(predictor or self.default_predictor)
+
+        # bitrate -> representation index, the first one wins on duplicates
+        self.qualityIndex = {}
+        for idx, bitrate in enumerate(self.manifestData.bitrates_kbps):
+            self.qualityIndex.setdefault(int(bitrate), idx)
+
+    def extendSegments(self, segment_size_bytes):
+        # live manifests: the sizes of newly published segments, as returned by
+        # Manifest.apply_update(). Rules with per segment state extend it here.
+        self.segmentSizes.extend(segment_size_bytes)
+
+    def replaceLastQuality(self, quality):
+        # the segment of the last decision is downloaded at quality instead,
+        # its download at the chosen one having been abandoned. Rules that
+        # remember their last choice update it here.
+        pass
+
+    def estimateThroughput(self, playerStats):
+        # feeds the last throughput sample to the predictor, returns the
+        # estimate for the next download in kbps
+        self.predictor.update(playerStats["lastTput_kbps"])
+        return self.predictor.predict()
 
     def getBitrateList(self):
-        manifest_bitrate = self.manifestData.get('bitrates_kbps')
-        bitrateList = []
-        for bitrate in manifest_bitrate:
-            bitrateList.append(int(bitrate))
-        return bitrateList
+        return [int(bitrate) for bitrate in self.manifestData.bitrates_kbps]
 
     '''
     The throughput rule: bitrate is choosen as per the last throughput.
@@ -19,9 +88,9 @@ class BasicABR:
     on the basis of the throughput rule.
     '''
     def NextSegmentQualityIndex(self, playerStats):
-        tput = playerStats["lastTput_kbps"]
+        tput = self.estimateThroughput(playerStats)
         #p = manifest.segment_time
-        m_bitrate = self.manifestData.get('bitrates_kbps')
+        m_bitrate = self.manifestData.bitrates_kbps
         if not tput:
             return 0
 
@@ -39,21 +108,15 @@ class BasicABR:
             return 0
 
     def NextSegmentSize(self, segment_idx, quality):
-        size = self.manifestData['segment_size_bytes'][segment_idx][quality]
-        return size
+        return int(self.segmentSizes.sizes[segment_idx, quality])
 
     def GetSegmentDuration(self):
-        return float(self.manifestData['segment_duration_ms'])
+        return self.manifestData.segment_duration_ms
 
     def GetTotalSegments(self):
-        return self.manifestData['total_segments']
+        return self.manifestData.total_segments
 
     def GetCorrespondingQualityIndex(self, bitrate):
-        manifest_bitrate = self.manifestData.get('bitrates_kbps')
-
-        for m_bitrate in manifest_bitrate:
-            idx = manifest_bitrate.index(m_bitrate)
-            if int(m_bitrate) == bitrate:
-                return idx
-
-        return -1 #states no representation with given bitrate found
+        if bitrate is None or bitrate != int(bitrate):
+            return -1
+        return self.qualityIndex.get(int(bitrate), -1) # -1 states no representation with given bitrate found
@@ -1,58 +1,106 @@
 from .abr import BasicABR
+from .manifest import RowBuffer
 import json
 
-import math
-
-# calculated from zip files, for each bitrate, from 1 to 5. in kBs
-file_sizes = [691.215, 1229.775, 2764.816, 6220.817]
+import numpy as np
 
 MINIMUM_SAFE_BUFFER = 10
 MAXIMUM_TARGET_BUFFER = 30
 
+# BOLA-E startup: fraction of the throughput estimate the first segment may use
+STARTUP_SAFETY_FACTOR = 0.9
+
+# per segment attributes, in the order segmentParameters() returns them
+SEGMENT_ARRAYS = ('order', 'sizes', 'utilities', 'gp', 'Vp', 'scoreNumerator')
+
 class Bola(BasicABR):
-    def __init__(self, manifestData):
-        super(Bola, self).__init__(manifestData)
-        self.manifestData = manifestData
+    def __init__(self, manifestData, predictor=None, placeholder=False):
+        super(Bola, self).__init__(manifestData, predictor)
 
         bitrates = self.getBitrateList()
         self.bitrates = sorted(bitrates)
-    
-        # buffer size in s
-        # self.buffer_size = args.bufferSize
-        # self.buffer_size = 100
- 
 
-        # default value for gamma variable is set to 5(as said in paper).
-        # self.gp = args.gp
-        #self.gp = 5
+        # BOLA-E: virtual buffer added to the real one, so that playback can
+        # start at the quality the throughput allows instead of ramping up from
+        # the lowest one. None until the first decision.
+        self.placeholder = placeholder
+        self.placeholderBuffer = None
 
-    def calculateParameters(self, min_buffer, target_buffer, seg_idx):
-        seg_sizes = self.manifestData['segment_size_bytes'][seg_idx]
-        seg_sizes.sort() # sort the list of segments sizes incase it is not sorted in ascending order.
-        sM = seg_sizes[0] 
+        self.calculateParameters(MINIMUM_SAFE_BUFFER, MAXIMUM_TARGET_BUFFER)
 
-        self.utilities = [math.log(s/sM) for s in seg_sizes]
+    def calculateParameters(self, min_buffer, target_buffer):
+        # utilities, gp and Vp of every segment, computed once from the manifest
+        self.minBuffer = min_buffer
+        self.targetBuffer = target_buffer
+        self.segmentArrays = {}
+        for name, values in zip(SEGMENT_ARRAYS, self.segmentParameters(self.segmentSizes.sizes)):
+            self.segmentArrays[name] = RowBuffer(values)
+            setattr(self, name, values)
 
-        self.gp = 1 - self.utilities[0] + (self.utilities[-1] - self.utilities[0]) / (target_buffer / min_buffer - 1)
-        self.Vp = min_buffer / (self.utilities[0] + self.gp - 1)
+    def segmentParameters(self, sizes):
+        # Qualities are ranked by segment size, order maps a rank back to the
+        # representation index.
+        order = np.argsort(sizes, axis=1, kind='stable')
+        sizes = np.take_along_axis(sizes, order, axis=1)
 
-    def NextSegmentQualityIndex(self, playerStats):
-        self.calculateParameters(MINIMUM_SAFE_BUFFER, MAXIMUM_TARGET_BUFFER, playerStats['segment_Idx'])
-        #self.calculateParameters(MINIMUM_SAFE_BUFFER, MAXIMUM_TARGET_BUFFER, 1)
+        utilities = np.log(sizes / sizes[:, :1])
+        u_min = utilities[:, 0]
+        u_max = utilities[:, -1]
+
+        gp = 1 - u_min + (u_max - u_min) / (self.targetBuffer / self.minBuffer - 1)
+        Vp = self.minBuffer / (u_min + gp - 1)
+        # Vp * (utility + gp), the part of the score that does not depend on the buffer
+        scoreNumerator = Vp[:, None] * (utilities + gp[:, None])
+        return order, sizes, utilities, gp, Vp, scoreNumerator
+
+    def extendSegments(self, segment_size_bytes):
+        super(Bola, self).extendSegments(segment_size_bytes)
+        new = self.segmentParameters(np.asarray(segment_size_bytes, dtype=np.float64))
+        for name, values in zip(SEGMENT_ARRAYS, new):
+            setattr(self, name, self.segmentArrays[name].extend(values))
 
+    def minBufferLevelForQuality(self, seg_idx, rank):
+        # lowest buffer level at which BOLA picks rank over every lower one
+        u = self.utilities[seg_idx]
+        s = self.sizes[seg_idx]
+        level = 0.0
+        for i in range(rank):
+            if u[i] < u[rank]:
+                level = max(level, self.Vp[seg_idx] * (self.gp[seg_idx] + (s[rank] * u[i] - s[i] * u[rank]) / (s[rank] - s[i])))
+        return level
+
+    def throughputRank(self, seg_idx, tput):
+        # highest rank the throughput estimate can download in time
+        seg_duration = self.GetSegmentDuration()
+        affordable = np.nonzero(self.sizes[seg_idx] * 8 / 1000 <= STARTUP_SAFETY_FACTOR * tput * seg_duration)[0]
+        return int(affordable[-1]) if len(affordable) else 0
+
+    def NextSegmentQualityIndex(self, playerStats):
+        seg_idx = playerStats['segment_Idx']
         level = playerStats['currBuffer']
-        # level = 15
-        quality = 0
-        score = None
-        for q in range(len(self.bitrates)):
-            s = ((self.Vp * (self.utilities[q] + self.gp) - level) / file_sizes[q])
-            if score is None or s >= score:
-                quality = q
-                score = s
+        tput = self.estimateThroughput(playerStats)
+
+        if self.placeholder:
+            if self.placeholderBuffer is None:
+                rank = self.throughputRank(seg_idx, tput)
+                self.placeholderBuffer = max(0.0, self.minBufferLevelForQuality(seg_idx, rank) - level)
+                return int(self.order[seg_idx, rank])
+            if level <= 0:
+                # a stall means the placeholder was too optimistic
+                self.placeholderBuffer = 0.0
+            level += self.placeholderBuffer
+
+        # score of every quality, the highest one wins, the last of equal scores
+        scores = (self.scoreNumerator[seg_idx] - level) / self.sizes[seg_idx]
+        rank = len(scores) - 1 - int(np.argmax(scores[::-1]))
+
+        if self.placeholder:
+            # no need for a virtual buffer above the level where the top quality is picked
+            top_level = self.minBufferLevelForQuality(seg_idx, len(scores) - 1)
+            if level > top_level:
+                self.placeholderBuffer = max(0.0, self.placeholderBuffer - (level - top_level))
 
-        # print('level:{}, quality:{}, score:{}, i: {}'.format(level, quality, score, i))
-        print('quality: {} quality level:{}'.format(self.bitrates[quality], quality))
-        return quality
+        return int(self.order[seg_idx, rank])
 
 
 # if __name__ == "__main__":
@@ -61,4 +109,4 @@ class Bola(BasicABR):
 #     a = Bola(manifest)
 #     # for i in range(0, 150, 10):
 #     #     q = a.NextSegmentQualityIndex(10, i)
-#     q = a.NextSegmentQualityIndex(10)
\ No newline at end of file
+#     q = a.NextSegmentQualityIndex(10)
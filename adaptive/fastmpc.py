@@ -0,0 +1,241 @@
+from .abr import SegmentSizeIndex
+from .manifest import Manifest
+from .mpc import MPC, QoEEvaluator, look_ahead_segments
+
+import argparse
+import hashlib
+import math
+import os
+import random
+import struct
+import time
+
+import numpy as np
+
+# FastMPC: the decisions of MPC over a discretised (previous bitrate, buffer
+# level, predicted throughput) space, solved offline and stored as a table.
+#
+# Table file layout, little endian:
+#   header      TABLE_HEADER
+#   bitrates    total_representation * float64, the manifest bitrates in kbps
+#   decisions   uint8[total_representation + 1][buffer_bins][tput_bins]
+# Row 0 of decisions is for the first segment (no previous bitrate), row q + 1
+# for a previous download at quality q. Buffer bins are uniform over
+# [0, max_buffer] and throughput bins are log spaced over [tput_min, tput_max].
+# The table is not indexed by segment, it is solved for segments of the mean
+# size of each representation over the manifest. The digest in the header
+# covers everything the decisions depend on, the table version, the manifest
+# bitrates, segment duration and mean segment sizes and the parameters of the
+# table, so a table built for anything else is refused rather than giving
+# wrong decisions. A new version is built next to the old tables in the cache.
+
+TABLE_MAGIC = b'FMPC'
+TABLE_VERSION = 4
+# magic, version, total_representation, look_ahead, reserved, buffer_bins, tput_bins,
+# segment_duration, max_buffer, tput_min, tput_max, digest
+TABLE_HEADER = struct.Struct('<4sHHHHIIdddd16s')
+
+# tables built on first use, named by their digest, outside the source tree
+TABLE_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+                               'abr-transport', 'fastmpc')
+
+default_buffer_bins = 64
+default_tput_bins = 64
+default_max_buffer = 60
+default_tput_min = 100
+default_tput_max = 100000
+
+
+def mean_segment_sizes(manifest):
+    segment_sizes = SegmentSizeIndex(manifest.segment_size_bytes)
+    return segment_sizes.total(0, len(segment_sizes)) / len(segment_sizes)
+
+
+def table_digest(manifest, look_ahead=look_ahead_segments, buffer_bins=default_buffer_bins,
+                 tput_bins=default_tput_bins, max_buffer=default_max_buffer, tput_min=default_tput_min,
+                 tput_max=default_tput_max):
+    manifest = Manifest.coerce(manifest)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(struct.pack('<HIIIdddd', TABLE_VERSION, look_ahead, buffer_bins, tput_bins, manifest.segment_duration_ms,
+                         max_buffer, tput_min, tput_max))
+    h.update(np.asarray(manifest.bitrates_kbps, dtype='<f8').tobytes())
+    h.update(np.asarray(mean_segment_sizes(manifest), dtype='<f8').tobytes())
+    return h.digest()
+
+
+def default_table_file(manifest, **parameters):
+    return os.path.join(TABLE_CACHE_DIR, table_digest(manifest, **parameters).hex() + '.fastmpc')
+
+
+class DecisionTable:
+    def __init__(self, bitrates_kbps, decisions, look_ahead, segment_duration, max_buffer, tput_min, tput_max,
+                 digest=bytes(16)):
+        self.bitrates_kbps = list(bitrates_kbps)
+        self.decisions = decisions
+        self.look_ahead = look_ahead
+        self.segment_duration = segment_duration
+        self.max_buffer = max_buffer
+        self.tput_min = tput_min
+        self.tput_max = tput_max
+        self.digest = digest
+
+        _, self.buffer_bins, self.tput_bins = decisions.shape
+        self.buffer_step = max_buffer / (self.buffer_bins - 1)
+        self.log_tput_min = math.log(tput_min)
+        self.log_tput_step = (math.log(tput_max) - self.log_tput_min) / (self.tput_bins - 1)
+
+    def buffer_levels(self):
+        return [i * self.buffer_step for i in range(self.buffer_bins)]
+
+    def tput_levels(self):
+        return [math.exp(self.log_tput_min + i * self.log_tput_step) for i in range(self.tput_bins)]
+
+    def lookup(self, prev_quality, buffer_level, tput_pred):
+        # prev_quality is -1 before the first download
+        b = int(buffer_level / self.buffer_step + 0.5)
+        b = min(max(b, 0), self.buffer_bins - 1)
+        if tput_pred > 0:
+            t = int((math.log(tput_pred) - self.log_tput_min) / self.log_tput_step + 0.5)
+            t = min(max(t, 0), self.tput_bins - 1)
+        else:
+            t = 0
+        return int(self.decisions[prev_quality + 1, b, t])
+
+    def nbytes(self):
+        return TABLE_HEADER.size + 8 * len(self.bitrates_kbps) + self.decisions.nbytes
+
+    def save(self, path):
+        header = TABLE_HEADER.pack(TABLE_MAGIC, TABLE_VERSION, len(self.bitrates_kbps), self.look_ahead, 0,
+                                   self.buffer_bins, self.tput_bins, self.segment_duration,
+                                   self.max_buffer, self.tput_min, self.tput_max, self.digest)
+        with open(path, 'wb') as f:
+            f.write(header)
+            f.write(np.asarray(self.bitrates_kbps, dtype='<f8').tobytes())
+            f.write(np.ascontiguousarray(self.decisions, dtype=np.uint8).tobytes())
+
+    @classmethod
+    def load(cls, path):
+        # the decisions are memory mapped, nothing but the header is read here
+        with open(path, 'rb') as f:
+            header = f.read(TABLE_HEADER.size)
+        if len(header) < TABLE_HEADER.size:
+            raise ValueError("FastMPC table '%s' is truncated" % path)
+        (magic, version, num_rep, look_ahead, _, buffer_bins, tput_bins,
+         segment_duration, max_buffer, tput_min, tput_max, digest) = TABLE_HEADER.unpack(header)
+        if magic != TABLE_MAGIC:
+            raise ValueError("'%s' is not a FastMPC table" % path)
+        if version != TABLE_VERSION:
+            raise ValueError("FastMPC table '%s' has unsupported version %d" % (path, version))
+
+        bitrates = np.memmap(path, dtype='<f8', mode='r', offset=TABLE_HEADER.size, shape=(num_rep,))
+        decisions = np.memmap(path, dtype=np.uint8, mode='r', offset=TABLE_HEADER.size + 8 * num_rep,
+                              shape=(num_rep + 1, buffer_bins, tput_bins))
+        return cls(bitrates.tolist(), decisions, look_ahead, segment_duration, max_buffer, tput_min, tput_max, digest)
+
+    def parameters(self):
+        return {'look_ahead': self.look_ahead, 'buffer_bins': self.buffer_bins, 'tput_bins': self.tput_bins,
+                'max_buffer': self.max_buffer, 'tput_min': self.tput_min, 'tput_max': self.tput_max}
+
+
+def build_table(manifest, look_ahead=look_ahead_segments, buffer_bins=default_buffer_bins, tput_bins=default_tput_bins,
+                max_buffer=default_max_buffer, tput_min=default_tput_min, tput_max=default_tput_max):
+    # solves f_MPC at the centre of every cell of the table
+    manifest = Manifest.coerce(manifest)
+    bitrates_kbps = manifest.bitrates_kbps
+    segment_duration = manifest.segment_duration_ms
+    evaluator = QoEEvaluator(bitrates_kbps, segment_duration, look_ahead)
+    sizes = np.tile(mean_segment_sizes(manifest), (look_ahead, 1))
+    digest = table_digest(manifest, look_ahead, buffer_bins, tput_bins, max_buffer, tput_min, tput_max)
+
+    decisions = np.zeros((len(bitrates_kbps) + 1, buffer_bins, tput_bins), dtype=np.uint8)
+    table = DecisionTable(bitrates_kbps, decisions, look_ahead, segment_duration, max_buffer, tput_min, tput_max,
+                          digest)
+    prev_bitrates = [0] + list(bitrates_kbps)
+    for p, prev_bitrate in enumerate(prev_bitrates):
+        for b, buffer_level in enumerate(table.buffer_levels()):
+            for t, tput_pred in enumerate(table.tput_levels()):
+                plan, _ = evaluator.plan(prev_bitrate, buffer_level, tput_pred, sizes)
+                decisions[p, b, t] = plan[0]
+    return table
+
+
+class FastMPC(MPC):
+    '''
+    MPC answering every decision with a lookup in a precomputed table. The table
+    is memory mapped, and built from the manifest first when the file is missing,
+    by default in TABLE_CACHE_DIR. A table built for another manifest or other
+    parameters raises ValueError.
+    '''
+    def __init__(self, manifestData, table_file=None, predictor=None, look_ahead=look_ahead_segments,
+                 buffer_bins=default_buffer_bins, tput_bins=default_tput_bins, max_buffer=default_max_buffer):
+        manifestData = Manifest.coerce(manifestData)
+        parameters = {'look_ahead': look_ahead, 'buffer_bins': buffer_bins, 'tput_bins': tput_bins,
+                      'max_buffer': max_buffer, 'tput_min': default_tput_min, 'tput_max': default_tput_max}
+        digest = table_digest(manifestData, **parameters)
+        table_file = table_file or os.path.join(TABLE_CACHE_DIR, digest.hex() + '.fastmpc')
+        if not os.path.exists(table_file):
+            os.makedirs(os.path.dirname(os.path.abspath(table_file)), exist_ok=True)
+            build_table(manifestData, **parameters).save(table_file)
+        self.table = DecisionTable.load(table_file)
+        if self.table.digest != digest:
+            stale = [name for name, value in self.table.parameters().items() if value != parameters[name]]
+            raise ValueError("FastMPC table '%s' was built for %s, rebuild it with python -m adaptive.fastmpc build"
+                             % (table_file, "other " + ", ".join(stale) if stale else "a different manifest"))
+
+        super(FastMPC, self).__init__(manifestData, look_ahead=self.table.look_ahead, predictor=predictor)
+
+    def f_MPC(self, prev_bitrate, buffer_level, tput_pred, segment_idx):
+        prev_quality = self.GetCorrespondingQualityIndex(prev_bitrate) if prev_bitrate else -1
+        return self.manifestData.bitrates_kbps[self.table.lookup(prev_quality, buffer_level, tput_pred)]
+
+
+def table_agreement(manifest, table, samples=2000, seed=0):
+    # fraction of random player states where the table picks the same
+    # bitrate as the full MPC optimisation over the real segment sizes
+    manifest = Manifest.coerce(manifest)
+    bitrates_kbps = manifest.bitrates_kbps
+    evaluator = QoEEvaluator(bitrates_kbps, table.segment_duration, table.look_ahead)
+    segment_sizes = SegmentSizeIndex(manifest.segment_size_bytes)
+    rng = random.Random(seed)
+    agree = 0
+    for _ in range(samples):
+        sizes = segment_sizes.window(rng.randrange(len(segment_sizes) - table.look_ahead + 1), table.look_ahead)
+        prev_quality = rng.randrange(-1, len(bitrates_kbps))
+        prev_bitrate = bitrates_kbps[prev_quality] if prev_quality >= 0 else 0
+        buffer_level = rng.uniform(0, table.max_buffer)
+        tput_pred = math.exp(rng.uniform(math.log(table.tput_min), math.log(table.tput_max)))
+        plan, _ = evaluator.plan(prev_bitrate, buffer_level, tput_pred, sizes)
+        agree += plan[0] == table.lookup(prev_quality, buffer_level, tput_pred)
+    return agree / samples
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and evaluate FastMPC decision tables")
+    parser.add_argument("action", choices=["build", "evaluate"],
+                        help="build: write a table file, evaluate: table size versus agreement with MPC")
+    parser.add_argument("--manifest-file", type=str, default="htdocs/bbb_m.json", help="Path to the custom manifest file")
+    parser.add_argument("--output", type=str, help="table file to write (build), by default in " + TABLE_CACHE_DIR)
+    parser.add_argument("--look-ahead", type=int, default=look_ahead_segments)
+    parser.add_argument("--buffer-bins", type=int, nargs="+", default=[default_buffer_bins])
+    parser.add_argument("--tput-bins", type=int, nargs="+", default=[default_tput_bins])
+    parser.add_argument("--max-buffer", type=float, default=default_max_buffer, help="largest buffer level in s")
+    parser.add_argument("--samples", type=int, default=2000, help="random states to compare (evaluate)")
+    args = parser.parse_args()
+
+    manifest = Manifest.load(args.manifest_file)
+
+    if args.action == "build":
+        output = args.output or default_table_file(manifest, look_ahead=args.look_ahead,
+                                                   buffer_bins=args.buffer_bins[0], tput_bins=args.tput_bins[0],
+                                                   max_buffer=args.max_buffer)
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        start = time.perf_counter()
+        table = build_table(manifest, args.look_ahead, args.buffer_bins[0], args.tput_bins[0], args.max_buffer)
+        table.save(output)
+        print('wrote {} ({} bytes) in {:.1f}s'.format(output, table.nbytes(), time.perf_counter() - start))
+    else:
+        for buffer_bins in args.buffer_bins:
+            for tput_bins in args.tput_bins:
+                table = build_table(manifest, args.look_ahead, buffer_bins, tput_bins, args.max_buffer)
+                print('buffer bins:{} tput bins:{} size:{} bytes agreement:{:.2%}'.format(
+                    buffer_bins, tput_bins, table.nbytes(), table_agreement(manifest, table, args.samples)))
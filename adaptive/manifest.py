@@ -0,0 +1,288 @@
+# The manifest as loaded once and shared by the DASH client, the server and the
+# adaptive algorithms. Numeric fields are converted when the manifest is read
+# instead of on every use, and the segment sizes are one contiguous
+# (segments x representations) uint32 array rather than nested lists.
+#
+# Besides JSON a manifest can be stored in a binary file, little endian:
+#   header      MANIFEST_HEADER
+#   bitrates    total_representation * float64, in kbps
+#   resolutions total_representation * RESOLUTION_WIDTH bytes, ASCII, NUL padded
+#   sizes       uint32[segments][total_representation], in bytes
+# The size table is memory mapped on load, so opening a binary manifest costs
+# the same whatever the length of the title.
+#
+# A live manifest ("live": true) only lists the segments of a sliding window
+# published so far, start_number being the number of the first of them, and
+# carries the update sequence number of the channel. A player keeps it current
+# with apply_update(), which appends the segments published since. A player
+# that falls more than the window behind gets an update starting past its last
+# known segment: the segments in between are no longer offered, and are left
+# out of the segments to download through window_start. A live channel loops
+# over the segments of a static manifest, loop_segments of them: the segment
+# at row r stands for segment (start_number + r) % loop_segments of the source.
+
+import argparse
+import json
+import struct
+import time
+
+import numpy as np
+
+MANIFEST_MAGIC = b'DMAN'
+MANIFEST_VERSION = 1
+# magic, version, representations in the size table, total_representation, reserved,
+# start_number, total_duration, timescale, total_segments, segments in the size table,
+# segment_duration_ms
+MANIFEST_HEADER = struct.Struct('<4sHHHHIIIIId')
+RESOLUTION_WIDTH = 16
+
+
+class RowBuffer:
+    '''
+    An array grown by appending rows in place. The storage doubles when full,
+    so appending a few rows at a time costs amortised O(1) per row and views
+    handed out before stay valid until the storage is replaced.
+    '''
+    __slots__ = ('buffer', 'count')
+
+    def __init__(self, rows):
+        self.buffer = rows
+        self.count = len(rows)
+
+    @property
+    def rows(self):
+        return self.buffer[:self.count]
+
+    def extend(self, new_rows):
+        # returns a view of all the rows, the new ones included
+        end = self.count + len(new_rows)
+        if end > len(self.buffer):
+            grown = np.empty((max(end, 2 * len(self.buffer)),) + self.buffer.shape[1:], dtype=self.buffer.dtype)
+            grown[:self.count] = self.buffer[:self.count]
+            self.buffer = grown
+        self.buffer[self.count:end] = new_rows
+        self.count = end
+        return self.rows
+
+
+class Manifest:
+    __slots__ = ('start_number', 'total_duration', 'segment_duration_ms', 'timescale', 'segment_duration',
+                 'total_segments', 'total_representation', 'bitrates_kbps', 'resolutions', 'segment_size_bytes',
+                 'live', 'sequence', 'loop_segments', 'window_start', '_rows')
+
+    def __init__(self, start_number, total_duration, segment_duration_ms, timescale, bitrates_kbps, resolutions,
+                 segment_size_bytes, total_segments=None, total_representation=None, live=False, sequence=0,
+                 loop_segments=0):
+        self.start_number = int(start_number)
+        self.total_duration = int(total_duration)
+        self.segment_duration_ms = float(segment_duration_ms)
+        self.timescale = int(timescale)
+        # in seconds, as the player counts its buffer
+        self.segment_duration = self.segment_duration_ms / self.timescale
+        self.bitrates_kbps = [float(b) for b in bitrates_kbps]
+        self.resolutions = [str(r) for r in resolutions]
+
+        self.segment_size_bytes = np.ascontiguousarray(segment_size_bytes, dtype=np.uint32)
+        if not self.segment_size_bytes.size:
+            # a live manifest before anything is published
+            self.segment_size_bytes = self.segment_size_bytes.reshape(0, len(self.bitrates_kbps))
+        if self.segment_size_bytes.ndim != 2 or self.segment_size_bytes.shape[1] != len(self.bitrates_kbps):
+            raise ValueError("segment sizes of shape %s do not match %d representations"
+                             % (self.segment_size_bytes.shape, len(self.bitrates_kbps)))
+
+        self.total_segments = int(total_segments) if total_segments is not None else len(self.segment_size_bytes)
+        self.total_representation = int(total_representation) if total_representation is not None \
+            else len(self.bitrates_kbps)
+
+        self.live = bool(live)
+        self.sequence = int(sequence)
+        self.loop_segments = int(loop_segments)
+        # row of the oldest segment known to be still offered, live manifests
+        self.window_start = 0
+        # created on the first append, the sizes may be a read only memory map
+        self._rows = None
+
+    @classmethod
+    def from_dict(cls, data):
+        # scripts/abr/manifest.py writes the sizes as frame_size_bytes
+        sizes = data['segment_size_bytes'] if 'segment_size_bytes' in data else data['frame_size_bytes']
+        return cls(data['start_number'], data['total_duration'], data['segment_duration_ms'], data['timescale'],
+                   data['bitrates_kbps'], data['resolutions'], sizes,
+                   data.get('total_segments'), data.get('total_representation'),
+                   data.get('live', False), data.get('sequence', 0), data.get('loop_segments', 0))
+
+    @classmethod
+    def load(cls, path):
+        # binary or JSON, told apart by the magic
+        if is_binary_manifest(path):
+            return cls.load_binary(path)
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    @classmethod
+    def load_binary(cls, path):
+        with open(path, 'rb') as f:
+            header = f.read(MANIFEST_HEADER.size)
+        if len(header) < MANIFEST_HEADER.size:
+            raise ValueError("binary manifest '%s' is truncated" % path)
+        (magic, version, num_rep, total_representation, _, start_number, total_duration, timescale,
+         total_segments, segments, segment_duration_ms) = MANIFEST_HEADER.unpack(header)
+        if magic != MANIFEST_MAGIC:
+            raise ValueError("'%s' is not a binary manifest" % path)
+        if version != MANIFEST_VERSION:
+            raise ValueError("binary manifest '%s' has unsupported version %d" % (path, version))
+
+        offset = MANIFEST_HEADER.size
+        bitrates = np.fromfile(path, dtype='<f8', count=num_rep, offset=offset)
+        offset += 8 * num_rep
+        resolutions = np.fromfile(path, dtype='S%d' % RESOLUTION_WIDTH, count=num_rep, offset=offset)
+        offset += RESOLUTION_WIDTH * num_rep
+        sizes = np.memmap(path, dtype='<u4', mode='r', offset=offset, shape=(segments, num_rep))
+        return cls(start_number, total_duration, segment_duration_ms, timescale, bitrates.tolist(),
+                   [r.decode('ascii') for r in resolutions], sizes, total_segments, total_representation)
+
+    def save_binary(self, path):
+        num_rep = len(self.bitrates_kbps)
+        for r in self.resolutions:
+            if len(r.encode('ascii')) > RESOLUTION_WIDTH:
+                raise ValueError("resolution '%s' is longer than %d bytes" % (r, RESOLUTION_WIDTH))
+        header = MANIFEST_HEADER.pack(MANIFEST_MAGIC, MANIFEST_VERSION, num_rep, self.total_representation, 0,
+                                      self.start_number, self.total_duration, self.timescale, self.total_segments,
+                                      len(self.segment_size_bytes), self.segment_duration_ms)
+        with open(path, 'wb') as f:
+            f.write(header)
+            f.write(np.asarray(self.bitrates_kbps, dtype='<f8').tobytes())
+            f.write(np.asarray(self.resolutions, dtype='S%d' % RESOLUTION_WIDTH).tobytes())
+            f.write(np.ascontiguousarray(self.segment_size_bytes, dtype='<u4').tobytes())
+
+    def save_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+    @classmethod
+    def coerce(cls, manifest):
+        # a Manifest is passed through, a dict parsed from JSON is converted
+        return manifest if isinstance(manifest, cls) else cls.from_dict(manifest)
+
+    def to_dict(self):
+        return {
+            "start_number": self.start_number,
+            "segment_duration_ms": self.segment_duration_ms,
+            "total_duration": self.total_duration,
+            "timescale": self.timescale,
+            "total_segments": self.total_segments,
+            "total_representation": self.total_representation,
+            "bitrates_kbps": self.bitrates_kbps,
+            "resolutions": self.resolutions,
+            "segment_size_bytes": self.segment_size_bytes.tolist(),
+            "live": self.live,
+            "sequence": self.sequence,
+            "loop_segments": self.loop_segments,
+        }
+
+    def append_segments(self, rows):
+        # sizes of segments published after the last known one, returns them as
+        # stored. Lookups of the segments already known are not affected.
+        rows = np.asarray(rows, dtype=np.uint32).reshape(-1, len(self.bitrates_kbps))
+        if self._rows is None:
+            self._rows = RowBuffer(self.segment_size_bytes)
+        self.segment_size_bytes = self._rows.extend(rows)
+        self.total_segments = len(self.segment_size_bytes)
+        return self.segment_size_bytes[-len(rows):] if len(rows) else self.segment_size_bytes[:0]
+
+    def apply_update(self, update):
+        # update as sent by LiveChannel.update(): the segments from first_segment
+        # on, some of which may already be known. Returns the sizes of the new ones.
+        # Segments that left the window before they were listed get the sizes of
+        # the first one offered, to keep one row per segment, and window_start
+        # moves past them.
+        known_end = self.start_number + len(self)
+        first = int(update['first_segment'])
+        rows = np.asarray(update['segment_size_bytes'], dtype=np.uint32).reshape(-1, len(self.bitrates_kbps))
+        self.sequence = max(self.sequence, int(update['sequence']))
+        if first > known_end:
+            if not len(rows):
+                return self.segment_size_bytes[:0]
+            rows = np.concatenate([np.repeat(rows[:1], first - known_end, axis=0), rows])
+            first = known_end
+            self.window_start = int(update['first_segment']) - self.start_number
+        return self.append_segments(rows[known_end - first:])
+
+    def source_segment(self, segment_idx):
+        # the segment of the source manifest a row stands for
+        if self.loop_segments:
+            return (self.start_number + segment_idx) % self.loop_segments
+        return segment_idx
+
+    def segment_size(self, segment_idx, quality):
+        return self.segment_size_bytes.item(segment_idx, quality)
+
+    def __len__(self):
+        return len(self.segment_size_bytes)
+
+
+class LiveChannel:
+    '''
+    A live channel played out of a static manifest: from start_time on, one
+    segment is published every segment duration, looping over the segments of
+    the manifest. Only the last window segments are offered to players.
+    '''
+    def __init__(self, manifest, window, start_time):
+        self.manifest = manifest
+        self.window = window
+        self.start_time = start_time
+
+    def sequence(self, now):
+        # update sequence number, the count of segments published so far
+        return max(0, int((now - self.start_time) / self.manifest.segment_duration))
+
+    def _sizes(self, first, end):
+        idx = np.arange(first, end) % len(self.manifest)
+        return self.manifest.segment_size_bytes[idx].tolist()
+
+    def snapshot(self, now):
+        # the whole window, as a live manifest
+        sequence = self.sequence(now)
+        first = max(0, sequence - self.window)
+        data = self.manifest.to_dict()
+        data.update(start_number=first, total_segments=sequence - first, live=True, sequence=sequence,
+                    loop_segments=len(self.manifest), segment_size_bytes=self._sizes(first, sequence))
+        return data
+
+    def update(self, now, since):
+        # the segments published after update since, as many as are still in the window
+        sequence = self.sequence(now)
+        first = min(max(since, sequence - self.window, 0), sequence)
+        return {
+            "live": True,
+            "sequence": sequence,
+            "first_segment": first,
+            "segment_size_bytes": self._sizes(first, sequence),
+        }
+
+
+def is_binary_manifest(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MANIFEST_MAGIC)) == MANIFEST_MAGIC
+
+
+def convert(src, dst):
+    # JSON to binary or back, the direction is given by the source file
+    manifest = Manifest.load(src)
+    if is_binary_manifest(src):
+        manifest.save_json(dst)
+    else:
+        manifest.save_binary(dst)
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a manifest between JSON and the binary format")
+    parser.add_argument("input", type=str, help="JSON or binary manifest")
+    parser.add_argument("output", type=str, help="manifest to write, in the other format")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    manifest = convert(args.input, args.output)
+    print('wrote {} ({} segments, {} representations) in {:.1f}ms'.format(
+        args.output, len(manifest), len(manifest.bitrates_kbps), (time.perf_counter() - start) * 1000))
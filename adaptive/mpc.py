@@ -1,100 +1,311 @@
-from .abr import BasicABR
+from .abr import BasicABR, SegmentSizeIndex
+from .manifest import Manifest
 
+import argparse
 import itertools
-import json
+import logging
 import time
 
+import numpy as np
+
 MPC_STARTUP_STATE = "startup"
 MPC_STEADY_STATE = "steady"
 
 look_ahead_segments = 4 
 keep_past_segment = 4
 
-# bitrate combinations for look_ahead_segments. will be used to calculate QOE.
-bitrate_combination = list(itertools.product(range(4), repeat = look_ahead_segments))
+# the dynamic programming solver can afford a much longer horizon
+dp_look_ahead_segments = 10
+dp_buffer_bins = 64
+
+MPC_SOLVER_EXHAUSTIVE = "exhaustive"
+MPC_SOLVER_DP = "dp"
 
 LAMBDA = 1
 MU = MUs = 3000
 
+logger = logging.getLogger("MPC")
+
+
+def bitrate_combinations(num_representations, horizon):
+    # every quality sequence of length horizon, one per row, in the same
+    # order as itertools.product(range(num_representations), repeat=horizon).
+    grid = np.indices((num_representations,) * horizon)
+    return grid.reshape(horizon, -1).T.copy()
+
+
+def plan_qoe(bitrates_kbps, segment_duration, plan, prev_bitrate, buffer_level, tput_pred, sizes):
+    # QoE of downloading the quality sequence plan, one segment at a time.
+    # sizes holds the segment sizes in bytes of the window, one row per segment,
+    # the plan is cut short when the window is.
+    curr_qoe = 0
+    curr_buffer = buffer_level
+    last_bitrate = prev_bitrate * 0.001
+
+    for b, segment_sizes in zip(plan, sizes):
+        curr_bitrate = bitrates_kbps[b] * 0.001 # since curr_bitrate is in bits per sec
+        segment_size = float(segment_sizes[b])
+        download_time = segment_size / (tput_pred * 125) # convert kilobits per sec to bytes per second 1000/8
+        rebuf_time = max(download_time - curr_buffer, 0.0)
+
+        curr_buffer -= download_time
+        if curr_buffer < 0:
+            curr_buffer = 0.0
+
+        curr_buffer += segment_duration
+
+        curr_qoe += curr_bitrate
+        curr_qoe -= (LAMBDA * abs(last_bitrate - curr_bitrate))
+        curr_qoe -= (MU * rebuf_time)
+
+        last_bitrate = curr_bitrate
+    return curr_qoe
+
+
+class QoEEvaluator:
+    '''
+    Scores all the bitrate combinations of the look ahead horizon in one batched pass.
+    The combination matrix and everything that only depends on the manifest is built
+    once, a decision then walks the horizon step by step over whole columns, doing
+    the same floating point operations in the same order as the scalar loop.
+    '''
+    def __init__(self, bitrates_kbps, segment_duration, horizon=look_ahead_segments):
+        self.horizon = horizon
+        self.segment_duration = segment_duration
+        self.bitrates_kbps = list(bitrates_kbps)
+        self.combos = bitrate_combinations(len(self.bitrates_kbps), horizon)
+
+        # since curr_bitrate is in bits per sec
+        self.bitrates = np.array([b * 0.001 for b in self.bitrates_kbps], dtype=np.float64)
+        self.combo_bitrates = self.bitrates[self.combos]
+
+        # switching penalty between consecutive steps of a combination, the first
+        # step depends on the previous bitrate and is computed per decision.
+        self.switch_penalty = LAMBDA * np.abs(self.combo_bitrates[:, :-1] - self.combo_bitrates[:, 1:])
+
+    def scores(self, prev_bitrate, buffer_level, tput_pred, sizes):
+        # sizes: (steps x representations) segment sizes in bytes of the window,
+        # steps beyond the end of a shorter window are not scored.
+        download_time = sizes / (tput_pred * 125) # convert kilobits per sec to bytes per second 1000/8
+
+        curr_qoe = np.zeros(len(self.combos), dtype=np.float64)
+        curr_buffer = np.full(len(self.combos), float(buffer_level), dtype=np.float64)
+        last_bitrate = prev_bitrate * 0.001
+
+        for i in range(min(self.horizon, len(sizes))):
+            curr_bitrate = self.combo_bitrates[:, i]
+            dt = download_time[i][self.combos[:, i]]
+            rebuf_time = np.maximum(dt - curr_buffer, 0.0)
+
+            curr_buffer = curr_buffer - dt
+            curr_buffer = np.where(curr_buffer < 0, 0.0, curr_buffer)
+            curr_buffer = curr_buffer + self.segment_duration
+
+            curr_qoe = curr_qoe + curr_bitrate
+            if i == 0:
+                curr_qoe = curr_qoe - (LAMBDA * np.abs(last_bitrate - curr_bitrate))
+            else:
+                curr_qoe = curr_qoe - self.switch_penalty[:, i - 1]
+            curr_qoe = curr_qoe - (MU * rebuf_time)
+
+        return curr_qoe
+
+    def best(self, prev_bitrate, buffer_level, tput_pred, sizes):
+        # returns (index of the best combination, its score). argmax keeps the
+        # first maximum, like the strict comparison of the scalar loop.
+        qoe = self.scores(prev_bitrate, buffer_level, tput_pred, sizes)
+        idx = int(np.argmax(qoe))
+        return idx, float(qoe[idx])
+
+    def plan(self, prev_bitrate, buffer_level, tput_pred, sizes):
+        idx, qoe = self.best(prev_bitrate, buffer_level, tput_pred, sizes)
+        return self.combos[idx][:len(sizes)].tolist(), qoe
+
+
+class DPSolver:
+    '''
+    Dynamic programming over (step, buffer bin, last quality) instead of enumerating
+    the Q^horizon combinations. Paths landing in the same buffer bin with the same
+    last quality are merged, keeping the best one together with its exact buffer
+    level, so the cost of a decision is horizon * bins * Q^2 and the plan is
+    approximate only where two merged paths would have diverged later.
+    The QoE still to come never decreases with the buffer level: a larger buffer
+    rebuffers no longer on any step and leaves no less buffer for the next one.
+    So a state is also dropped when a higher bin of the same quality has at
+    least its value.
+    '''
+    def __init__(self, bitrates_kbps, segment_duration, horizon=look_ahead_segments, buffer_bins=dp_buffer_bins):
+        if buffer_bins < 2:
+            raise ValueError("the DP solver needs at least 2 buffer bins, not %d" % buffer_bins)
+        self.horizon = horizon
+        self.segment_duration = segment_duration
+        self.bitrates_kbps = list(bitrates_kbps)
+        self.buffer_bins = buffer_bins
+
+        # since curr_bitrate is in bits per sec
+        self.bitrates = np.array([b * 0.001 for b in self.bitrates_kbps], dtype=np.float64)
+        # switch_gain[q, a]: bitrate of a minus the penalty of switching from q to a
+        self.switch_gain = self.bitrates[None, :] - LAMBDA * np.abs(self.bitrates[:, None] - self.bitrates[None, :])
+        self.qualities = np.arange(len(self.bitrates))
+        # best value and the candidate holding it per (bin, quality), reused by every step
+        self._best = np.empty(buffer_bins * len(self.bitrates), dtype=np.float64)
+        self._parent = np.empty(buffer_bins * len(self.bitrates), dtype=np.intp)
+
+    def plan(self, prev_bitrate, buffer_level, tput_pred, sizes):
+        num_rep = len(self.bitrates)
+        steps = min(self.horizon, len(sizes))
+        download_time = sizes / (tput_pred * 125)
+
+        max_buffer = max(float(buffer_level), 0.0) + steps * self.segment_duration
+        bin_width = max_buffer / (self.buffer_bins - 1)
+        best = self._best
+        grid = best.reshape(self.buffer_bins, num_rep)
+        parent = self._parent
+
+        # live states: accumulated QoE, exact buffer level, last quality
+        value = self.bitrates - LAMBDA * np.abs(prev_bitrate * 0.001 - self.bitrates) - MU * np.maximum(download_time[0] - buffer_level, 0.0)
+        buffer = np.maximum(buffer_level - download_time[0], 0.0) + self.segment_duration
+        quality = self.qualities
+        history = []
+
+        for i in range(1, steps):
+            # every live state followed by every quality
+            dt = download_time[i]
+            total = (value[:, None] + self.switch_gain[quality] - MU * np.maximum(dt[None, :] - buffer[:, None], 0.0)).ravel()
+            next_buffer = np.maximum(buffer[:, None] - dt[None, :], 0.0) + self.segment_duration
+            bins = np.minimum(np.rint(next_buffer / bin_width), self.buffer_bins - 1).astype(np.intp)
+            keys = (bins * num_rep + self.qualities).ravel()
+            next_buffer = next_buffer.ravel()
+
+            # the best candidate landing on each (bin, quality) state, the first
+            # one on ties
+            best.fill(-np.inf)
+            np.maximum.at(best, keys, total)
+            winners = np.flatnonzero(total == best[keys])[::-1]
+            parent[keys[winners]] = winners
+
+            # minus the states dominated by a higher bin
+            above = np.maximum.accumulate(grid[::-1], axis=0)[::-1]
+            keep = np.empty(grid.shape, dtype=bool)
+            keep[:-1] = grid[:-1] > above[1:]
+            keep[-1] = grid[-1] > -np.inf
+            states = np.flatnonzero(keep)
+            picked = parent[states]
+
+            history.append((quality, picked // num_rep))
+            value = total[picked]
+            buffer = next_buffer[picked]
+            quality = states % num_rep
+
+        state = int(np.argmax(value))
+        plan = [int(quality[state])]
+        for prev_quality, parent_state in reversed(history):
+            state = int(parent_state[state])
+            plan.append(int(prev_quality[state]))
+        plan.reverse()
+        return plan, float(np.max(value))
+
+
+class ParetoSolver(DPSolver):
+    '''
+    The exact optimum for horizons exhaustive search cannot reach. Paths are
+    only dropped when another one with the same last quality has at least
+    their buffer level and their QoE, which never loses the best plan. The
+    number of states is not bounded, it is the reference solver_gap() measures
+    the DP against, not a solver for decisions.
+    '''
+    def plan(self, prev_bitrate, buffer_level, tput_pred, sizes):
+        num_rep = len(self.bitrates)
+        steps = min(self.horizon, len(sizes))
+        download_time = sizes / (tput_pred * 125)
+
+        value = self.bitrates - LAMBDA * np.abs(prev_bitrate * 0.001 - self.bitrates) - MU * np.maximum(download_time[0] - buffer_level, 0.0)
+        buffer = np.maximum(buffer_level - download_time[0], 0.0) + self.segment_duration
+        quality = self.qualities
+        history = []
+
+        for i in range(1, steps):
+            dt = download_time[i]
+            total = (value[:, None] + self.switch_gain[quality] - MU * np.maximum(dt[None, :] - buffer[:, None], 0.0)).ravel()
+            next_buffer = (np.maximum(buffer[:, None] - dt[None, :], 0.0) + self.segment_duration).ravel()
+            next_quality = np.tile(self.qualities, len(value))
+
+            # per quality, by decreasing buffer level, the candidates doing
+            # better than every one with more buffer
+            order = np.lexsort((-total, -next_buffer, next_quality))
+            groups = np.searchsorted(next_quality[order], self.qualities)
+            picked = []
+            for start, end in zip(groups, list(groups[1:]) + [len(order)]):
+                group = order[start:end]
+                if not len(group):
+                    continue
+                running = np.maximum.accumulate(total[group])
+                keep = np.empty(len(group), dtype=bool)
+                keep[0] = True
+                keep[1:] = total[group][1:] > running[:-1]
+                picked.append(group[keep])
+            picked = np.concatenate(picked)
+
+            history.append((quality, picked // num_rep))
+            value = total[picked]
+            buffer = next_buffer[picked]
+            quality = next_quality[picked]
+
+        state = int(np.argmax(value))
+        plan = [int(quality[state])]
+        for prev_quality, parent_state in reversed(history):
+            state = int(parent_state[state])
+            plan.append(int(prev_quality[state]))
+        plan.reverse()
+        return plan, float(np.max(value))
+
+
 class MPC(BasicABR):
-    def __init__(self, manifestData):
-        super(MPC, self).__init__(manifestData)
-        self.prev_tput_pred = []
-        self.prev_tput_observed = []
-        self.prev_error = []
+    # robust MPC, harmonic mean discounted by the recent prediction error
+    default_predictor = 'robust'
+
+    def __init__(self, manifestData, look_ahead=look_ahead_segments, solver=MPC_SOLVER_EXHAUSTIVE, predictor=None):
+        super(MPC, self).__init__(manifestData, predictor)
         self.state = MPC_STEADY_STATE
         self.prev_bitrate = 0
+        self.look_ahead = look_ahead
+        if solver == MPC_SOLVER_DP:
+            self.evaluator = DPSolver(self.manifestData.bitrates_kbps, self.GetSegmentDuration(), look_ahead)
+        elif solver == MPC_SOLVER_EXHAUSTIVE:
+            self.evaluator = QoEEvaluator(self.manifestData.bitrates_kbps, self.GetSegmentDuration(), look_ahead)
+        else:
+            raise ValueError("Unknown MPC solver '%s'" % solver)
 
     def f_MPC(self, prev_bitrate, buffer_level, tput_pred, segment_idx):
-        sTime = time.time()
+        sizes = self.segmentSizes.window(segment_idx, self.look_ahead)
+        if tput_pred <= 0 or not len(sizes):
+            # nothing observed yet or nothing left, lowest representation
+            return self.manifestData.bitrates_kbps[0]
+
+        plan, max_qoe = self.evaluator.plan(prev_bitrate, buffer_level, tput_pred, sizes)
+        best_bitrate = self.manifestData.bitrates_kbps[plan[0]]
+        logger.debug('for seg:{}, at buffer:{}, tputpred:{},best rate:{}, with score:{}'.format(segment_idx,buffer_level,tput_pred, best_bitrate, max_qoe))
+        return best_bitrate
+
+    def f_MPC_scalar(self, prev_bitrate, buffer_level, tput_pred, segment_idx):
+        # reference implementation, one combination at a time. Kept to check
+        # the solvers against, not used for decisions.
         max_qoe = -float('inf')
         best_bitrate = -1
-        for combo in bitrate_combination:
-            curr_qoe = 0
-            curr_buffer = buffer_level
-            seg_idx = segment_idx
-            last_bitrate = prev_bitrate * 0.001
-
-            for i, b in enumerate(combo):
-                curr_bitrate = self.manifestData['bitrates_kbps'][b] * 0.001 # since curr_bitrate is in bits per sec
-                # segment_size = self.video_properties['segment_size_bytes'][seg_idx][b]
-                segment_size = curr_bitrate * 2 * 125
-                download_time = segment_size / (tput_pred * 125) # convert kilobits per sec to bytes per second 1000/8
-                print('size:{}, downloadtime:{}, tput:{}'.format(segment_size, download_time, tput_pred))
-                rebuf_time =  download_time - curr_buffer
-                
-                curr_buffer -= download_time
-                if curr_buffer < 0:
-                    curr_buffer = 0.0
-
-                curr_buffer += self.GetSegmentDuration()
-
-                curr_qoe += curr_bitrate 
-                curr_qoe -= (LAMBDA * abs(last_bitrate - curr_bitrate))
-                curr_qoe -= (MU * rebuf_time)
-
-                last_bitrate = curr_bitrate
-            # print('combo:{} score:{}'.format(combo, curr_qoe))
+        bitrates_kbps = self.manifestData.bitrates_kbps
+        sizes = self.manifestData.segment_size_bytes[segment_idx:segment_idx + self.look_ahead]
+        for combo in itertools.product(range(len(bitrates_kbps)), repeat=self.look_ahead):
+            curr_qoe = plan_qoe(bitrates_kbps, self.GetSegmentDuration(), combo, prev_bitrate, buffer_level, tput_pred, sizes)
             if curr_qoe > max_qoe:
                 max_qoe = curr_qoe
-                best_bitrate = self.manifestData['bitrates_kbps'][combo[0]]
-        print('for seg:{}, at buffer:{}, tputpred:{},best rate:{}, with score:{}'.format(segment_idx,buffer_level,tput_pred, best_bitrate, max_qoe))
-        # print('time for looping:{}'.format(time.time() - sTime))
+                best_bitrate = bitrates_kbps[combo[0]]
         return best_bitrate
 
-    def throughput_pred(self):
-        # basic MPC - throughput prediction from paper by harmonic mean
-        rev_sum = 0.0
-        rev_count = 0
-        last_N_tput = self.prev_tput_observed[-5:]
-
-        for a in last_N_tput:
-            if a != 0:
-                rev_count += 1
-                rev_sum += (1/a)
-        print('observed:{}'.format(self.prev_tput_observed))
-        print('pred:{}'.format(self.prev_tput_pred))
-
-        harmonic_mean = 0
-        if rev_sum != 0:
-            harmonic_mean = rev_count / rev_sum
-
-        max_error = 0
-        if len(self.prev_tput_pred) > 0:
-            error = abs(self.prev_tput_observed[-1] - self.prev_tput_pred[-1]) / self.prev_tput_observed[-1]
-            self.prev_error.append(error)
-            max_error = max(self.prev_error[-5:])
-
-        # robust MPC- lower bound for tput from harmonic mean
-        next_tput = harmonic_mean / (1 + max_error)
-        self.prev_tput_pred.append(next_tput)
-
-        return next_tput
+    def replaceLastQuality(self, quality):
+        self.prev_bitrate = self.manifestData.bitrates_kbps[quality]
 
     def NextSegmentQualityIndex(self, playerStats):
-        self.prev_tput_observed.append(playerStats['lastTput_kbps'])
-        # self.prev_tput_observed.append(100000)
-        tput_pred = self.throughput_pred()
+        tput_pred = self.estimateThroughput(playerStats)
 
         if self.state == MPC_STARTUP_STATE:
             next_bitrate = self.f_MPC(self.prev_bitrate, playerStats['currBuffer'], tput_pred, playerStats['segment_Idx'])
@@ -104,16 +315,88 @@ class MPC(BasicABR):
             next_bitrate = self.f_MPC(self.prev_bitrate, playerStats['currBuffer'], tput_pred, playerStats['segment_Idx'])
             # next_bitrate = self.f_MPC(self.prev_bitrate, i, tput_pred, 1)
 
-        return next_bitrate
+        self.prev_bitrate = next_bitrate
+        return self.GetCorrespondingQualityIndex(next_bitrate)
+
+
+def scaled_ladder(manifest, representations):
+    # bitrates and segment sizes of a ladder of the given number of
+    # representations over the bitrate range of manifest. A segment keeps the
+    # size of its manifest counterparts relative to their bitrates.
+    bitrates_kbps = np.geomspace(min(manifest.bitrates_kbps), max(manifest.bitrates_kbps), representations)
+    sizes = np.asarray(manifest.segment_size_bytes, dtype=np.float64)
+    nominal = np.array(manifest.bitrates_kbps) * 125 * manifest.segment_duration
+    scale = (sizes / nominal).mean(axis=1)
+    return bitrates_kbps.tolist(), scale[:, None] * (bitrates_kbps * 125 * manifest.segment_duration)
+
+
+def solver_gap(manifest, look_ahead, buffer_bins=dp_buffer_bins, representations=None):
+    # compares the dynamic programming plan against the exact optimum over a
+    # grid of player states, found by ParetoSolver. The gap is measured on the
+    # exact QoE of the DP plan, relative to the optimum. With representations,
+    # on a ladder of that many representations scaled from the manifest.
+    manifest = Manifest.coerce(manifest)
+    segment_duration = manifest.segment_duration_ms
+    if representations is None:
+        bitrates_kbps, sizes = manifest.bitrates_kbps, manifest.segment_size_bytes
+    else:
+        bitrates_kbps, sizes = scaled_ladder(manifest, representations)
+    segment_sizes = SegmentSizeIndex(sizes)
+    exact = ParetoSolver(bitrates_kbps, segment_duration, look_ahead)
+    dp = DPSolver(bitrates_kbps, segment_duration, look_ahead, buffer_bins)
+    # the first segments and a window running past the last one
+    windows = [segment_sizes.window(i, look_ahead) for i in (0, len(segment_sizes) // 2, len(segment_sizes) - 2)]
+
+    gaps = []
+    agree = 0
+    optimal = 0
+    t_exact = 0.0
+    t_dp = []
+    for sizes in windows:
+        for prev_bitrate in [0] + list(bitrates_kbps):
+            for buffer_level in (0, 0.5, 1, 2, 4, 8, 15, 30, 60):
+                for tput_pred in (300, 1000, 2000, 4000, 6000, 9000, 15000, 30000):
+                    start = time.perf_counter()
+                    best_plan, best_qoe = exact.plan(prev_bitrate, buffer_level, tput_pred, sizes)
+                    t_exact += time.perf_counter() - start
+
+                    start = time.perf_counter()
+                    dp_plan, _ = dp.plan(prev_bitrate, buffer_level, tput_pred, sizes)
+                    t_dp.append(time.perf_counter() - start)
+
+                    dp_qoe = plan_qoe(bitrates_kbps, segment_duration, dp_plan, prev_bitrate, buffer_level, tput_pred, sizes)
+                    gaps.append((best_qoe - dp_qoe) / max(abs(best_qoe), 1e-9))
+                    agree += dp_plan[0] == best_plan[0]
+                    optimal += gaps[-1] <= 1e-12
+
+    return {
+        'states': len(gaps),
+        'first_decision_agreement': agree / len(gaps),
+        'optimal_plans': optimal / len(gaps),
+        'mean_gap': sum(gaps) / len(gaps),
+        'max_gap': max(gaps),
+        'exact_ms': t_exact / len(gaps) * 1000,
+        'dp_ms': sum(t_dp) / len(t_dp) * 1000,
+        'dp_p99_ms': float(np.percentile(t_dp, 99)) * 1000,
+    }
 
 
 if __name__ == "__main__":
-    f = open("/home/aniketh/devel/src/abr-over-quic/src/bbb_m.json")
-    manifest = json.load(f)
-
-    a = MPC(manifest)
-    # for i in range(0, 100, 10):
-    #     q = a.NextSegmentQualityIndex(10, i)
-    #     print("bitrate: {} buffer: {}".format(q, i))
-    q = a.NextSegmentQualityIndex(10)
-    print(q)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Approximation gap and decision time of the MPC dynamic programming solver")
+    parser.add_argument("--manifest-file", type=str, default="htdocs/bbb_m.json", help="Path to the custom manifest file")
+    parser.add_argument("--look-ahead", type=int, nargs="+", default=[8, 10, 12], help="horizons to compare")
+    parser.add_argument("--representations", type=int, nargs="+", default=[6, 8, 10],
+                        help="representations of the ladders scaled from the manifest, 0 for the manifest's own")
+    parser.add_argument("--buffer-bins", type=int, default=dp_buffer_bins, help="buffer levels of the DP grid")
+    args = parser.parse_args()
+
+    manifest = Manifest.load(args.manifest_file)
+
+    for representations in args.representations:
+        for look_ahead in args.look_ahead:
+            r = solver_gap(manifest, look_ahead, args.buffer_bins, representations or None)
+            print('representations:{} look_ahead:{} states:{} optimal:{:.1%} same first decision:{:.1%} mean gap:{:.4%} '
+                  'max gap:{:.4%} exact:{:.3f}ms dp:{:.3f}ms dp p99:{:.3f}ms'.format(
+                      representations or len(manifest.bitrates_kbps), look_ahead, r['states'], r['optimal_plans'],
+                      r['first_decision_agreement'], r['mean_gap'], r['max_gap'], r['exact_ms'], r['dp_ms'],
+                      r['dp_p99_ms']))
@@ -0,0 +1,182 @@
+# Throughput predictors shared by the adaptive algorithms.
+#
+# A predictor is fed one throughput sample (kbps) per decision with update()
+# and asked for the estimate of the next download with predict(). All of them
+# keep their history in fixed size ring buffers with running sums, so both
+# calls cost O(1) (O(window) at worst, for a window fixed at construction)
+# and memory does not grow over a session.
+
+import bisect
+import math
+
+# running sums are recomputed from the window every so often so that the
+# floating point error of adding and removing samples does not accumulate.
+RESYNC_INTERVAL = 1024
+
+
+class RingBuffer:
+    def __init__(self, size):
+        self.size = size
+        self.items = [0.0] * size
+        self.head = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def push(self, value):
+        # returns the value pushed out of the buffer, None while not yet full
+        evicted = self.items[self.head] if self.count == self.size else None
+        self.items[self.head] = value
+        self.head = (self.head + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+        return evicted
+
+    def values(self):
+        # oldest first
+        if self.count < self.size:
+            return self.items[:self.count]
+        return self.items[self.head:] + self.items[:self.head]
+
+    def last(self):
+        return self.items[self.head - 1] if self.count else None
+
+
+class ThroughputPredictor:
+    def update(self, tput):
+        raise NotImplementedError
+
+    def predict(self):
+        raise NotImplementedError
+
+
+class LastSample(ThroughputPredictor):
+    '''
+    The throughput rule estimate: the next download goes as fast as the last one.
+    '''
+    def __init__(self):
+        self.tput = 0
+
+    def update(self, tput):
+        self.tput = tput
+
+    def predict(self):
+        return self.tput
+
+
+class HarmonicMean(ThroughputPredictor):
+    '''
+    Harmonic mean of the last window samples, zero samples are left out.
+    '''
+    def __init__(self, window=5):
+        self.samples = RingBuffer(window)
+        self.rev_sum = 0.0
+        self.rev_count = 0
+        self.updates = 0
+
+    def update(self, tput):
+        evicted = self.samples.push(tput)
+        if tput:
+            self.rev_sum += 1 / tput
+            self.rev_count += 1
+        if evicted:
+            self.rev_sum -= 1 / evicted
+            self.rev_count -= 1
+
+        self.updates += 1
+        if self.updates % RESYNC_INTERVAL == 0:
+            self.rev_sum = sum(1 / a for a in self.samples.values() if a)
+
+    def predict(self):
+        if self.rev_count == 0 or self.rev_sum <= 0:
+            return 0
+        return self.rev_count / self.rev_sum
+
+
+class RobustHarmonicMean(HarmonicMean):
+    '''
+    robust MPC: lower bound of the harmonic mean, discounted by the largest
+    relative prediction error over the last window predictions.
+    '''
+    def __init__(self, window=5):
+        super(RobustHarmonicMean, self).__init__(window)
+        self.errors = RingBuffer(window)
+        self.prev_pred = None
+
+    def update(self, tput):
+        super(RobustHarmonicMean, self).update(tput)
+        if self.prev_pred is not None and tput:
+            self.errors.push(abs(tput - self.prev_pred) / tput)
+
+    def predict(self):
+        max_error = max(self.errors.values()) if len(self.errors) else 0
+        self.prev_pred = super(RobustHarmonicMean, self).predict() / (1 + max_error)
+        return self.prev_pred
+
+
+class EWMA(ThroughputPredictor):
+    '''
+    Two exponentially weighted moving averages with half lives counted in
+    samples, the estimate is the lower of the two: the fast one reacts to drops,
+    the slow one keeps short spikes from being trusted. Both are corrected for
+    the bias towards zero of their initial value.
+    '''
+    def __init__(self, fast_half_life=3, slow_half_life=8):
+        self.fast_alpha = math.pow(0.5, 1 / fast_half_life)
+        self.slow_alpha = math.pow(0.5, 1 / slow_half_life)
+        self.fast = 0.0
+        self.slow = 0.0
+        self.fast_weight = 1.0
+        self.slow_weight = 1.0
+
+    def update(self, tput):
+        if not tput:
+            return
+        self.fast = self.fast_alpha * self.fast + (1 - self.fast_alpha) * tput
+        self.slow = self.slow_alpha * self.slow + (1 - self.slow_alpha) * tput
+        self.fast_weight *= self.fast_alpha
+        self.slow_weight *= self.slow_alpha
+
+    def predict(self):
+        if self.fast_weight == 1.0:
+            return 0
+        fast = self.fast / (1 - self.fast_weight)
+        slow = self.slow / (1 - self.slow_weight)
+        return min(fast, slow)
+
+
+class SlidingPercentile(ThroughputPredictor):
+    '''
+    Percentile of the last window samples, kept in a sorted window next to the
+    ring buffer so a prediction is an index lookup.
+    '''
+    def __init__(self, window=20, percentile=0.25):
+        self.samples = RingBuffer(window)
+        self.sorted = []
+        self.percentile = percentile
+
+    def update(self, tput):
+        evicted = self.samples.push(tput)
+        if evicted is not None:
+            del self.sorted[bisect.bisect_left(self.sorted, evicted)]
+        bisect.insort(self.sorted, tput)
+
+    def predict(self):
+        if not self.sorted:
+            return 0
+        return self.sorted[int(self.percentile * (len(self.sorted) - 1))]
+
+
+PREDICTORS = {
+    'last': LastSample,
+    'harmonic': HarmonicMean,
+    'robust': RobustHarmonicMean,
+    'ewma': EWMA,
+    'percentile': SlidingPercentile,
+}
+
+
+def make_predictor(name):
+    if name not in PREDICTORS:
+        raise ValueError("Unknown throughput predictor '%s', expected one of: %s" % (name, ', '.join(PREDICTORS)))
+    return PREDICTORS[name]()
@@ -0,0 +1,227 @@
+# Decision latency of the ABR rules.
+#
+# Builds synthetic manifests over a grid of segment and representation counts,
+# records the playerStats a simulated session feeds to the rules, replays them
+# through a fresh instance of every rule and reports the NextSegmentQualityIndex
+# latency percentiles and the memory allocated per decision. Results can be
+# saved as a JSON baseline and later runs compared against it.
+#
+# Latencies are also given relative to a fixed reference workload, timed
+# alternately with the decisions, and the comparison with a baseline is made
+# on those ratios. A baseline saved on one host then still applies on a faster
+# or slower one, or while the speed of a shared host drifts.
+
+import argparse
+import json
+import math
+import random
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import numpy as np
+
+from adaptive import Manifest, select_abr_algorithm
+from simulation.simulator import Simulator, load_trace
+
+DEFAULT_RULES = ['tputRule', 'Bola', 'BBA0', 'BBA2', 'MPC']
+DEFAULT_SEGMENTS = [300, 3000, 30000, 100000]
+DEFAULT_REPRESENTATIONS = [3, 6, 12]
+DEFAULT_TRACE = 'traces/4Glogs/report_bus_0001.json'
+# regressions smaller than this, in reference units, are timer noise
+DEFAULT_MIN_DELTA = 1.0
+
+
+def synthetic_manifest(segments, representations, seed=0):
+    # log spaced bitrates from 300 kbps to 20 Mbps, segment sizes varying
+    # around the nominal bitrate like VBR content, ascending within a segment
+    rng = random.Random(seed)
+    bitrates = [round(300 * math.pow(20000 / 300, i / max(representations - 1, 1))) for i in range(representations)]
+    sizes = []
+    for _ in range(segments):
+        complexity = rng.uniform(0.5, 1.6)
+        sizes.append(sorted(int(b * 125 * complexity * rng.uniform(0.95, 1.05)) for b in bitrates))
+    return Manifest.from_dict({
+        "start_number": 0,
+        "segment_duration_ms": "1",
+        "total_duration": segments,
+        "timescale": 1,
+        "total_segments": segments,
+        "total_representation": representations,
+        "bitrates_kbps": bitrates,
+        "resolutions": [str(i) for i in range(representations)],
+        "segment_size_bytes": sizes,
+    })
+
+
+class _Recorder:
+    # wraps a rule and keeps a copy of every playerStats it is asked about
+    def __init__(self, abr):
+        self.abr = abr
+        self.stats = []
+
+    def NextSegmentQualityIndex(self, playerStats):
+        self.stats.append(dict(playerStats))
+        return self.abr.NextSegmentQualityIndex(playerStats)
+
+
+def record_player_stats(manifest, trace, abr='BBA0', buffer_size=60):
+    recorder = _Recorder(make_rule(manifest, abr))
+    Simulator(manifest, recorder, trace, buffer_size).run()
+    return recorder.stats
+
+
+def make_rule(manifest, abr):
+    return select_abr_algorithm(manifest, SimpleNamespace(abr=abr, manifest_file=None))
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(int(p * len(sorted_values)), len(sorted_values) - 1)]
+
+
+_reference_array = np.arange(64, dtype=np.float64)
+
+
+def reference_workload():
+    # a fixed mix of interpreter and small numpy work, about what a cheap
+    # decision costs. The unit of the relative latencies.
+    total = 0.0
+    for i in range(32):
+        total += i * 0.5
+    return total + float(np.dot(_reference_array, _reference_array))
+
+
+def replay(manifest, abr, stats):
+    # (decision latencies, reference workload latencies) in ns of a fresh
+    # instance of the rule, each sorted
+    rule = make_rule(manifest, abr)
+    latencies = []
+    references = []
+    for s in stats:
+        start = time.perf_counter_ns()
+        reference_workload()
+        references.append(time.perf_counter_ns() - start)
+        start = time.perf_counter_ns()
+        rule.NextSegmentQualityIndex(dict(s))
+        latencies.append(time.perf_counter_ns() - start)
+    latencies.sort()
+    references.sort()
+    return latencies, references
+
+
+def bench_rule(manifest, abr, stats, repeat=5):
+    start = time.perf_counter()
+    make_rule(manifest, abr)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    # an untimed replay warms up the caches and lazily built state, then the
+    # best of repeat replays for each percentile
+    replay(manifest, abr, stats)
+    runs = [replay(manifest, abr, stats) for _ in range(repeat)]
+    latencies = runs[0][0]
+    p50, p90, p99, latest = (min(percentile(run, p) for run, _ in runs) / 1000 for p in (0.50, 0.90, 0.99, 1.0))
+    p50_rel, p99_rel = (min(percentile(run, p) / percentile(references, 0.50) for run, references in runs)
+                        for p in (0.50, 0.99))
+
+    # allocations on a second instance, tracing slows every allocation down
+    rule = make_rule(manifest, abr)
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    for s in stats:
+        rule.NextSegmentQualityIndex(dict(s))
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'build_ms': build_ms,
+        'decisions': len(latencies),
+        'p50_us': p50,
+        'p90_us': p90,
+        'p99_us': p99,
+        'max_us': latest,
+        'p50_rel': p50_rel,
+        'p99_rel': p99_rel,
+        'retained_bytes_per_decision': (after - before) / len(stats),
+        'peak_bytes': peak - before,
+    }
+
+
+def run(rules, segment_counts, representation_counts, trace_file, decisions, repeat=5):
+    trace = load_trace(trace_file)
+    results = {}
+    for segments in segment_counts:
+        for representations in representation_counts:
+            manifest = synthetic_manifest(segments, representations)
+            stats = record_player_stats(manifest, trace)
+            # spread the replayed decisions over the whole title
+            stride = max(1, len(stats) // decisions)
+            stats = stats[::stride][:decisions]
+            for abr in rules:
+                key = '%s/%d/%d' % (abr, segments, representations)
+                results[key] = bench_rule(manifest, abr, stats, repeat)
+                r = results[key]
+                print('{:<10} segments:{:>6} reps:{:>2}  build:{:>8.1f}ms  p50:{:>8.1f}us ({:>6.1f}x)  p90:{:>8.1f}us  '
+                      'p99:{:>8.1f}us ({:>6.1f}x)  retained:{:>7.1f}B/decision  peak:{:>9}B'.format(
+                          abr, segments, representations, r['build_ms'], r['p50_us'], r['p50_rel'], r['p90_us'],
+                          r['p99_us'], r['p99_rel'], r['retained_bytes_per_decision'], r['peak_bytes']))
+                sys.stdout.flush()
+    return results
+
+
+def compare(results, baseline, tolerance, tail_tolerance, min_delta=DEFAULT_MIN_DELTA):
+    # a regression is a p50 (p99) latency, relative to the reference workload,
+    # more than tolerance (tail_tolerance) and min_delta reference units above
+    # the baseline
+    regressions = []
+    for key, r in sorted(results.items()):
+        b = baseline.get(key)
+        if b is None:
+            continue
+        for metric, allowed in (('p50_rel', tolerance), ('p99_rel', tail_tolerance)):
+            if metric not in b:
+                continue
+            if b[metric] > 0 and r[metric] > b[metric] * (1 + allowed) and r[metric] - b[metric] > min_delta:
+                regressions.append('%s %s: %.2fx, baseline %.2fx (+%.0f%%)'
+                                   % (key, metric, r[metric], b[metric], (r[metric] / b[metric] - 1) * 100))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ABR decision latency benchmark")
+    parser.add_argument("--abr", type=str, nargs="+", default=DEFAULT_RULES, help="ABR rules to benchmark")
+    parser.add_argument("--segments", type=int, nargs="+", default=DEFAULT_SEGMENTS, help="segment counts")
+    parser.add_argument("--representations", type=int, nargs="+", default=DEFAULT_REPRESENTATIONS,
+                        help="representation counts")
+    parser.add_argument("--trace", type=str, default=DEFAULT_TRACE, help="trace the playerStats are recorded on")
+    parser.add_argument("--decisions", type=int, default=1000, help="decisions replayed per rule and manifest")
+    parser.add_argument("--repeat", type=int, default=5, help="timed replays per rule and manifest, the best is kept")
+    parser.add_argument("--save-baseline", type=str, help="write the results to this JSON file")
+    parser.add_argument("--baseline", type=str, help="compare against this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed p50 latency increase over the baseline")
+    parser.add_argument("--tail-tolerance", type=float, default=1.0,
+                        help="allowed p99 latency increase over the baseline")
+    parser.add_argument("--min-delta", type=float, default=DEFAULT_MIN_DELTA,
+                        help="smallest latency increase reported, in reference workload units")
+    args = parser.parse_args()
+
+    results = run(args.abr, args.segments, args.representations, args.trace, args.decisions, args.repeat)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.tail_tolerance, args.min_delta)
+        for r in regressions:
+            print('REGRESSION', r)
+        if regressions:
+            return 1
+        print('no regression against', args.baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+# Load time of a manifest stored as JSON versus the binary format.
+#
+# Writes synthetic manifests of growing length in both formats to a temporary
+# directory and times, for each, parsing the JSON into a dict, building a
+# Manifest from the JSON and opening the binary manifest, the latter two up to
+# and including a segment size lookup.
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from adaptive.manifest import Manifest
+from benchmarks.abr_latency import synthetic_manifest
+
+DEFAULT_SEGMENTS = [300, 10000, 100000, 1000000]
+
+
+def best_of(repeat, fn):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_manifest(directory, segments, representations, repeat):
+    manifest = synthetic_manifest(segments, representations)
+    json_file = os.path.join(directory, 'm_%d.json' % segments)
+    binary_file = os.path.join(directory, 'm_%d.bin' % segments)
+    manifest.save_json(json_file)
+    manifest.save_binary(binary_file)
+    last = segments - 1
+
+    def load_dict():
+        with open(json_file) as f:
+            json.load(f)['segment_size_bytes'][last][0]
+
+    return {
+        'json_bytes': os.path.getsize(json_file),
+        'binary_bytes': os.path.getsize(binary_file),
+        'json_dict_ms': best_of(repeat, load_dict) * 1000,
+        'json_manifest_ms': best_of(repeat, lambda: Manifest.load(json_file).segment_size(last, 0)) * 1000,
+        'binary_manifest_ms': best_of(repeat, lambda: Manifest.load(binary_file).segment_size(last, 0)) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manifest load time, JSON versus binary")
+    parser.add_argument("--segments", type=int, nargs="+", default=DEFAULT_SEGMENTS, help="segment counts")
+    parser.add_argument("--representations", type=int, default=12, help="representation count")
+    parser.add_argument("--repeat", type=int, default=5, help="loads per format, the fastest is reported")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for segments in args.segments:
+            r = bench_manifest(directory, segments, args.representations, args.repeat)
+            print('segments:{:>8}  json:{:>11}B {:>9.2f}ms (dict) {:>9.2f}ms (Manifest)  binary:{:>10}B {:>7.3f}ms'.format(
+                segments, r['json_bytes'], r['json_dict_ms'], r['json_manifest_ms'],
+                r['binary_bytes'], r['binary_manifest_ms']))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+# Throughput and QoE gained by pipelining segment requests.
+#
+# Simulates sessions on network traces with the round trip time raised by a
+# fixed amount, for several prefetch windows, and reports the aggregate
+# throughput of the link while requests are in flight next to the QoE.
+
+import argparse
+from glob import glob
+
+from adaptive.manifest import Manifest
+from simulation.simulator import NetworkPeriod, load_trace, simulate
+
+DEFAULT_TRACES = sorted(glob('traces/3Glogs/*.json'))[:10] + sorted(glob('traces/4Glogs/*.json'))[:10]
+
+
+def with_latency(periods, latency_ms):
+    return [NetworkPeriod(p.time, p.bandwidth, p.latency + latency_ms) for p in periods]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gain of pipelined segment requests on high RTT networks")
+    parser.add_argument("--manifest-file", type=str, default="htdocs/bbb_m.json", help="Path to the custom manifest file")
+    parser.add_argument("--traces", type=str, nargs="+", default=DEFAULT_TRACES, help="network trace files")
+    parser.add_argument("--abr", type=str, default="tputRule", help="ABR rule to run")
+    parser.add_argument("--prefetch", type=int, nargs="+", default=[1, 2, 4], help="prefetch windows")
+    parser.add_argument("--extra-latency", type=float, nargs="+", default=[0, 100, 300],
+                        help="latency in ms added to every period of the traces")
+    parser.add_argument("-b", "--buffer-size", type=float, default=30, help="buffer size for video playback")
+    args = parser.parse_args()
+
+    manifest = Manifest.load(args.manifest_file)
+    traces = [load_trace(t) for t in args.traces]
+    for latency in args.extra_latency:
+        baseline = None
+        for prefetch in args.prefetch:
+            tput = qoe = 0.0
+            for periods in traces:
+                perf = simulate(manifest, args.abr, with_latency(periods, latency), args.buffer_size,
+                                manifest_file=args.manifest_file, prefetch=prefetch)
+                tput += perf['tput_aggregate_kbps'] / len(traces)
+                qoe += perf['MPC_QOE'] / len(traces)
+            baseline = baseline or tput
+            print('extra latency:{:>5.0f}ms  prefetch:{:>2}  throughput:{:>9.1f}kbps ({:+.1%})  qoe:{:>14.1f}'.format(
+                latency, prefetch, tput, tput / baseline - 1, qoe))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# Event loop cost of the connection timers of QuicServer, with a loop handle
+# per connection or with the shared TimerWheel.
+#
+# Every connection is open but idle: once per --interval it receives a
+# keep-alive, which moves its timer to the ACK delay, and when that fires the
+# timer moves on to the idle timeout, as QuicFactorySocket.transmit() re-arms
+# it after aioquic's get_timer(). One callback every millisecond delivers the
+# keep-alives, spread evenly over the connections, in both modes.
+# Reports the CPU time of the loop per second, the best of --repeat runs, per
+# timer set or fired, how late the timers fired and the loop handles created
+# for them.
+
+import argparse
+import asyncio
+import time
+
+from protocol.h3.timer import TimerWheel
+
+MODES = ['call_at', 'wheel']
+ACK_DELAY = 0.025
+IDLE_TIMEOUT = 60.0
+
+
+class Connection:
+    __slots__ = ('loop', 'wheel', 'stats', 'timer', 'timer_at')
+
+    def __init__(self, loop, wheel, stats):
+        self.loop = loop
+        self.wheel = wheel
+        self.stats = stats
+        self.timer = None
+        self.timer_at = None
+
+    def packet_received(self):
+        self.rearm(self.loop.time() + ACK_DELAY)
+
+    def handle_timer(self):
+        now = self.loop.time()
+        self.stats['fired'] += 1
+        self.stats['late'] += max(now - self.timer_at, 0)
+        self.stats['max_late'] = max(self.stats['max_late'], now - self.timer_at)
+        self.timer = None
+        self.timer_at = None
+        self.rearm(now + IDLE_TIMEOUT)
+
+    def rearm(self, timer_at):
+        # the timer handling of QuicFactorySocket.transmit()
+        if self.wheel is not None:
+            if timer_at != self.timer_at:
+                self.wheel.schedule(self, timer_at, self.handle_timer)
+        else:
+            if self.timer is not None and self.timer_at != timer_at:
+                self.timer.cancel()
+                self.timer = None
+            if self.timer is None:
+                self.timer = self.loop.call_at(timer_at, self.handle_timer)
+                self.stats['handles'] += 1
+        self.timer_at = timer_at
+
+
+async def bench_mode(mode, connections, interval, duration):
+    loop = asyncio.get_event_loop()
+    wheel = TimerWheel(loop) if mode == 'wheel' else None
+    stats = {'fired': 0, 'late': 0.0, 'max_late': 0.0, 'handles': 0}
+    conns = [Connection(loop, wheel, stats) for _ in range(connections)]
+    for conn in conns:
+        conn.rearm(loop.time() + IDLE_TIMEOUT)
+
+    done = loop.create_future()
+    start = loop.time()
+    delivered = 0
+    cpu_start = time.process_time()
+
+    def deliver():
+        nonlocal delivered
+        elapsed = loop.time() - start
+        if elapsed >= duration:
+            done.set_result(None)
+            return
+        due = int(elapsed / interval * connections)
+        while delivered < due:
+            conns[delivered % connections].packet_received()
+            delivered += 1
+        loop.call_later(0.001, deliver)
+
+    deliver()
+    await done
+    cpu = time.process_time() - cpu_start
+
+    if wheel is not None:
+        stats['handles'] = wheel.handles
+        wheel.close()
+    for conn in conns:
+        if conn.timer is not None:
+            conn.timer.cancel()
+    return {
+        'cpu_ms_per_s': cpu / duration * 1000,
+        'cpu_us_per_timer': cpu / max(delivered + stats['fired'], 1) * 1e6,
+        'fired': stats['fired'],
+        'mean_late_ms': stats['late'] / max(stats['fired'], 1) * 1000,
+        'max_late_ms': stats['max_late'] * 1000,
+        'handles': stats['handles'],
+    }
+
+
+async def run(modes, connections, interval, duration, repeat):
+    for n in connections:
+        baseline = None
+        for mode in modes:
+            runs = [await bench_mode(mode, n, interval, duration) for _ in range(repeat)]
+            r = min(runs, key=lambda r: r['cpu_ms_per_s'])
+            baseline = baseline or r
+            print('connections:{:>6}  {:<8} {:>6.1f} CPU ms/s ({:+.0%})  {:>5.2f} CPU us/timer  {:>7} fired  '
+                  'late {:.2f} ms mean, {:.2f} ms max  {:>7} loop handles'.format(
+                      n, mode, r['cpu_ms_per_s'], r['cpu_ms_per_s'] / baseline['cpu_ms_per_s'] - 1,
+                      r['cpu_us_per_timer'], r['fired'], r['mean_late_ms'], r['max_late_ms'], r['handles']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the connection timers, loop handles or a timer wheel")
+    parser.add_argument("--mode", type=str, nargs="+", choices=MODES, default=MODES, help="timer implementations")
+    parser.add_argument("--connections", type=int, nargs="+", default=[1000, 10000], help="idle connections")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between keep-alives of a connection")
+    parser.add_argument("--duration", type=float, default=5, help="seconds per measurement")
+    parser.add_argument("--repeat", type=int, default=3, help="measurements per mode, the best is reported")
+    args = parser.parse_args()
+
+    asyncio.get_event_loop().run_until_complete(
+        run(args.mode, args.connections, args.interval, args.duration, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
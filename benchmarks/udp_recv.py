@@ -0,0 +1,127 @@
+# CPU cost of the UDP receive paths of QuicServer.
+#
+# A separate process sends bursts of full size datagrams from a number of
+# client sockets to a server socket on the loopback interface, at a fixed rate,
+# the way clients send ACKs and requests during a heavy download. The server
+# reads them the way QuicServer does: one datagram per wakeup through the
+# asyncio transport, or the rest of each burst with UdpBatchReceiver, by
+# recvfrom_into or by recvmmsg. Datagrams are grouped by client as they would
+# be by connection, and every group stands for one transmit.
+# Reports the datagrams received, the CPU time of the server per datagram and
+# the transmits per 1000 datagrams.
+
+import argparse
+import asyncio
+import multiprocessing
+import socket
+import time
+
+from protocol.h3.udp import UdpBatchReceiver
+
+MODES = ['transport', 'recvfrom', 'recvmmsg']
+
+
+def send(addr, connections, burst, size, rate, duration):
+    clients = [socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(connections)]
+    data = bytes(size)
+    interval = burst / rate
+    start = time.perf_counter()
+    next_burst = start
+    i = 0
+    while next_burst - start < duration:
+        for _ in range(burst):
+            clients[i % connections].sendto(data, addr)
+        i += 1
+        next_burst += interval
+        delay = next_burst - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    for client in clients:
+        client.close()
+
+
+class Server(asyncio.DatagramProtocol):
+    def __init__(self, mode):
+        self.mode = mode
+        self.receiver = None
+        self.datagrams = 0
+        self.transmits = 0
+
+    def connection_made(self, transport):
+        sock = transport.get_extra_info('socket')
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+        if self.mode != 'transport':
+            self.receiver = UdpBatchReceiver.create(transport, recvmmsg=self.mode == 'recvmmsg')
+
+    def datagram_received(self, data, addr):
+        if self.receiver is None:
+            self.datagrams += 1
+            self.transmits += 1
+            return
+        batches = {}
+        for data, addr in [(data, addr)] + self.receiver.receive():
+            batches.setdefault(addr, []).append(data)
+        self.datagrams += sum(len(b) for b in batches.values())
+        self.transmits += len(batches)
+
+
+async def bench_mode(mode, connections, burst, size, rate, duration):
+    loop = asyncio.get_event_loop()
+    transport, server = await loop.create_datagram_endpoint(lambda: Server(mode), local_addr=('127.0.0.1', 0))
+    if mode == 'recvmmsg' and not server.receiver.recvmmsg:
+        transport.close()
+        return None
+
+    sender = multiprocessing.Process(target=send, args=(transport.get_extra_info('sockname'), connections, burst,
+                                                        size, rate, duration))
+    cpu_start = time.process_time()
+    sender.start()
+    while sender.is_alive():
+        await asyncio.sleep(0.05)
+    # whatever is still queued
+    await asyncio.sleep(0.1)
+    cpu = time.process_time() - cpu_start
+    sender.join()
+
+    result = {
+        'received': server.datagrams / (rate * duration),
+        'us_per_datagram': cpu / max(server.datagrams, 1) * 1e6,
+        'transmits_per_1000': server.transmits / max(server.datagrams, 1) * 1000,
+    }
+    if server.receiver is not None:
+        server.receiver.close()
+    transport.close()
+    return result
+
+
+async def run(modes, connections, bursts, size, rate, duration):
+    for burst in bursts:
+        baseline = None
+        for mode in modes:
+            r = await bench_mode(mode, connections, burst, size, rate, duration)
+            if r is None:
+                print('burst:{:>3}  {:<10} not available here'.format(burst, mode))
+                continue
+            baseline = baseline or r
+            print('burst:{:>3}  {:<10} {:>6.1%} received  {:>6.2f} CPU us/datagram ({:+.0%})  '
+                  '{:>6.0f} transmits/1000 datagrams'.format(
+                      burst, mode, r['received'], r['us_per_datagram'],
+                      r['us_per_datagram'] / baseline['us_per_datagram'] - 1, r['transmits_per_1000']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback benchmark of the batched UDP receive paths")
+    parser.add_argument("--mode", type=str, nargs="+", choices=MODES, default=MODES, help="receive paths to compare")
+    parser.add_argument("--connections", type=int, default=4, help="client sockets sending")
+    parser.add_argument("--burst", type=int, nargs="+", default=[1, 8, 32], help="datagrams sent back to back")
+    parser.add_argument("--size", type=int, default=1200, help="datagram size in bytes")
+    parser.add_argument("--rate", type=int, default=50000, help="datagrams per second sent")
+    parser.add_argument("--duration", type=float, default=2, help="seconds per measurement")
+    args = parser.parse_args()
+
+    asyncio.get_event_loop().run_until_complete(
+        run(args.mode, args.connections, args.burst, args.size, args.rate, args.duration))
+
+
+if __name__ == "__main__":
+    main()
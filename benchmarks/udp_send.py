@@ -0,0 +1,93 @@
+# Packet rate and CPU cost of the UDP send paths of QuicFactorySocket.
+#
+# Sends bursts of full size datagrams to a socket on the loopback interface,
+# the way transmit() hands them over after a burst of stream data, through
+# the asyncio transport one sendto at a time, with sendmmsg, with UDP GSO and
+# with both.
+# Reports datagrams per second, throughput and the CPU time of the sender per
+# Gbit sent. Nothing reads the receiving socket, so only the sender is timed.
+
+import argparse
+import asyncio
+import socket
+import time
+
+from protocol.h3.udp import UdpBatchSender
+
+MODES = ['sendto', 'sendmmsg', 'gso', 'gso+sendmmsg']
+
+
+async def bench_mode(mode, burst, size, duration):
+    loop = asyncio.get_event_loop()
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    transport, _ = await loop.create_datagram_endpoint(asyncio.DatagramProtocol, local_addr=('127.0.0.1', 0))
+    addr = receiver.getsockname()
+    datagrams = [(bytes([i % 256]) * size, addr) for i in range(burst)]
+
+    sender = None
+    if mode != 'sendto':
+        sender = UdpBatchSender.create(transport, gso='gso' in mode, sendmmsg='sendmmsg' in mode)
+        if sender is None or sender.gso != ('gso' in mode) or sender.sendmmsg != ('sendmmsg' in mode):
+            transport.close()
+            receiver.close()
+            return None
+
+    sent = 0
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    while time.perf_counter() - start < duration:
+        for _ in range(100):
+            if sender is not None:
+                sender.send(datagrams)
+            else:
+                for data, a in datagrams:
+                    transport.sendto(data, a)
+        sent += 100 * burst
+        # let the transport flush anything it had to queue
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+
+    result = {
+        'pps': sent / elapsed,
+        'gbps': sent * size * 8 / elapsed / 1e9,
+        'cpu_s_per_gbit': cpu / (sent * size * 8 / 1e9),
+        'syscalls_per_burst': sender.syscalls / (sent / burst) if sender is not None else burst,
+        'fallbacks': sender.fallbacks if sender is not None else 0,
+    }
+    if sender is not None:
+        sender.close()
+    transport.close()
+    receiver.close()
+    return result
+
+
+async def run(modes, bursts, size, duration):
+    for burst in bursts:
+        baseline = None
+        for mode in modes:
+            r = await bench_mode(mode, burst, size, duration)
+            if r is None:
+                print('burst:{:>3}  {:<13} not available here'.format(burst, mode))
+                continue
+            baseline = baseline or r
+            print('burst:{:>3}  {:<13} {:>10.0f} datagrams/s ({:+.0%})  {:>6.2f} Gbit/s  {:>6.3f} CPU s/Gbit  '
+                  '{:>5.1f} syscalls/burst  {} via transport'.format(
+                      burst, mode, r['pps'], r['pps'] / baseline['pps'] - 1, r['gbps'], r['cpu_s_per_gbit'],
+                      r['syscalls_per_burst'], r['fallbacks']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback benchmark of the batched UDP send paths")
+    parser.add_argument("--mode", type=str, nargs="+", choices=MODES, default=MODES, help="send paths to compare")
+    parser.add_argument("--burst", type=int, nargs="+", default=[1, 8, 32], help="datagrams per transmit")
+    parser.add_argument("--size", type=int, default=1200, help="datagram size in bytes")
+    parser.add_argument("--duration", type=float, default=2, help="seconds per measurement")
+    args = parser.parse_args()
+
+    asyncio.get_event_loop().run_until_complete(run(args.mode, args.burst, args.size, args.duration))
+
+
+if __name__ == "__main__":
+    main()
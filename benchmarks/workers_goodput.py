@@ -0,0 +1,91 @@
+# Aggregate goodput of server.py on loopback against its number of workers.
+#
+# For each worker count, starts server.py with --workers, then --clients
+# client processes, each with its own QUIC connection downloading /<size>
+# from the demo app again and again for --duration seconds. Reports the bytes
+# of response body all the clients received per second together, and the
+# speed-up over the first worker count. The clients share the machine with the
+# server: scaling can only show with more cores than workers plus busy clients.
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import ssl
+import subprocess
+import sys
+import time
+from typing import cast
+
+from aioquic.h3.connection import H3_ALPN
+from aioquic.quic.configuration import QuicConfiguration
+
+from clients.h3_client import HttpClient
+from protocol.h3.client import connect
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def download(port, size, start, duration):
+    # bytes of response body received between start and start + duration
+    configuration = QuicConfiguration(is_client=True, alpn_protocols=H3_ALPN)
+    configuration.verify_mode = ssl.CERT_NONE
+    url = 'https://localhost:{}/{}'.format(port, size)
+    received = 0
+    async with connect('localhost', port, configuration=configuration, create_protocol=HttpClient) as client:
+        client = cast(HttpClient, client)
+        await asyncio.sleep(max(start - time.time(), 0))
+        end = start + duration
+        while time.time() < end:
+            async for chunk in client.stream(url):
+                if time.time() >= end:
+                    break
+                received += len(chunk.data)
+    return received
+
+
+def run_client(port, size, start, duration):
+    return asyncio.new_event_loop().run_until_complete(download(port, size, start, duration))
+
+
+def bench_workers(workers, args):
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'server.py'), '--port', str(args.port), '--workers', str(workers),
+         '-c', args.certificate, '-k', args.private_key] + args.server_args,
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(args.startup)
+        start = time.time() + args.startup
+        with multiprocessing.Pool(args.clients) as pool:
+            received = pool.starmap(run_client, [(args.port, args.size, start, args.duration)] * args.clients)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+    return sum(received) * 8 / args.duration / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback goodput of server.py with several worker processes")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="worker counts to compare")
+    parser.add_argument("--clients", type=int, default=8, help="client processes, one connection each")
+    parser.add_argument("--size", type=int, default=1000000, help="bytes per response")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per measurement")
+    parser.add_argument("--port", type=int, default=4455, help="port of the server")
+    parser.add_argument("--startup", type=float, default=3, help="seconds to wait for the server and the clients")
+    parser.add_argument("-c", "--certificate", type=str, default=os.path.join(ROOT, 'tests', 'ssl_cert.pem'))
+    parser.add_argument("-k", "--private-key", type=str, default=os.path.join(ROOT, 'tests', 'ssl_key.pem'))
+    parser.add_argument("--server-args", type=str, nargs=argparse.REMAINDER, default=[],
+                        help="further options of server.py, e.g. --batch-send")
+    args = parser.parse_args()
+
+    print('{} cores'.format(os.cpu_count()))
+    baseline = None
+    for workers in args.workers:
+        goodput = bench_workers(workers, args)
+        baseline = baseline or goodput
+        print('workers:{:>3}  {:>8.1f} Mbit/s  {:>5.2f}x'.format(workers, goodput, goodput / baseline))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,22 @@
 import asyncio
 import logging
 import json
-import time
+import multiprocessing
 import os
 from glob import glob
 from pprint import pformat
 
-from collections import namedtuple
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from queue import Queue
 
 from aioquic.quic.configuration import QuicConfiguration
 from protocol.h3.socketFactory import QuicFactorySocket
-from clients.h3_client import perform_http_request, process_http_pushes
+from clients.decoder import decode_segment
+from clients.disk_writer import DiskWriter
+from clients.h3_client import RequestProgress, ResponseBuffer, SharedResponseBuffer, perform_http_request, process_http_pushes
 
-from adaptive.abr import BasicABR
-from adaptive.mpc import MPC
-from adaptive.bola import Bola
-from adaptive.BBA0 import BBA0
-from adaptive.BBA2 import BBA2
+from adaptive import Manifest, select_abr_algorithm
 
 import config
 
@@ -28,6 +27,18 @@ adaptiveInfo = namedtuple("AdaptiveInfo",
 downloadInfo = namedtuple("DownloadInfo",
                           'index file_name url quality resolution size downloaded time')
 NetworkPeriod = namedtuple('NetworkPeriod', 'time bandwidth latency')
+# buffer is the ResponseBuffer of the segment in memory mode, freed with the
+# request unless the segment reaches the decode stage
+inflightRequest = namedtuple("InflightRequest",
+                             'segment quality resolution task progress size buffer')
+# what the decode stage gets: the ResponseBuffer holding a segment in memory
+# mode, the files it was written to otherwise, and when it was downloaded
+segmentData = namedtuple("SegmentData", 'index name resolution data files time')
+
+# download abandonment: how often requests in flight are checked, in s, and
+# how long a request runs before its throughput is trusted to judge it
+ABANDON_CHECK_INTERVAL = 0.25
+ABANDON_MIN_ELAPSED = 0.5
 
 
 def segment_download_info(manifest, fname, size, idx, url, quality, resolution, time):
@@ -37,22 +48,6 @@ def segment_download_info(manifest, fname, size, idx, url, quality, resolution,
         return downloadInfo(index=idx, file_name=fname, url=url, quality=quality, resolution=resolution, size=size, downloaded=size, time=time)
 
 
-def select_abr_algorithm(manifest_data, args):
-	if args.abr == "BBA0":
-		return BBA0(manifest_data)
-	elif args.abr == 'Bola':
-		return Bola(manifest_data)
-	elif args.abr == 'tputRule':
-		return BasicABR(manifest_data)
-	elif args.abr == 'MPC':
-		return MPC(manifest_data)
-	elif args.abr == 'BBA2':
-		return BBA2(manifest_data)
-	else:
-		logger.error("Error!! No right rule specified")
-		return
-
-
 class DashClient:
 	def __init__(self, protocol: QuicFactorySocket, args):
 		self.protocol = protocol
@@ -60,7 +55,11 @@ class DashClient:
 		self.manifest_data = None
 		self.latest_tput = 0
 
+		# times are taken on the monotonic clock of the loop
+		self.loop = asyncio.get_event_loop()
 		self.lock = asyncio.Lock()
+		# notified by playback whenever it takes a segment out of the buffer
+		self.bufferChanged = asyncio.Condition(self.lock)
 		self.totalBuffer = args.buffer_size
 		self.currBuffer = 0
 		self.abr_algorithm = None
@@ -68,9 +67,25 @@ class DashClient:
 
 		self.lastDownloadSize = 0
 		self.lastDownloadTime = 0
+		self.prefetch = args.prefetch
+		self.abandon = not args.no_abandon
+		self.inMemory = args.in_memory
+		# responses go to disk off the loop. Segments and pushes are not written
+		# at all with --no-write, manifests always are as they are read back.
+		self.writer = DiskWriter()
+		self.segmentOutputDir = None if args.no_write else args.output_dir
+		# segments are decoded in worker processes, up to decodeWorkers at once,
+		# or on a thread of the player with none. See decodeExecutor().
+		self.decodeWorkers = args.decode_workers
+		self.decodePool = None
 		self.segmentQueue = asyncio.Queue()
 		self.frameQueue = asyncio.Queue()
 
+		# live manifests: set by refresh_manifest when new segments are published
+		self.manifestUrl = None
+		self.segmentsPublished = asyncio.Event()
+		self.downloadComplete = False
+
 		self.perf_parameters = {}
 		self.perf_parameters['startup_delay'] = 0
 		self.perf_parameters['total_time_elapsed'] = 0
@@ -82,6 +97,19 @@ class DashClient:
 		self.perf_parameters['avg_bitrate_change'] = 0.0
 		self.perf_parameters['rebuffer_count'] = 0
 		self.perf_parameters['tput_observed'] = []
+		self.perf_parameters['abandon_count'] = 0
+		self.perf_parameters['abandoned_bytes'] = 0
+		self.perf_parameters['abandonments'] = []
+		# live: segments that left the window before they could be requested
+		self.perf_parameters['live_skipped'] = 0
+		# (segment, decode time, queueing delay) in s, the delay being the rest
+		# of the time from download to decoded
+		self.perf_parameters['decode_latency'] = []
+
+		# (completion time, bytes) of recent responses, for windowThroughput
+		self.completed = deque()
+		self.downloadedBytes = 0
+		self.busyTime = 0
 
 	async def download_manifest(self) -> None:
 		#TODO: Cleanup: globally intakes a list of urls, while here
@@ -93,30 +121,64 @@ class DashClient:
 										url=self.args.urls[0],
 										data=self.args.data,
 										include=False,
-										output_dir=self.args.output_dir)
+										output_dir=self.args.output_dir,
+										writer=self.writer)
 
+		self.manifestUrl = self.args.urls[0]
 		self.baseUrl, self.filename = os.path.split(self.args.urls[0])
-		self.manifest_data = json.load(open(config.ROOT_PATH + ".cache/" + self.filename))
+		self.manifest_data = Manifest.load(config.ROOT_PATH + ".cache/" + self.filename)
 		self.lastDownloadSize = res[0]
-		self.latest_tput = res[1]
+		self.latest_tput = res[0] * 8 / 1000 / res[2]
 		self.lastDownloadTime = res[2]
 
 	async def dash_client_set_config(self) -> None:
 		logger.info("DASH client initialization in process")
 		await self.download_manifest()
-		process_http_pushes(client=self.protocol, include=self.args.include, output_dir=self.args.output_dir)
+		process_http_pushes(client=self.protocol, include=self.args.include, output_dir=self.segmentOutputDir, writer=self.writer)
 		self.abr_algorithm = select_abr_algorithm(self.manifest_data, self.args)
-		self.currentSegment = self.manifest_data['start_number']
+		if self.manifest_data.live:
+			# live: segments are counted from the first one of the window joined,
+			# as the rows of the manifest
+			self.currentSegment = 0
+		else:
+			self.currentSegment = self.manifest_data.start_number
 		self.totalSegments = self.getTotalSegments()
 
+	async def refresh_manifest(self) -> None:
+		# live manifests: once every segment duration, asks for the segments
+		# published since the last update and hands their sizes to the ABR rule
+		while not self.downloadComplete:
+			await asyncio.sleep(self.manifest_data.segment_duration)
+			await perform_http_request(client=self.protocol,
+									url=self.manifestUrl + "?since=" + str(self.manifest_data.sequence),
+									data=None,
+									include=False,
+									output_dir=self.args.output_dir,
+									writer=self.writer)
+			with open(config.ROOT_PATH + ".cache/" + self.filename) as f:
+				update = json.load(f)
+			segment_sizes = self.manifest_data.apply_update(update)
+			if self.currentSegment < self.manifest_data.window_start:
+				# fell behind the window, the segments left out of it are skipped
+				logger.warning("Live manifest: segments %d to %d left the window before they were requested",
+							   self.currentSegment, self.manifest_data.window_start - 1)
+				self.perf_parameters['live_skipped'] += self.manifest_data.window_start - self.currentSegment
+				self.currentSegment = self.manifest_data.window_start
+
+			if len(segment_sizes):
+				self.abr_algorithm.extendSegments(segment_sizes)
+				self.totalSegments = self.getTotalSegments()
+				logger.info("Live manifest update %d: %d new segments", self.manifest_data.sequence, len(segment_sizes))
+				self.segmentsPublished.set()
+
 	def getTotalSegments(self):
-		return self.manifest_data['total_segments']
+		return self.manifest_data.total_segments
 
 	def getDuration(self):
-		return self.manifest_data['total_duration']
+		return self.manifest_data.total_duration
 
 	def getCorrespondingBitrateIndex(self, bitrate):
-		for i, b in enumerate(self.manifest_data['bitrates_kbps']):
+		for i, b in enumerate(self.manifest_data.bitrates_kbps):
 			if b == bitrate:
 				return i + 1
 		return -1
@@ -125,91 +187,239 @@ class DashClient:
 		# returns throughput value of last segment downloaded in kbps
 		return self.latest_tput
 	
-	async def fetchNextSegment(self, segment_list, bitrate = 0):
-		if not bitrate:
-			return
-
-		segment_Duration = 0
-
-		for i, b in enumerate(self.manifest_data['bitrates_kbps']):
-			if b == bitrate:
-				segment_Duration = int(self.manifest_data['segment_duration_ms']) / int(self.manifest_data['timescale'])
-				break
+	def segmentFiles(self, segment, resolution):
+		return "htdocs/dash/" + resolution + "/out/frame-" + str(segment) + "-" + resolution + "-*"
+
+	def requestSegment(self, segment, quality):
+		# starts downloading a segment, returns its inflightRequest
+		resolution = self.manifest_data.resolutions[quality]
+		# a live row stands for a segment of the source the channel loops over
+		fName = self.segmentFiles(self.manifest_data.source_segment(segment), resolution)
+		# the size the ABR rule planned with, the files only past the manifest
+		if segment < len(self.manifest_data):
+			size = self.manifest_data.segment_size(segment, quality)
+		else:
+			size = sum(os.stat(f).st_size for f in glob(fName))
+		progress = RequestProgress()
+		buffer = None
+		if self.inMemory:
+			# a segment is only held from its download to its playback. The
+			# decode workers read it from shared memory.
+			buffer = SharedResponseBuffer(size) if self.decodeWorkers else ResponseBuffer(size)
+		task = asyncio.ensure_future(self.fetchSegment(fName, progress, buffer))
+		if buffer is not None:
+			task.add_done_callback(lambda task: self.releaseBuffer(task, buffer))
+		return inflightRequest(segment, quality, resolution, task, progress, size, buffer)
+
+	def releaseBuffer(self, task, buffer):
+		# frees the buffer of a request cancelled, even before it started,
+		# failed or with nothing to download
+		if task.cancelled() or task.exception() is not None or task.result() is None:
+			buffer.close()
+
+	def checkAbandonment(self, inflight, currBuff):
+		# abandons the requests projected to complete after the buffer runs dry
+		# and requests their segment again at the highest quality that would not
+		now = self.loop.time()
+		segment_Duration = self.manifest_data.segment_duration
+		for i, request in enumerate(inflight):
+			progress = request.progress
+			if request.quality == 0 or request.task.done() or progress.started is None or not progress.received:
+				continue
+			elapsed = now - progress.started
+			if elapsed < ABANDON_MIN_ELAPSED:
+				continue
+
+			# time before the segment is due, the segments ahead of it included
+			budget = currBuff + i * segment_Duration
+			rate = progress.received / elapsed # bytes per s
+			if (request.size - progress.received) / rate <= budget:
+				continue
+
+			quality = 0
+			for q in range(request.quality - 1, 0, -1):
+				if self.manifest_data.segment_size(request.segment, q) / rate <= budget:
+					quality = q
+					break
 
+			self.protocol.cancel_request(progress)
+			request.task.cancel()
+			logger.info("Abandoned segment %d at quality %d after %d of %d bytes, requesting quality %d",
+						request.segment, request.quality, progress.received, request.size, quality)
+			self.perf_parameters['abandon_count'] += 1
+			self.perf_parameters['abandoned_bytes'] += progress.received
+			self.perf_parameters['abandonments'].append((request.segment + 1, request.quality, quality, progress.received, request.size))
+			inflight[i] = self.requestSegment(request.segment, quality)
+			if i == len(inflight) - 1:
+				# the latest decision, the next one starts from the quality downloaded
+				self.abr_algorithm.replaceLastQuality(quality)
+
+	async def fetchSegment(self, segment_list, progress=None, buffer=None):
+		# downloads the frames of one segment in turn, into buffer when given.
+		# Returns (file name, url, bytes, throughput, request time, elapsed) of
+		# the last one, the buffer and the files written, None when there is
+		# nothing to download. The files are named after the frames, whose
+		# names hold the segment index and resolution: the urls only give the
+		# size, which other segments can share.
+		result = None
+		files = []
 		for fname in sorted(glob(segment_list)):
-			_, self.segment_baseName = fname.rsplit('/', 1)
-			self.args.urls[0] = self.baseUrl.rstrip('manifest') + str(os.stat(fname).st_size)
-			start = time.time()
+			_, baseName = fname.rsplit('/', 1)
+			url = self.baseUrl.rstrip('manifest') + str(os.stat(fname).st_size)
+			start = self.loop.time()
 
 			res = await perform_http_request(client=self.protocol,
-											url=self.args.urls[0],
+											url=url,
 											data=self.args.data,
 											include=self.args.include,
-											output_dir=self.args.output_dir)
-
-			elapsed = time.time() - start
-
-		data = res[0]
-		if data is not None:
-			self.lastDownloadTime = elapsed
-			self.lastDownloadSize = data
-			self.latest_tput =  res[1]
-
-			await self.segmentQueue.put(self.segment_baseName)
-
-			# QOE parameters update
-			self.perf_parameters['bitrate_change'].append((self.currentSegment + 1,  bitrate))
-			self.perf_parameters['tput_observed'].append((self.currentSegment + 1,  res[1]))
-			self.perf_parameters['avg_bitrate'] += bitrate
-			self.perf_parameters['avg_bitrate_change'] += abs(bitrate - self.perf_parameters['prev_rate'])
-
-			if not self.perf_parameters['prev_rate'] or self.perf_parameters['prev_rate'] != bitrate:
-				self.perf_parameters['prev_rate'] = bitrate
-				self.perf_parameters['change_count'] += 1
-
-			self.currentSegment += 1
-			async with self.lock:
-					self.currBuffer += segment_Duration
-
-			ret = True
-		else:
+											output_dir=self.segmentOutputDir,
+											progress=progress,
+											buffer=buffer,
+											writer=self.writer,
+											output_name=baseName)
+
+			if buffer is None and self.segmentOutputDir is not None:
+				files.append(os.path.join(self.segmentOutputDir, baseName))
+			result = (baseName, url, res[0], res[1], start, self.loop.time() - start, buffer, files)
+		return result
+
+	def windowThroughput(self, requested, octets):
+		# throughput in kbps of the connection over the lifetime of the request
+		# just completed, the responses of the other requests in flight received
+		# meanwhile included. The same as the throughput of the request alone
+		# when requests are not pipelined.
+		now = self.loop.time()
+		self.completed.append((now, octets))
+		while self.completed[0][0] <= requested:
+			self.completed.popleft()
+		return sum(o for _, o in self.completed) * 8 / 1000 / (now - requested)
+
+	async def segmentDownloaded(self, segment, quality, resolution, result) -> bool:
+		# bookkeeping of a downloaded segment, called in segment order
+		if result is None:
 			logger.fatal("Error: downloaded segment is none!! Playback will stop shortly")
-			ret = False
-		return ret
+			return False
+
+		self.segment_baseName, url, octets, tput, requested, elapsed, data, files = result
+		self.lastDownloadTime = elapsed
+		self.lastDownloadSize = octets
+		self.latest_tput = self.windowThroughput(requested, octets)
+		self.downloadedBytes += octets
+
+		await self.segmentQueue.put(segmentData(segment + 1, self.segment_baseName, resolution, data, files, self.loop.time()))
+
+		# QOE parameters update
+		self.perf_parameters['bitrate_change'].append((segment + 1,  quality))
+		# kbps, like every throughput the ABR rules and the simulator see
+		self.perf_parameters['tput_observed'].append((segment + 1,  tput * 1000))
+		self.perf_parameters['avg_bitrate'] += quality
+		self.perf_parameters['avg_bitrate_change'] += abs(quality - self.perf_parameters['prev_rate'])
+
+		# a switch is a change of quality from the previous segment
+		bitrate_change = self.perf_parameters['bitrate_change']
+		if len(bitrate_change) > 1 and bitrate_change[-2][1] != quality:
+			self.perf_parameters['change_count'] += 1
+		self.perf_parameters['prev_rate'] = quality
+
+		async with self.lock:
+			self.currBuffer += self.manifest_data.segment_duration
+
+		dp = segment_download_info(self.manifest_data, self.segment_baseName, octets, segment, url, quality, resolution, elapsed)
+		logger.info(dp)
+		return True
+
+	async def waitForRoom(self, inflight_count) -> None:
+		# returns once the buffer has room for one more segment besides the
+		# inflight_count ones being downloaded
+		segment_Duration = self.manifest_data.segment_duration
+		async with self.bufferChanged:
+			await self.bufferChanged.wait_for(
+				lambda: self.totalBuffer - self.currBuffer - inflight_count * segment_Duration >= segment_Duration)
 
 	async def download_segment(self) -> None:
 		if config.NUM_SERVER_PUSHED_FRAMES is not None:
 			self.currentSegment = config.NUM_SERVER_PUSHED_FRAMES + 1
 			for i in range(1, config.NUM_SERVER_PUSHED_FRAMES + 1):
-				await self.segmentQueue.put("Frame-pushed-" + str(i) + ".ppm")
+				await self.segmentQueue.put(segmentData(i, "Frame-pushed-" + str(i) + ".ppm", None, None, None, self.loop.time()))
 		else:
 			self.currentSegment += 1
 
-		while self.currentSegment <= 4:
+		# up to prefetch requests in flight on separate streams of the
+		# connection, oldest first, as inflightRequest. currentSegment is the
+		# next segment to request.
+		inflight = deque()
+		busy_since = 0
+		while self.currentSegment <= 4 or inflight:
 			async with self.lock:
 				currBuff = self.currBuffer
 
-			segment_Duration = int(self.manifest_data['segment_duration_ms']) / int(self.manifest_data['timescale'])
+			segment_Duration = self.manifest_data.segment_duration
+			# segments in flight count as buffered already
+			room = self.totalBuffer - currBuff - len(inflight) * segment_Duration >= segment_Duration
+			published = not self.manifest_data.live or self.currentSegment + 1 < len(self.manifest_data)
 
-			playback_stats = {}
-			playback_stats["lastTput_kbps"] = self.latest_segment_Throughput_kbps()
-			playback_stats["currBuffer"] = currBuff
-			playback_stats["segment_Idx"] = self.currentSegment + 1
+			if self.currentSegment <= 4 and len(inflight) < self.prefetch and room and published:
+				playback_stats = {}
+				playback_stats["lastTput_kbps"] = self.latest_segment_Throughput_kbps()
+				playback_stats["currBuffer"] = currBuff
+				playback_stats["segment_Idx"] = self.currentSegment + 1
 
-			logger.info(pformat(playback_stats))
+				logger.info(pformat(playback_stats))
 
-			if self.totalBuffer - currBuff >= segment_Duration:
 				rateNext = self.abr_algorithm.NextSegmentQualityIndex(playback_stats)
-				segment_resolution = self.manifest_data['resolutions'][rateNext]
-				fName = "htdocs/dash/" + segment_resolution + "/out/frame-" + str(self.currentSegment) + "-" + segment_resolution + "-*"
-				if await self.fetchNextSegment(fName, rateNext):
-					dp = segment_download_info(self.manifest_data, self.segment_baseName, self.lastDownloadSize, self.currentSegment, self.args.urls, rateNext, segment_resolution, self.lastDownloadTime)
-					logger.info(dp)
+				if not inflight:
+					busy_since = self.loop.time()
+				inflight.append(self.requestSegment(self.currentSegment, rateNext))
+				self.currentSegment += 1
+				continue
+
+			if not inflight:
+				if not published:
+					# caught up with the live edge, wait for the next manifest update
+					self.segmentsPublished.clear()
+					await self.segmentsPublished.wait()
 				else:
-					break
-			else:
-				asyncio.sleep(1)
+					await self.waitForRoom(0)
+				continue
+
+			# wake up on the oldest request completing or, with a request slot
+			# free, on playback making room for one more segment
+			waiters = [inflight[0].task]
+			if len(inflight) < self.prefetch and self.currentSegment <= 4:
+				if not published:
+					self.segmentsPublished.clear()
+					waiters.append(asyncio.ensure_future(self.segmentsPublished.wait()))
+				else:
+					waiters.append(asyncio.ensure_future(self.waitForRoom(len(inflight))))
+			timeout = None
+			if self.abandon and self.perf_parameters['bitrate_change']:
+				# once playback can start, keep an eye on the progress of every request
+				timeout = ABANDON_CHECK_INTERVAL
+			await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+			for waiter in waiters[1:]:
+				waiter.cancel()
+
+			if self.abandon and self.perf_parameters['bitrate_change']:
+				async with self.lock:
+					currBuff = self.currBuffer
+				self.checkAbandonment(inflight, currBuff)
+			if not inflight[0].task.done():
+				continue
+			request = inflight.popleft()
+
+			if not await self.segmentDownloaded(request.segment, request.quality, request.resolution, request.task.result()):
+				for r in inflight:
+					if not r.task.cancel() and r.buffer is not None:
+						# downloaded already, never to be decoded
+						r.buffer.close()
+				break
+			if not inflight:
+				self.busyTime += self.loop.time() - busy_since
 
+		if self.busyTime:
+			# kbps while at least one request was in flight
+			self.perf_parameters['tput_aggregate_kbps'] = self.downloadedBytes * 8 / self.busyTime / 1000
+		self.downloadComplete = True
 		await self.segmentQueue.put("Download complete")
 		logger.info("All the segments have been downloaded")
 
@@ -217,11 +427,16 @@ class DashClient:
 	async def playback_frames(self) -> None:
 		#Flag to mark whether placback has started or not.
 		has_playback_started = False
+		segment_Duration = self.manifest_data.segment_duration
+		# end of the segment being played, on the loop clock
+		playing_until = None
 		while True:
-			await asyncio.sleep(1)
-			rebuffer_start = time.time()
+			if playing_until is not None:
+				await asyncio.sleep(playing_until - self.loop.time())
+			rebuffer_start = self.loop.time()
 			frame = await self.frameQueue.get()
-			rebuffer_elapsed = time.time() - rebuffer_start
+			now = self.loop.time()
+			rebuffer_elapsed = now - rebuffer_start
 
 			if frame == "Decoding complete":
 				logger.info("All the segments have been played back")
@@ -229,38 +444,86 @@ class DashClient:
 
 			if not has_playback_started:
 				has_playback_started = True
-				self.perf_parameters['startup_delay'] = time.time()
+				self.perf_parameters['startup_delay'] = now
 			else:
 				self.perf_parameters['rebuffer_time'] += rebuffer_elapsed
 
 			if rebuffer_elapsed > 0.0001:
 				logger.info('rebuffer_time:{}'.format(rebuffer_elapsed))
 				self.perf_parameters['rebuffer_count'] += 1
-			async with self.lock:
-				self.currBuffer -= 2
-			logger.info("Played segments: {}".format(frame))
-
-	#emulate decoding the frame scenario
-	async def decode_frames(self) -> None:
+			# segments play back to back unless playback stalled waiting for this one
+			playing_until = (now if playing_until is None or rebuffer_elapsed > 0.0001 else playing_until) + segment_Duration
+			async with self.bufferChanged:
+				self.currBuffer -= segment_Duration
+				self.bufferChanged.notify_all()
+			logger.info("Played segments: {}".format(frame.name))
+
+	def decodeExecutor(self):
+		# the worker processes, started on the first segment to decode, or the
+		# default thread pool of the loop without any
+		if self.decodeWorkers and self.decodePool is None:
+			self.decodePool = ProcessPoolExecutor(max_workers=self.decodeWorkers, mp_context=multiprocessing.get_context("spawn"))
+		return self.decodePool
+
+	async def submit_decodes(self, decoding) -> None:
+		# hands the downloaded segments to the decode pool, in order
 		while True:
-			await asyncio.sleep(1)
 			segment = await self.segmentQueue.get()
 			if segment == "Download complete":
-				logger.info("All the segments have been decoded")
-				await self.frameQueue.put("Decoding complete")
+				await decoding.put(None)
 				break
 
-			logger.info("Decoded segments: {}".format(segment))
+			cost = config.DECODE_COST_MS.get(segment.resolution, 0) / 1000
+			# a segment held in memory is not copied: the workers attach to its
+			# shared memory, a thread of the player reads the buffer itself
+			data = shared = None
+			if segment.data is not None and self.decodeWorkers:
+				shared = segment.data.handle
+			elif segment.data is not None:
+				data = segment.data.data
+			future = self.loop.run_in_executor(self.decodeExecutor(), decode_segment, data, segment.files, cost, shared)
+			await decoding.put((segment, future))
+
+	async def decode_frames(self) -> None:
+		# decodes segments on the worker pool, decodeWorkers at a time, and
+		# passes them on to playback in order
+		decoding = asyncio.Queue(maxsize=max(self.decodeWorkers, 1))
+		submitter = asyncio.ensure_future(self.submit_decodes(decoding))
+		while True:
+			item = await decoding.get()
+			if item is None:
+				break
+			segment, future = item
+			try:
+				decode_time, frames = await future
+			except ValueError as e:
+				logger.error("Segment %d could not be decoded: %s", segment.index, e)
+				decode_time, frames = 0.0, 0
+			if segment.data is not None:
+				segment.data.close()
+			queueing_delay = self.loop.time() - segment.time - decode_time
+			self.perf_parameters['decode_latency'].append((segment.index, decode_time, queueing_delay))
+
+			logger.info("Decoded segments: {} ({} frames in {:.3f} s, {:.3f} s queued)".format(segment.name, frames, decode_time, queueing_delay))
 			await self.frameQueue.put(segment)
 
+		await submitter
+		logger.info("All the segments have been decoded")
+		await self.frameQueue.put("Decoding complete")
+
 	async def player(self) -> None:
 		await self.dash_client_set_config()
 
 		tasks = [asyncio.ensure_future(self.download_segment()),
 				asyncio.ensure_future(self.decode_frames()),
 				asyncio.ensure_future(self.playback_frames())]
+		if self.manifest_data.live:
+			tasks.append(asyncio.ensure_future(self.refresh_manifest()))
 
 		await asyncio.gather(*tasks)
+		await self.writer.close()
+		if self.decodePool is not None:
+			self.decodePool.shutdown()
 
 		self.perf_parameters['avg_bitrate'] /= self.totalSegments
 		self.perf_parameters['avg_bitrate_change'] /= (self.totalSegments - 1)
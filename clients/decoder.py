@@ -0,0 +1,115 @@
+import time
+from multiprocessing import shared_memory
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# The decode stage of the player, run in worker processes. A segment payload
+# is one or more binary PPM (P6) frames back to back, anything else is taken
+# as packed RGB samples. Decoding converts every frame to luma, then spins
+# for the CPU time the cost model charges for a segment of that resolution.
+# Segments held in memory by the player reach the workers in shared memory,
+# see SharedResponseBuffer.
+
+_WHITESPACE = frozenset(b" \t\n\r\x0b\x0c")
+_COMMENT = ord("#")
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def _token(view: memoryview, pos: int) -> Tuple[Optional[bytes], int]:
+    # next header token and the position after it
+    n = len(view)
+    while pos < n:
+        if view[pos] == _COMMENT:
+            while pos < n and view[pos] not in (10, 13):
+                pos += 1
+        elif view[pos] in _WHITESPACE:
+            pos += 1
+        else:
+            break
+    start = pos
+    while pos < n and view[pos] not in _WHITESPACE and view[pos] != _COMMENT:
+        pos += 1
+    return (bytes(view[start:pos]) if pos > start else None), pos
+
+
+def parse_ppm(data) -> Iterator[np.ndarray]:
+    # (height, width, 3) samples of every frame, without copying them
+    view = memoryview(data).cast("B")
+    pos = 0
+    while True:
+        frame_start = pos
+        magic, pos = _token(view, pos)
+        if magic is None:
+            return
+        if magic != b"P6":
+            raise ValueError("no binary PPM frame at byte %d" % frame_start)
+        fields = []
+        for _ in range(3):
+            token, pos = _token(view, pos)
+            if token is None:
+                raise ValueError("PPM header at byte %d is truncated" % frame_start)
+            fields.append(int(token))
+        width, height, maxval = fields
+        # a single whitespace character ends the header
+        pos += 1
+        dtype = np.dtype(np.uint8) if maxval < 256 else np.dtype(">u2")
+        end = pos + width * height * 3 * dtype.itemsize
+        if end > len(view):
+            raise ValueError("PPM frame at byte %d is truncated" % frame_start)
+        yield np.frombuffer(view[pos:end], dtype=dtype).reshape(height, width, 3)
+        pos = end
+
+
+def payload_frames(data) -> Iterator[np.ndarray]:
+    if bytes(data[:2]) == b"P6":
+        yield from parse_ppm(data)
+    else:
+        samples = len(data) // 3 * 3
+        yield np.frombuffer(data, dtype=np.uint8, count=samples).reshape(-1, 3)
+
+
+def decode_payload(payload) -> int:
+    frames = 0
+    for frame in payload_frames(payload):
+        np.dot(frame, _LUMA)
+        frames += 1
+    return frames
+
+
+def decode_shared(shared: Tuple[str, int]) -> int:
+    # decodes the (name, length) shared memory block of SharedResponseBuffer.handle
+    name, length = shared
+    memory = shared_memory.SharedMemory(name=name)
+    payload = memory.buf[:length]
+    error = None
+    try:
+        frames = decode_payload(payload)
+    except ValueError as e:
+        # its traceback holds views of the block, which could not be closed
+        error = str(e)
+    payload.release()
+    memory.close()
+    if error is not None:
+        raise ValueError(error)
+    return frames
+
+
+def decode_segment(data=None, files: Optional[List[str]] = None, cost: float = 0.0,
+                   shared: Optional[Tuple[str, int]] = None) -> Tuple[float, int]:
+    # decodes a segment from data, from a shared memory block or from files,
+    # then charges cost s of CPU. Returns the time spent and the frames decoded.
+    start = time.perf_counter()
+    frames = 0
+    if data is not None:
+        frames += decode_payload(data)
+    if shared is not None:
+        frames += decode_shared(shared)
+    for path in files or []:
+        with open(path, "rb") as f:
+            frames += decode_payload(f.read())
+
+    deadline = time.perf_counter() + cost
+    while time.perf_counter() < deadline:
+        pass
+    return time.perf_counter() - start, frames
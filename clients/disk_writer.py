@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Set
+
+logger = logging.getLogger("disk writer")
+
+# Downloaded responses are written on a thread pool, off the event loop, so
+# that a slow disk delays neither QUIC ACKs nor the other streams. The bytes
+# queued for the threads are bounded: past max_pending, write() waits for
+# them to catch up.
+
+# chunks of one file are gathered into writes of at least this many bytes
+COALESCE_BYTES = 256 * 1024
+MAX_PENDING_BYTES = 32 * 1024 * 1024
+DEFAULT_WORKERS = 2
+
+
+def _write_at(fd: int, chunks: List[bytes], offset: int) -> float:
+    # returns the time spent writing
+    start = time.perf_counter()
+    data = memoryview(chunks[0] if len(chunks) == 1 else b"".join(chunks))
+    while data:
+        written = os.pwrite(fd, data, offset)
+        data = data[written:]
+        offset += written
+    return time.perf_counter() - start
+
+
+class WriterFile:
+    """
+    A file being written by a DiskWriter. Writes are queued at their offset in
+    the file, so the threads can complete them in any order.
+    """
+    def __init__(self, writer: "DiskWriter", path: str) -> None:
+        self.writer = writer
+        self.path = path
+        self._fd = writer._run(os.open, path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        self._chunks: List[bytes] = []
+        self._size = 0
+        self._offset = 0
+        self._writes: List[asyncio.Future] = []
+
+    async def write(self, data: bytes) -> None:
+        self._chunks.append(data)
+        self._size += len(data)
+        if self._size >= self.writer.coalesce:
+            await self._flush()
+
+    async def _flush(self) -> None:
+        if self._chunks:
+            await self.writer._reserve(self._size)
+            self._writes.append(asyncio.ensure_future(
+                self.writer._write(self._fd, self._chunks, self._offset, self._size)))
+            self._offset += self._size
+            self._chunks = []
+            self._size = 0
+
+    async def close(self) -> None:
+        # returns once the whole file is on disk
+        try:
+            await self._flush()
+            await asyncio.gather(*self._writes)
+        finally:
+            await self.writer._run(os.close, await self._fd)
+
+    async def discard(self) -> None:
+        await self.close()
+        await self.writer._run(os.remove, self.path)
+
+
+class DiskWriter:
+    def __init__(self, workers: int = DEFAULT_WORKERS, max_pending: int = MAX_PENDING_BYTES,
+                 coalesce: int = COALESCE_BYTES) -> None:
+        self.max_pending = max_pending
+        self.coalesce = coalesce
+        self.pending = 0
+        self.bytes_written = 0
+        self.writes = 0
+        # time the threads spent in write calls
+        self.disk_time = 0.0
+
+        self._loop = asyncio.get_event_loop()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="disk-writer")
+        self._room = asyncio.Condition()
+        self._background: Set[asyncio.Future] = set()
+
+    def open(self, path: str) -> WriterFile:
+        return WriterFile(self, path)
+
+    def write_file(self, path: str, chunks: List[bytes]) -> None:
+        # writes a response already in memory in the background, see drain()
+        self.background(self._write_file(path, chunks))
+
+    def background(self, coro) -> None:
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def drain(self) -> None:
+        # waits for the files written in the background
+        while self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+
+    async def close(self) -> None:
+        await self.drain()
+        self._pool.shutdown()
+        logger.info("%d bytes written in %d writes, %.3f s in write calls",
+                    self.bytes_written, self.writes, self.disk_time)
+
+    async def _write_file(self, path: str, chunks: List[bytes]) -> None:
+        f = self.open(path)
+        for chunk in chunks:
+            await f.write(chunk)
+        await f.close()
+
+    def _run(self, fn, *args) -> asyncio.Future:
+        return self._loop.run_in_executor(self._pool, fn, *args)
+
+    async def _reserve(self, size: int) -> None:
+        # a write larger than max_pending goes through once nothing else is pending
+        async with self._room:
+            await self._room.wait_for(lambda: not self.pending or self.pending + size <= self.max_pending)
+            self.pending += size
+
+    async def _write(self, fd: asyncio.Future, chunks: List[bytes], offset: int, size: int) -> None:
+        try:
+            self.disk_time += await self._run(_write_at, await fd, chunks, offset)
+            self.bytes_written += size
+            self.writes += 1
+        finally:
+            async with self._room:
+                self.pending -= size
+                self._room.notify_all()
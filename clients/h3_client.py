@@ -1,13 +1,14 @@
 import os
 import asyncio
+import inspect
 import logging
 import pickle
 from urllib.parse import urlparse
 import argparse
-from typing import Deque, Dict, List, Optional, Union, cast, BinaryIO
+from typing import Callable, Deque, Dict, List, Optional, Tuple, Union, cast, BinaryIO
 import ssl
-import time
-from collections import deque
+from collections import deque, namedtuple
+from multiprocessing import shared_memory
 
 import aioquic
 from aioquic.h0.connection import H0_ALPN, H0Connection
@@ -21,7 +22,10 @@ from aioquic.h3.events import (
 )
 from aioquic.quic.configuration import QuicConfiguration
 from aioquic.quic.events import QuicEvent
+from aioquic.quic.packet import QuicFrameType
+from aioquic.quic.stream import QuicStream
 
+from clients.disk_writer import DiskWriter
 from protocol.h3.client import connect
 from protocol.h3.socketFactory import QuicFactorySocket
 
@@ -36,6 +40,24 @@ HttpConnection = Union[H0Connection, H3Connection]
 
 USER_AGENT = "aioquic/" + aioquic.__version__
 
+# span in s of the throughput samples of a ResponseStream
+THROUGHPUT_WINDOW = 1.0
+
+# bytes of credit a streamed response gets past what its consumer has read,
+# so at most that much of it waits in memory
+RESPONSE_HIGH_WATER = 2 * 1024 * 1024
+
+# that credit is granted through aioquic internals, as of aioquic 0.9.7.
+# Where they differ, aioquic's own stream limits are kept.
+STREAM_LIMITS_PARAMETERS = ("builder", "space", "stream")
+STREAM_CREDIT_ATTRIBUTES = ("_recv_highest", "max_stream_data_local", "max_stream_data_local_sent")
+# frame type, stream id, maximum
+MAX_STREAM_DATA_FRAME_CAPACITY = 1 + 8 + 8
+
+# a piece of response body, when it arrived on the loop clock and the
+# throughput in Mbps over the window ending then
+ResponseChunk = namedtuple("ResponseChunk", "data time throughput")
+
 
 class URL:
     def __init__(self, url: str) -> None:
@@ -58,6 +80,191 @@ class HttpRequest:
         self.url = url
 
 
+class RequestProgress:
+    """
+    Progress of a request in flight, kept up to date by HttpClient: the stream
+    it was sent on, when it was first sent and the response bytes received.
+    One instance can follow several requests in turn, the bytes add up.
+    """
+    def __init__(self) -> None:
+        self.stream_id: Optional[int] = None
+        self.started: Optional[float] = None
+        self.received = 0
+
+
+class ResponseBuffer:
+    """
+    Response bodies assembled in memory. Every chunk is copied once, through a
+    memoryview, into a bytearray allocated up front; the bytearray is only
+    replaced when the bodies turn out larger than it was sized for.
+    """
+    def __init__(self, size: int = 0) -> None:
+        self.buffer = bytearray(size)
+        self.length = 0
+
+    def reserve(self, size: int) -> None:
+        # room for size more bytes
+        end = self.length + size
+        if end > len(self.buffer):
+            grown = bytearray(max(end, 2 * len(self.buffer)))
+            grown[:self.length] = memoryview(self.buffer)[:self.length]
+            self.buffer = grown
+
+    def write(self, data: bytes) -> None:
+        end = self.length + len(data)
+        self.reserve(len(data))
+        memoryview(self.buffer)[self.length:end] = data
+        self.length = end
+
+    @property
+    def data(self) -> memoryview:
+        return memoryview(self.buffer)[:self.length]
+
+    def close(self) -> None:
+        self.buffer = bytearray()
+        self.length = 0
+
+
+class SharedResponseBuffer(ResponseBuffer):
+    """
+    A ResponseBuffer in shared memory, for bodies read by other processes:
+    they attach to it by handle instead of getting a copy. The block is
+    removed by the first close(), once every view of data has been released.
+    """
+    def __init__(self, size: int = 0) -> None:
+        self._memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.buffer = self._memory.buf
+        self.length = 0
+
+    def reserve(self, size: int) -> None:
+        end = self.length + size
+        if end > len(self.buffer):
+            grown = shared_memory.SharedMemory(create=True, size=max(end, 2 * len(self.buffer)))
+            grown.buf[:self.length] = self.buffer[:self.length]
+            self.close()
+            self._memory = grown
+            self.buffer = grown.buf
+
+    @property
+    def handle(self) -> Tuple[str, int]:
+        # (name, length), for decode_segment() to read the body in another process
+        return self._memory.name, self.length
+
+    def close(self) -> None:
+        if self.buffer is None:
+            return
+        self.buffer = None
+        self._memory.close()
+        self._memory.unlink()
+
+
+def content_length(headers: Optional[List]) -> Optional[int]:
+    for k, v in headers or []:
+        if k == b"content-length":
+            return int(v)
+    return None
+
+
+class ResponseStream:
+    """
+    Response to a request sent with HttpClient.stream(), an async iterator
+    over its body as ResponseChunk, in order of arrival. Chunks are dropped
+    once handed over, only those not read yet are held: the server gets flow
+    control credit for high_water bytes past what the consumer has read, so
+    a slow consumer slows the server down instead of piling up the body.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, window: float = THROUGHPUT_WINDOW,
+                 progress: Optional[RequestProgress] = None,
+                 high_water: int = RESPONSE_HIGH_WATER) -> None:
+        self.window = window
+        self.progress = progress
+        self.high_water = high_water
+        self.stream_id: Optional[int] = None
+        self.headers: Optional[List] = None
+        self.started: Optional[float] = None
+        self.first_byte: Optional[float] = None
+        self.received = 0
+        self.buffered = 0
+        self.ended = False
+
+        self._loop = loop
+        # called each time the consumer has read half of high_water, to send
+        # the credit it freed when the server is blocked waiting for it
+        self._on_drain: Optional[Callable[[], None]] = None
+        self._drained = 0
+        self._chunks: Deque[ResponseChunk] = deque()
+        # (arrival time, bytes) of the chunks within the window
+        self._samples: Deque = deque()
+        self._window_bytes = 0
+        self._error: Optional[BaseException] = None
+        self._waiter: Optional[asyncio.Future] = None
+
+    @property
+    def ttfb(self) -> Optional[float]:
+        # time to first byte of the body, from the request being sent
+        if self.first_byte is None:
+            return None
+        return self.first_byte - self.started
+
+    def throughput(self, now: Optional[float] = None) -> float:
+        # Mbps over the last window s, or since the request was sent when more recent
+        if now is None:
+            now = self._loop.time()
+        while self._samples and self._samples[0][0] <= now - self.window:
+            self._window_bytes -= self._samples.popleft()[1]
+        span = min(self.window, now - self.started)
+        return self._window_bytes * 8 / span / 1000000 if span > 0 else 0.0
+
+    def _event_received(self, event: H3Event) -> None:
+        if isinstance(event, HeadersReceived):
+            self.headers = event.headers
+        elif event.data:
+            now = self._loop.time()
+            if self.first_byte is None:
+                self.first_byte = now
+            self.received += len(event.data)
+            if self.progress is not None:
+                self.progress.received += len(event.data)
+            self._samples.append((now, len(event.data)))
+            self._window_bytes += len(event.data)
+            self._chunks.append(ResponseChunk(event.data, now, self.throughput(now)))
+            self.buffered += len(event.data)
+        if event.stream_ended:
+            self.ended = True
+        self._wake()
+
+    def _abort(self, error: BaseException) -> None:
+        self._error = error
+        self.ended = True
+        self._wake()
+
+    def _wake(self) -> None:
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def __aiter__(self) -> "ResponseStream":
+        return self
+
+    async def __anext__(self) -> ResponseChunk:
+        while not self._chunks:
+            if self._error is not None:
+                raise self._error
+            if self.ended:
+                raise StopAsyncIteration
+            self._waiter = self._loop.create_future()
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+        chunk = self._chunks.popleft()
+        self.buffered -= len(chunk.data)
+        self._drained += len(chunk.data)
+        if self._drained >= self.high_water // 2 and self._on_drain is not None:
+            self._drained = 0
+            self._on_drain()
+        return chunk
+
+
 class HttpClient(QuicFactorySocket):
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
@@ -66,35 +273,106 @@ class HttpClient(QuicFactorySocket):
         self._http: Optional[HttpConnection] = None
         self._request_events: Dict[int, Deque[H3Event]] = {}
         self._request_waiter: Dict[int, asyncio.Future[Deque[H3Event]]] = {}
+        self._request_progress: Dict[int, RequestProgress] = {}
+        self._request_streams: Dict[int, ResponseStream] = {}
 
         if self._quic.configuration.alpn_protocols[0].startswith("hq-"):
             self._http = H0Connection(self._quic)
         else:
             self._http = H3Connection(self._quic)
 
-    async def get(self, url: str, headers: Dict = {}) -> Deque[H3Event]:
+        # aioquic raises MAX_STREAM_DATA as data arrives, whether it was read or
+        # not, the credit of streamed responses follows their consumer instead
+        if self._stream_credit_supported():
+            self._write_stream_limits = self._quic._write_stream_limits
+            self._quic._write_stream_limits = self._stream_limits
+        else:
+            logger.warning("aioquic %s is not supported by the flow control of streamed responses, "
+                           "their unread body is not bounded", aioquic.__version__)
+
+    async def get(
+        self, url: str, headers: Dict = {}, progress: Optional[RequestProgress] = None
+    ) -> Deque[H3Event]:
         """
         Perform a GET request.
         """
         return await self._request(
-            HttpRequest(method="GET", url=URL(url), headers=headers)
+            HttpRequest(method="GET", url=URL(url), headers=headers), progress
         )
 
-    async def post(self, url: str, data: bytes, headers: Dict = {}) -> Deque[H3Event]:
+    async def post(
+        self, url: str, data: bytes, headers: Dict = {}, progress: Optional[RequestProgress] = None
+    ) -> Deque[H3Event]:
         """
         Perform a POST request.
         """
         return await self._request(
-            HttpRequest(method="POST", url=URL(url), content=data, headers=headers)
+            HttpRequest(method="POST", url=URL(url), content=data, headers=headers), progress
         )
 
+    def stream(
+        self, url: str, headers: Dict = {}, data: Optional[bytes] = None,
+        window: float = THROUGHPUT_WINDOW, progress: Optional[RequestProgress] = None,
+        high_water: int = RESPONSE_HIGH_WATER
+    ) -> ResponseStream:
+        """
+        Perform a GET request, or a POST one when data is given, and return the
+        response as a ResponseStream to read the body from as it arrives.
+        At most about high_water bytes of it wait to be read.
+        """
+        if data is None:
+            request = HttpRequest(method="GET", url=URL(url), headers=headers)
+        else:
+            request = HttpRequest(method="POST", url=URL(url), content=data, headers=headers)
+        response = ResponseStream(self._loop, window, progress, high_water)
+        response._on_drain = self.transmit
+        response.stream_id = self._send_request(request)
+        response.started = self._loop.time()
+        self._request_streams[response.stream_id] = response
+        if progress is not None:
+            progress.stream_id = response.stream_id
+            if progress.started is None:
+                progress.started = response.started
+        self.transmit()
+        return response
+
+    def cancel_request(self, progress: Union[RequestProgress, ResponseStream], error_code: int = 0) -> None:
+        """
+        Abandon the request followed by progress: the stream is reset and the
+        request, or reading its ResponseStream, raises asyncio.CancelledError.
+        """
+        stream_id = progress.stream_id
+        response = self._request_streams.pop(stream_id, None)
+        if response is not None:
+            self.reset_stream(stream_id, error_code)
+            response._abort(asyncio.CancelledError())
+            return
+        waiter = self._request_waiter.pop(stream_id, None)
+        if waiter is None:
+            return
+        self._request_events.pop(stream_id, None)
+        self._request_progress.pop(stream_id, None)
+        self.reset_stream(stream_id, error_code)
+        waiter.cancel()
+
     def http_event_received(self, event: H3Event) -> None:
         if isinstance(event, (HeadersReceived, DataReceived)):
             stream_id = event.stream_id
-            if stream_id in self._request_events:
+            if stream_id in self._request_streams:
+                # http, streamed
+                response = self._request_streams[stream_id]
+                if event.stream_ended:
+                    del self._request_streams[stream_id]
+                response._event_received(event)
+
+            elif stream_id in self._request_events:
                 # http
                 self._request_events[event.stream_id].append(event)
+                progress = self._request_progress.get(stream_id)
+                if progress is not None and isinstance(event, DataReceived):
+                    progress.received += len(event.data)
                 if event.stream_ended:
+                    self._request_progress.pop(stream_id, None)
                     request_waiter = self._request_waiter.pop(stream_id)
                     request_waiter.set_result(self._request_events.pop(stream_id))
 
@@ -112,7 +390,39 @@ class HttpClient(QuicFactorySocket):
             for http_event in self._http.handle_event(event):
                 self.http_event_received(http_event)
 
-    async def _request(self, request: HttpRequest):
+    def _stream_credit_supported(self) -> bool:
+        write_stream_limits = getattr(self._quic, "_write_stream_limits", None)
+        if write_stream_limits is None or not hasattr(self._quic, "_on_max_stream_data_delivery"):
+            return False
+        if tuple(inspect.signature(write_stream_limits).parameters) != STREAM_LIMITS_PARAMETERS:
+            return False
+        try:
+            stream = QuicStream()
+        except TypeError:
+            return False
+        return all(hasattr(stream, name) for name in STREAM_CREDIT_ATTRIBUTES)
+
+    def _stream_limits(self, builder, space, stream) -> None:
+        response = self._request_streams.get(stream.stream_id)
+        if response is None:
+            self._write_stream_limits(builder=builder, space=space, stream=stream)
+            return
+        # the stream offset read so far, give or take the HTTP/3 framing
+        limit = stream._recv_highest - response.buffered + response.high_water
+        if limit - stream.max_stream_data_local >= response.high_water // 2:
+            stream.max_stream_data_local = limit
+        if stream.max_stream_data_local_sent != stream.max_stream_data_local:
+            buf = builder.start_frame(
+                QuicFrameType.MAX_STREAM_DATA,
+                capacity=MAX_STREAM_DATA_FRAME_CAPACITY,
+                handler=self._quic._on_max_stream_data_delivery,
+                handler_args=(stream,),
+            )
+            buf.push_uint_var(stream.stream_id)
+            buf.push_uint_var(stream.max_stream_data_local)
+            stream.max_stream_data_local_sent = stream.max_stream_data_local
+
+    def _send_request(self, request: HttpRequest) -> int:
         stream_id = self._quic.get_next_available_stream_id()
         self._http.send_headers(
             stream_id=stream_id,
@@ -126,10 +436,18 @@ class HttpClient(QuicFactorySocket):
             + [(k.encode(), v.encode()) for (k, v) in request.headers.items()],
         )
         self._http.send_data(stream_id=stream_id, data=request.content, end_stream=True)
+        return stream_id
 
+    async def _request(self, request: HttpRequest, progress: Optional[RequestProgress] = None):
+        stream_id = self._send_request(request)
         waiter = self._loop.create_future()
         self._request_events[stream_id] = deque()
         self._request_waiter[stream_id] = waiter
+        if progress is not None:
+            progress.stream_id = stream_id
+            if progress.started is None:
+                progress.started = self._loop.time()
+            self._request_progress[stream_id] = progress
         self.transmit()
 
         return await asyncio.shield(waiter)
@@ -137,43 +455,90 @@ class HttpClient(QuicFactorySocket):
 
 async def perform_http_request(
     client: HttpClient, url: str, data: str, include: bool, output_dir: Optional[str],
+    progress: Optional[RequestProgress] = None, buffer: Optional[ResponseBuffer] = None,
+    writer: Optional[DiskWriter] = None, output_name: Optional[str] = None,
 ) -> None:
-    # perform request
-    start = time.time()
+    # perform request, the body is written out as it arrives, through writer
+    # when given, or appended to buffer instead of going to a file. The file
+    # is output_name in output_dir, the last part of the url path by default.
+    # The time spent waiting for the writer is not counted as download time.
+    start = client._loop.time()
     if data is not None:
-        http_events = await client.post(
+        response = client.stream(
             url,
             data=data.encode(),
             headers={"content-type": "application/x-www-form-urlencoded"},
+            progress=progress,
         )
         method = "POST"
     else:
-        http_events = await client.get(url)
+        response = client.stream(url, progress=progress)
         method = "GET"
-    elapsed = time.time() - start
+
+    output_path = None
+    output = None
+    disk_wait = 0.0
+    buffer_start = buffer.length if buffer is not None else 0
+    if buffer is None and output_dir is not None:
+        output_path = os.path.join(
+            output_dir, output_name or os.path.basename(urlparse(url).path) or "index.html"
+        )
+    try:
+        if buffer is not None:
+            async for chunk in response:
+                if buffer.length == buffer_start:
+                    # sized for the manifest, make room for the whole body at once
+                    buffer.reserve(content_length(response.headers) or 0)
+                buffer.write(chunk.data)
+        elif output_path is None:
+            async for _ in response:
+                pass
+        elif writer is not None:
+            output = writer.open(output_path)
+            headers_written = not include
+            async for chunk in response:
+                wait_start = client._loop.time()
+                if not headers_written:
+                    await output.write(format_headers(response.headers))
+                    headers_written = True
+                await output.write(chunk.data)
+                disk_wait += client._loop.time() - wait_start
+            if not headers_written:
+                await output.write(format_headers(response.headers))
+        else:
+            with open(output_path, "wb") as output_file:
+                headers_written = not include
+                async for chunk in response:
+                    if not headers_written:
+                        write_headers(response.headers, output_file)
+                        headers_written = True
+                    output_file.write(chunk.data)
+                if not headers_written:
+                    write_headers(response.headers, output_file)
+    except asyncio.CancelledError:
+        if not response.ended:
+            client.cancel_request(response)
+        # abandoned, do not leave a truncated response behind
+        if buffer is not None:
+            buffer.length = buffer_start
+        elif output is not None:
+            writer.background(output.discard())
+        elif output_path is not None and os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+    elapsed = client._loop.time() - start - disk_wait
+    if output is not None:
+        await output.close()
 
     # print speed
-    octets = 0
-    for http_event in http_events:
-        if isinstance(http_event, DataReceived):
-            octets += len(http_event.data)
+    octets = response.received
     logger.info(
-        "Response received for %s %s : %d bytes in %.1f s (%.3f Mbps)"
-        % (method, urlparse(url).path, octets, elapsed, octets * 8 / elapsed / 1000000)
+        "Response received for %s %s : %d bytes in %.1f s (%.3f Mbps, first byte after %.3f s)"
+        % (method, urlparse(url).path, octets, elapsed, octets * 8 / elapsed / 1000000, response.ttfb or 0)
     )
 
     tput = octets * 8 / elapsed / 1000000
 
-    # output response
-    if output_dir is not None:
-        output_path = os.path.join(
-            output_dir, os.path.basename(urlparse(url).path) or "index.html"
-        )
-        with open(output_path, "wb") as output_file:
-                write_response(
-                    http_events=http_events, include=include, output_file=output_file
-                )
-
     return octets, tput, elapsed
 
 
@@ -181,7 +546,9 @@ def process_http_pushes(
     client: HttpClient,
     include: bool,
     output_dir: Optional[str],
+    writer: Optional[DiskWriter] = None,
 ) -> None:
+    # with a writer the files are written in the background, see DiskWriter.drain()
     for _, http_events in client.pushes.items():
         method = ""
         octets = 0
@@ -202,21 +569,35 @@ def process_http_pushes(
             output_path = os.path.join(
                 output_dir, os.path.basename(path) or "index.html"
             )
+            if writer is not None:
+                writer.write_file(output_path, list(response_chunks(http_events, include)))
+                continue
             with open(output_path, "wb") as output_file:
                 write_response(
                     http_events=http_events, include=include, output_file=output_file
                 )
 
 
-def write_response(
-    http_events: Deque[H3Event], output_file: BinaryIO, include: bool
-) -> None:
+def format_headers(headers: Optional[List]) -> bytes:
+    if not headers:
+        return b""
+    return b"".join(k + b": " + v + b"\r\n" for k, v in headers) + b"\r\n"
+
+
+def write_headers(headers: Optional[List], output_file: BinaryIO) -> None:
+    output_file.write(format_headers(headers))
+
+
+def response_chunks(http_events: Deque[H3Event], include: bool):
     for http_event in http_events:
         if isinstance(http_event, HeadersReceived) and include:
-            headers = b""
-            for k, v in http_event.headers:
-                headers += k + b": " + v + b"\r\n"
-            if headers:
-                output_file.write(headers + b"\r\n")
+            yield format_headers(http_event.headers)
         elif isinstance(http_event, DataReceived):
-            output_file.write(http_event.data)
\ No newline at end of file
+            yield http_event.data
+
+
+def write_response(
+    http_events: Deque[H3Event], output_file: BinaryIO, include: bool
+) -> None:
+    for chunk in response_chunks(http_events, include):
+        output_file.write(chunk)
\ No newline at end of file
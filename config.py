@@ -10,8 +10,15 @@ CA_CERTS = "tests/pycacert.pem"
 
 OUT_DIR = ".cache/"
 
+# live manifests (/live/<manifest>): segments offered in the sliding window
+LIVE_WINDOW_SEGMENTS = 30
+
 MAX_STREAM_DATA = 65556
 
+# decode cost model: CPU time in ms charged for decoding a segment of each
+# resolution, on top of parsing it
+DECODE_COST_MS = {"360": 5, "480": 10, "720": 25, "1080": 60}
+
 # QOE calculations
 # MPC lambda and mu for balanced
 LAMBDA = 1
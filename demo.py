@@ -4,18 +4,20 @@
 
 import datetime
 import os
+import time
 import json
 from urllib.parse import urlencode
 
 import httpbin
 from asgiref.wsgi import WsgiToAsgi
 from starlette.applications import Starlette
-from starlette.responses import PlainTextResponse, Response, JSONResponse
+from starlette.responses import FileResponse, PlainTextResponse, Response, JSONResponse
 from starlette.staticfiles import StaticFiles
 from starlette.templating import Jinja2Templates
 from starlette.websockets import WebSocketDisconnect
 
 import config
+from adaptive.manifest import LiveChannel, Manifest, is_binary_manifest
 
 ROOT = os.path.dirname(__file__)
 STATIC_ROOT = os.environ.get("STATIC_ROOT", os.path.join(ROOT, "htdocs"))
@@ -26,6 +28,23 @@ QVIS_URL = "https://qvis.edm.uhasselt.be/"
 templates = Jinja2Templates(directory=os.path.join(STATIC_ROOT, "templates"))
 app = Starlette(debug=True)
 
+# path -> (mtime, Manifest, JSON body), parsed once and reused until the file changes.
+# Binary manifests are memory mapped and sent as they are, their body is None.
+manifest_cache = {}
+# manifest file name -> LiveChannel, started on the first request for it
+live_channels = {}
+
+
+def load_manifest(path):
+    mtime = os.stat(path).st_mtime
+    cached = manifest_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        manifest = Manifest.load(path)
+        body = None if is_binary_manifest(path) else json.dumps(manifest.to_dict()).encode()
+        cached = (mtime, manifest, body)
+        manifest_cache[path] = cached
+    return cached[1], cached[2]
+
 
 @app.route("/")
 async def homepage(request):
@@ -40,15 +59,45 @@ async def manifest(request):
     server_pushed = 0
 
     filename = request.path_params['filename']
-    manifest = json.load(open(STATIC_ROOT + "/" + filename))
-    segment = manifest['segment_size_bytes'][0][2]
+    path = STATIC_ROOT + "/" + filename
+    manifest, body = load_manifest(path)
+    segment = manifest.segment_size(0, 2)
 
     if config.NUM_SERVER_PUSHED_FRAMES is not None:
         while server_pushed < config.NUM_SERVER_PUSHED_FRAMES:
             await request.send_push_promise(str(segment))
             server_pushed += 1
 
-    return JSONResponse(manifest)
+    if body is None:
+        return FileResponse(path, media_type="application/octet-stream")
+    return Response(body, media_type="application/json")
+
+
+@app.route("/live/{filename:str}")
+async def live_manifest(request):
+    """
+    The manifest played as a live channel: the sliding window of segments
+    published so far, or with ?since=<sequence> only those published after.
+    """
+    filename = request.path_params['filename']
+    manifest, _ = load_manifest(STATIC_ROOT + "/" + filename)
+    now = time.time()
+
+    channel = live_channels.get(filename)
+    if channel is None or channel.manifest is not manifest:
+        # the window is full from the start
+        window = config.LIVE_WINDOW_SEGMENTS
+        channel = LiveChannel(manifest, window, now - window * manifest.segment_duration)
+        live_channels[filename] = channel
+
+    since = request.query_params.get('since')
+    if since is None:
+        return JSONResponse(channel.snapshot(now))
+    try:
+        since = int(since)
+    except ValueError:
+        return PlainTextResponse("since must be an update sequence number", status_code=400)
+    return JSONResponse(channel.update(now, since))
 
 
 @app.route("/echo", methods=["POST"])
@@ -1,7 +1,5 @@
 import asyncio
-import json
 import ssl
-import time
 import os
 import argparse
 import pickle
@@ -30,7 +28,8 @@ from clients.h3_client import HttpClient
 from quic_logger import QuicDirectoryLogger
 
 import config
-from adaptive.mpc import MPC
+from adaptive import ABR_RULES, Manifest
+from adaptive.throughput import PREDICTORS
 
 logger = logging.getLogger("DASH Player")
 
@@ -93,9 +92,9 @@ async def run(configuration: QuicConfiguration, args) -> None:
 
             dc = DashClient(protocol=h3_client, args=args)
 
-            start = time.time()
+            start = dc.loop.time()
             await dc.player()
-            elapsed = time.time() - start
+            elapsed = dc.loop.time() - start
 
             dc.perf_parameters['total_time_played'] = elapsed
             dc.perf_parameters['startup_delay'] = dc.perf_parameters['startup_delay'] - start
@@ -179,10 +178,29 @@ if __name__ == "__main__":
     # Start of ABR/streaming related config parameters
     parser.add_argument("-b", "--buffer-size", action="store",
 						default=60, help="Buffer size for video playback")
-    parser.add_argument("--abr", "--abr", action="store", 
+    parser.add_argument("--abr", "--abr", action="store", choices=ABR_RULES,
 						default="tputRule", help="ABR rule to download video")
+    parser.add_argument("--predictor", choices=sorted(PREDICTORS),
+                        help="throughput predictor fed to the ABR rule (default: the rule's own)")
+    parser.add_argument("--fastmpc-table", type=str,
+                        help="FastMPC decision table, built in the user cache directory when not given")
+    parser.add_argument("--prefetch", type=int, default=1,
+                        help="segment requests in flight at once, on separate streams of the connection")
+    parser.add_argument("--no-abandon", action="store_true",
+                        help="never abandon a segment download projected to outlast the buffer")
+    parser.add_argument("--in-memory", action="store_true",
+                        help="assemble segments in memory and hand them to the decoder instead of writing them out")
+    parser.add_argument("--no-write", action="store_true",
+                        help="discard segments and pushes as they arrive, to measure the transport alone")
+    parser.add_argument("--decode-workers", type=int, default=1,
+                        help="processes decoding segments, 0 to decode on a thread of the player. "
+                             "The cost of each resolution is config.DECODE_COST_MS")
 
     args = parser.parse_args()
+    if args.prefetch < 1:
+        parser.error("--prefetch must be at least 1")
+    if args.decode_workers < 0:
+        parser.error("--decode-workers cannot be negative")
 
     logging.basicConfig(
         format="%(asctime)s %(levelname)s %(name)s %(message)s",
@@ -199,7 +217,7 @@ if __name__ == "__main__":
 
     if args.manifest_file is None:
         args.manifest_file = config.MANIFEST_FILE
-    manifest = json.load(open(args.manifest_file))
+    manifest = Manifest.load(args.manifest_file)
 
     configuration = QuicConfiguration(
         is_client=True,
@@ -1,14 +1,18 @@
 import asyncio
 import os
+import socket
 from functools import partial
-from typing import Callable, Dict, Optional, Text, Union, cast
+from typing import Callable, Dict, List, Optional, Text, Tuple, Union, cast
 
 from aioquic.buffer import Buffer
 from aioquic.quic.connection import NetworkAddress, QuicConnection
 from aioquic.quic.configuration import QuicConfiguration
 from aioquic.quic.retry import QuicRetryTokenHandler
 from aioquic.tls import SessionTicketHandler, SessionTicketFetcher
-from .socketFactory import QuicFactorySocket, QuicStreamHandler
+from .socketFactory import QuicFactorySocket, QuicStreamHandler, TransmitCoalescer
+from .timer import TimerWheel
+from .udp import UdpBatchReceiver, UdpBatchSender
+from .workers import WorkerQuicConnection, WorkerRouter
 
 from aioquic.quic.packet import (
     PACKET_TYPE_INITIAL,
@@ -27,7 +31,20 @@ class QuicServer(asyncio.DatagramProtocol):
         session_ticket_handler: Optional[SessionTicketHandler] = None,
         retry: bool = False,
         stream_handler: Optional[QuicStreamHandler] = None,
+        batch_send: bool = False,
+        sendmmsg: bool = False,
+        batch_recv: bool = False,
+        recvmmsg: bool = False,
+        recv_buffer: Optional[int] = None,
+        coalesce: bool = False,
+        timer_wheel: bool = False,
+        router: Optional[WorkerRouter] = None,
     ) -> None:
+        self._batch_send = batch_send
+        self._sendmmsg = sendmmsg
+        self._batch_recv = batch_recv
+        self._recvmmsg = recvmmsg
+        self._recv_buffer = recv_buffer
         self._configuration = configuration
         self._create_protocol = create_protocol
         self._loop = asyncio.get_event_loop()
@@ -35,6 +52,18 @@ class QuicServer(asyncio.DatagramProtocol):
         self._session_ticket_fetcher = session_ticket_fetcher
         self._session_ticket_handler = session_ticket_handler
         self._transport: Optional[asyncio.DatagramProtocol] = None
+        self._sender: Optional[UdpBatchSender] = None
+        self._receiver: Optional[UdpBatchReceiver] = None
+        # shared by all the connections, None when each transmits right away
+        self.coalescer = TransmitCoalescer(self._loop) if coalesce else None
+        # the timers of all the connections, None when each has a loop handle
+        self.timer_wheel = TimerWheel(self._loop) if timer_wheel else None
+        # set when this is one of several workers on the port
+        self.router = router
+        if router is not None:
+            self._create_connection = partial(WorkerQuicConnection, worker_id=router.worker_id)
+        else:
+            self._create_connection = QuicConnection
 
         self._stream_handler = stream_handler
 
@@ -46,9 +75,37 @@ class QuicServer(asyncio.DatagramProtocol):
 
     def connection_made(self, transport: asyncio.BaseTransport) -> None:
         self._transport = cast(asyncio.DatagramProtocol, transport)
+        if self._batch_send:
+            # None where batched sends are not available, the transport is used then
+            self._sender = UdpBatchSender.create(self._transport, sendmmsg=self._sendmmsg)
+        if self._recv_buffer is not None:
+            sock = self._transport.get_extra_info("socket")
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self._recv_buffer)
+        if self._batch_recv:
+            self._receiver = UdpBatchReceiver.create(self._transport, recvmmsg=self._recvmmsg)
+        if self.router is not None:
+            self.router.start(self.datagram_received)
 
     def datagram_received(self, data: Union[bytes, Text], addr: NetworkAddress) -> None:
         data = cast(bytes, data)
+        if self._receiver is None:
+            protocol = self._dispatch(data, addr)
+            if protocol is not None:
+                protocol.datagram_received(data, addr)
+            return
+
+        # the transport read one datagram, read the rest of the burst and hand
+        # each connection its datagrams at once
+        batches: Dict[QuicFactorySocket, List[Tuple[bytes, NetworkAddress]]] = {}
+        for data, addr in [(data, addr)] + self._receiver.receive():
+            protocol = self._dispatch(data, addr)
+            if protocol is not None:
+                batches.setdefault(protocol, []).append((data, addr))
+        for protocol, datagrams in batches.items():
+            protocol.datagrams_received(datagrams)
+
+    def _dispatch(self, data: bytes, addr: NetworkAddress) -> Optional[QuicFactorySocket]:
+        # the connection a datagram is for, created for a new client
         buf = Buffer(data=data)
 
         try:
@@ -56,7 +113,7 @@ class QuicServer(asyncio.DatagramProtocol):
                 buf, host_cid_length=self._configuration.connection_id_length
             )
         except ValueError:
-            return
+            return None
 
         # version negotiation
         if (
@@ -71,9 +128,16 @@ class QuicServer(asyncio.DatagramProtocol):
                 ),
                 addr,
             )
-            return
+            return None
         
         protocol = self._protocols.get(header.destination_cid, None)
+        if protocol is None and self.router is not None and not header.is_long_header:
+            # a connection of another worker, whose client's address has changed
+            owner = self.router.owner(header.destination_cid)
+            if owner is not None and owner != self.router.worker_id:
+                self.router.forward(owner, data, addr)
+                return None
+
         original_destination_connection_id: Optional[bytes] = None
         retry_source_connection_id: Optional[bytes] = None
         if (
@@ -98,18 +162,18 @@ class QuicServer(asyncio.DatagramProtocol):
                         ),
                         addr,
                     )
-                    return
+                    return None
                 else:
                     # validate retry token
                     try:
                         (original_destination_cid, retry_source_connection_id) = self._retry.validate_token(addr, header.token)
                     except ValueError:
-                        return
+                        return None
             else:
                 original_destination_connection_id = header.destination_cid
             
             # create new connection
-            connection = QuicConnection(
+            connection = self._create_connection(
                 configuration=self._configuration,
                 original_destination_connection_id=original_destination_connection_id,
                 retry_source_connection_id=retry_source_connection_id,
@@ -122,6 +186,9 @@ class QuicServer(asyncio.DatagramProtocol):
                 connection, stream_handler=self._stream_handler
             )
             protocol.connection_made(self._transport)
+            protocol._sender = self._sender
+            protocol._coalescer = self.coalescer
+            protocol._timer_wheel = self.timer_wheel
 
             # register callbacks
             protocol._connection_id_issued_handler = partial(
@@ -137,8 +204,7 @@ class QuicServer(asyncio.DatagramProtocol):
             self._protocols[header.destination_cid] = protocol
             self._protocols[connection.host_cid] = protocol
 
-        if protocol is not None:
-            protocol.datagram_received(data, addr)
+        return protocol
 
     def _connection_id_issued(self, cid: bytes, protocol: QuicFactorySocket):
         self._protocols[cid] = protocol
@@ -159,6 +225,16 @@ class QuicServer(asyncio.DatagramProtocol):
         for protocol in set(self._protocols.values()):
             protocol.close()
         self._protocols.clear()
+        if self._sender is not None:
+            self._sender.close()
+        if self._receiver is not None:
+            self._receiver.close()
+        if self.coalescer is not None:
+            self.coalescer.close()
+        if self.timer_wheel is not None:
+            self.timer_wheel.close()
+        if self.router is not None:
+            self.router.close()
         self._transport.close()
 
 """
@@ -174,6 +250,14 @@ async def start_server(
     session_ticket_handler: Optional[SessionTicketHandler] = None,
     retry: bool = False,
     stream_handler: QuicStreamHandler = None,
+    batch_send: bool = False,
+    sendmmsg: bool = False,
+    batch_recv: bool = False,
+    recvmmsg: bool = False,
+    recv_buffer: Optional[int] = None,
+    coalesce: bool = False,
+    timer_wheel: bool = False,
+    router: Optional[WorkerRouter] = None,
 ) -> QuicServer:
     loop = asyncio.get_event_loop()
 
@@ -185,8 +269,18 @@ async def start_server(
             session_ticket_handler = session_ticket_handler,
             retry = retry,
             stream_handler = stream_handler,
+            batch_send = batch_send,
+            sendmmsg = sendmmsg,
+            batch_recv = batch_recv,
+            recvmmsg = recvmmsg,
+            recv_buffer = recv_buffer,
+            coalesce = coalesce,
+            timer_wheel = timer_wheel,
+            router = router,
         ),
         local_addr=(host, port),
+        # the workers share the port
+        reuse_port=router is not None,
     )
     return cast(QuicServer, protocol)
 
@@ -1,12 +1,72 @@
 import asyncio
-from typing import Any, Callable, Dict, Optional, Text, Tuple, Union, cast
+from typing import Any, Callable, Dict, List, Optional, Text, Tuple, Union, cast
 
 from aioquic.quic import events
 from aioquic.quic.connection import NetworkAddress, QuicConnection
 
+from .timer import TimerWheel
+from .udp import UdpBatchSender
+
 QuicConnectionIdHandler = Callable[[bytes], None]
 QuicStreamHandler = Callable[[asyncio.StreamReader, asyncio.StreamWriter], None]
 
+
+class TransmitCoalescer:
+    """
+    Transmits for the connections of a server once per iteration of the event
+    loop. Datagrams received, timers and stream writes only mark a connection,
+    and one flush scheduled with call_soon transmits for all the connections
+    marked, so ACKs and stream data produced in the meantime share packets.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+        self._marked: Dict["QuicFactorySocket", None] = {}
+        self._flush_task: Optional[asyncio.Handle] = None
+
+        self.flushes = 0
+        self.datagrams_received = 0
+        self.packets_sent = 0
+        self.max_datagrams_received = 0
+        self.max_packets_sent = 0
+        self._received = 0
+
+    def mark(self, protocol: "QuicFactorySocket", received: int = 0) -> None:
+        self._received += received
+        self._marked[protocol] = None
+        if self._flush_task is None:
+            self._flush_task = self._loop.call_soon(self.flush)
+
+    def flush(self) -> None:
+        self._flush_task = None
+        marked, self._marked = self._marked, {}
+        sent = 0
+        for protocol in marked:
+            sent += protocol.transmit()
+
+        self.flushes += 1
+        self.datagrams_received += self._received
+        self.packets_sent += sent
+        self.max_datagrams_received = max(self.max_datagrams_received, self._received)
+        self.max_packets_sent = max(self.max_packets_sent, sent)
+        self._received = 0
+
+    def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        self._marked.clear()
+
+    def stats(self) -> Dict[str, float]:
+        flushes = max(self.flushes, 1)
+        return {
+            "flushes": self.flushes,
+            "datagrams_received_per_flush": self.datagrams_received / flushes,
+            "packets_sent_per_flush": self.packets_sent / flushes,
+            "max_datagrams_received_per_flush": self.max_datagrams_received,
+            "max_packets_sent_per_flush": self.max_packets_sent,
+        }
+
+
 class QuicFactorySocket(asyncio.DatagramProtocol):
     def __init__(
         self, quic: QuicConnection, stream_handler: Optional[QuicStreamHandler] = None
@@ -19,6 +79,11 @@ class QuicFactorySocket(asyncio.DatagramProtocol):
         self._loop = loop
         self._ping_waiters: Dict[int, asyncio.Future[None]] = {}
         self._quic = quic
+        # set by QuicServer when sends are batched, when transmits are coalesced
+        # and when its connections share a timer wheel
+        self._sender: Optional[UdpBatchSender] = None
+        self._coalescer: Optional[TransmitCoalescer] = None
+        self._timer_wheel: Optional[TimerWheel] = None
         self._stream_readers: Dict[int, asyncio.StreamReader] = {}
         self._timer: Optional[asyncio.TimerHandle] = None
         self._timer_at: Optional[float] = None
@@ -70,19 +135,31 @@ class QuicFactorySocket(asyncio.DatagramProtocol):
         self.transmit()
         await asyncio.shield(waiter)
 
-    def transmit(self) -> None:
+    def transmit(self) -> int:
+        # returns the number of datagrams sent
         self._transmit_task = None
 
-        for data, addr in self._quic.datagrams_to_send(now=self._loop.time()):
-            self._transport.sendto(data, addr)
+        datagrams = self._quic.datagrams_to_send(now=self._loop.time())
+        if self._sender is not None:
+            self._sender.send(datagrams)
+        else:
+            for data, addr in datagrams:
+                self._transport.sendto(data, addr)
         # re-arm timer
         timer_at = self._quic.get_timer()
-        if self._timer is not None and self._timer_at != timer_at:
-            self._timer.cancel()
-            self._timer = None
-        if self._timer is None and timer_at is not None:
-            self._timer = self._loop.call_at(timer_at, self._handle_timer)
+        if self._timer_wheel is not None:
+            if timer_at is None:
+                self._timer_wheel.cancel(self)
+            elif timer_at != self._timer_at:
+                self._timer_wheel.schedule(self, timer_at, self._handle_timer)
+        else:
+            if self._timer is not None and self._timer_at != timer_at:
+                self._timer.cancel()
+                self._timer = None
+            if self._timer is None and timer_at is not None:
+                self._timer = self._loop.call_at(timer_at, self._handle_timer)
         self._timer_at = timer_at
+        return len(datagrams)
 
     async def wait_closed(self) -> None:
         await self._closed.wait()
@@ -102,7 +179,15 @@ class QuicFactorySocket(asyncio.DatagramProtocol):
     def datagram_received(self, data: Union[bytes, Text], addr: NetworkAddress) -> None:
         self._quic.receive_datagram(cast(bytes, data), addr, now=self._loop.time())
         self._process_events()
-        self.transmit()
+        self._schedule_transmit(1)
+
+    def datagrams_received(self, datagrams: List[Tuple[bytes, NetworkAddress]]) -> None:
+        # a burst read at once by the server, answered with a single transmit
+        now = self._loop.time()
+        for data, addr in datagrams:
+            self._quic.receive_datagram(data, addr, now=now)
+        self._process_events()
+        self._schedule_transmit(len(datagrams))
 
     #overridable
     def quic_event_received(self, event: events.QuicEvent) -> None:
@@ -135,7 +220,7 @@ class QuicFactorySocket(asyncio.DatagramProtocol):
         self._timer_at = None
         self._quic.handle_timer(now=now)
         self._process_events()
-        self.transmit()
+        self._schedule_transmit()
 
     def _process_events(self) -> None:
         event = self._quic.next_event()
@@ -172,8 +257,18 @@ class QuicFactorySocket(asyncio.DatagramProtocol):
             self.quic_event_received(event)
             event = self._quic.next_event()
 
+    def _schedule_transmit(self, received: int = 0) -> None:
+        # after received datagrams or a timer: transmits now, or at the next
+        # flush when transmits are coalesced
+        if self._coalescer is not None:
+            self._coalescer.mark(self, received)
+        else:
+            self.transmit()
+
     def _transmit_soon(self) -> None:
-        if self._transmit_task is None:
+        if self._coalescer is not None:
+            self._coalescer.mark(self)
+        elif self._transmit_task is None:
             self._transmit_task = self._loop.call_soon(self.transmit)
 
 
@@ -0,0 +1,181 @@
+import asyncio
+import math
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+# A hierarchical timer wheel shared by the connections of a server, in place of
+# one loop.call_at() handle per connection that is cancelled and created again
+# every time the connection's timer moves.
+#
+# Time is counted in ticks of `resolution` seconds. A timer goes in one of
+# LEVELS wheels of SLOTS slots: the level is the highest base SLOTS digit in
+# which its tick differs from the current one, the slot that digit. When the
+# current tick reaches the start of a slot at level n > 0, the timers in it
+# are moved down to the lower levels, and the timers of a slot at level 0 are
+# due. Setting, moving and cancelling a timer are dict operations, and one
+# loop.call_at() handle, for the earliest slot, wakes the wheel up.
+
+SLOT_BITS = 8
+SLOTS = 1 << SLOT_BITS
+LEVELS = 4
+DEFAULT_RESOLUTION = 0.001
+
+TimerCallback = Callable[[], None]
+
+
+class TimerWheel:
+    """
+    Timers keyed by their owner, at most one per key. A timer fires at the
+    first tick at or after its deadline, never before it.
+    """
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None,
+                 resolution: float = DEFAULT_RESOLUTION) -> None:
+        self._loop = loop or asyncio.get_event_loop()
+        self._resolution = resolution
+        self._tick = int(self._loop.time() / resolution)
+        self._wheels: List[List[Dict[Hashable, TimerCallback]]] = [
+            [{} for _ in range(SLOTS)] for _ in range(LEVELS)]
+        # timers past the range of the top level
+        self._overflow: Dict[Hashable, TimerCallback] = {}
+        self._counts = [0] * LEVELS
+        # key to (tick, level, slot), level None for the overflow
+        self._timers: Dict[Hashable, Tuple[int, Optional[int], int]] = {}
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+        self._wakeup_tick: Optional[int] = None
+        self._firing = False
+
+        # timers fired, wakeups of the wheel, loop handles created for them
+        self.fired = 0
+        self.wakeups = 0
+        self.handles = 0
+
+    def __len__(self) -> int:
+        return len(self._timers)
+
+    def schedule(self, key: Hashable, deadline: float, callback: TimerCallback) -> None:
+        # sets the timer of key, replacing the one it had
+        if key in self._timers:
+            self._remove(key)
+        tick = max(math.ceil(deadline / self._resolution), self._tick + 1)
+        self._insert(key, tick, callback)
+        # while firing, the wheel is armed once they have all run
+        if not self._firing and (self._wakeup_tick is None or tick < self._wakeup_tick):
+            self._arm(tick)
+
+    def cancel(self, key: Hashable) -> None:
+        if key in self._timers:
+            self._remove(key)
+
+    def close(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+            self._wakeup = None
+            self._wakeup_tick = None
+        for wheel in self._wheels:
+            for slot in wheel:
+                slot.clear()
+        self._overflow.clear()
+        self._timers.clear()
+        self._counts = [0] * LEVELS
+
+    # private
+
+    def _insert(self, key: Hashable, tick: int, callback: TimerCallback) -> None:
+        level = max((tick ^ self._tick).bit_length() - 1, 0) // SLOT_BITS
+        if level >= LEVELS:
+            self._overflow[key] = callback
+            self._timers[key] = (tick, None, 0)
+            return
+        index = (tick >> (level * SLOT_BITS)) & (SLOTS - 1)
+        self._wheels[level][index][key] = callback
+        self._counts[level] += 1
+        self._timers[key] = (tick, level, index)
+
+    def _remove(self, key: Hashable) -> TimerCallback:
+        tick, level, index = self._timers.pop(key)
+        if level is None:
+            return self._overflow.pop(key)
+        self._counts[level] -= 1
+        return self._wheels[level][index].pop(key)
+
+    def _arm(self, tick: int) -> None:
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+        self._wakeup_tick = tick
+        self._wakeup = self._loop.call_at(tick * self._resolution, self._run)
+        self.handles += 1
+
+    def _run(self) -> None:
+        # the loop runs call_at() handles up to its clock resolution early, the
+        # tick woken up for counts as reached
+        target = max(int(self._loop.time() / self._resolution), self._wakeup_tick)
+        self._wakeup = None
+        self._wakeup_tick = None
+        self.wakeups += 1
+
+        due: List[TimerCallback] = []
+        while self._tick < target:
+            self._step(target, due)
+        self._firing = True
+        try:
+            for callback in due:
+                callback()
+        finally:
+            self._firing = False
+        self.fired += len(due)
+
+        if self._timers:
+            self._arm(self._next_tick())
+
+    def _step(self, target: int, due: List[TimerCallback]) -> None:
+        # advances by one tick, or straight to the last tick before the next
+        # slot with timers in it when the levels below it are empty
+        counts = self._counts
+        lowest = 0
+        while lowest < LEVELS and not counts[lowest]:
+            lowest += 1
+        if lowest == LEVELS and not self._overflow:
+            self._tick = target
+            return
+        if lowest:
+            last = self._tick | ((1 << (lowest * SLOT_BITS)) - 1)
+            if last >= target:
+                self._tick = target
+                return
+            self._tick = last
+
+        self._tick += 1
+        tick = self._tick
+        if tick & ((1 << (LEVELS * SLOT_BITS)) - 1) == 0:
+            self._cascade(self._overflow)
+        for level in range(LEVELS - 1, 0, -1):
+            if tick & ((1 << (level * SLOT_BITS)) - 1) == 0:
+                index = (tick >> (level * SLOT_BITS)) & (SLOTS - 1)
+                self._cascade(self._wheels[level][index])
+
+        slot = self._wheels[0][tick & (SLOTS - 1)]
+        if slot:
+            for key in list(slot):
+                due.append(self._remove(key))
+
+    def _cascade(self, slot: Dict[Hashable, TimerCallback]) -> None:
+        # moves the timers of a slot down, relative to the current tick
+        for key in list(slot):
+            tick = self._timers[key][0]
+            callback = self._remove(key)
+            self._insert(key, max(tick, self._tick), callback)
+
+    def _next_tick(self) -> int:
+        # the first tick at which the wheel has something to do: the start of
+        # the next slot with timers in the lowest level in use. The slots of a
+        # level are all ahead of the current one in this turn of the wheel,
+        # and those of the levels above it are past the end of the turn.
+        for level in range(LEVELS):
+            if self._counts[level]:
+                span = level * SLOT_BITS
+                base = self._tick >> span
+                wheel = self._wheels[level]
+                for offset in range(1, SLOTS - (base & (SLOTS - 1))):
+                    if wheel[(base + offset) & (SLOTS - 1)]:
+                        return (base + offset) << span
+        span = LEVELS * SLOT_BITS
+        return ((self._tick >> span) + 1) << span
@@ -0,0 +1,409 @@
+import asyncio
+import ctypes
+import errno
+import socket
+import struct
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+# Batched UDP input and output for the QUIC server.
+#
+# Output, for QuicFactorySocket.transmit(): on Linux a run of equal
+# size datagrams to one peer goes out as a single UDP GSO (generic
+# segmentation offload) send when the kernel supports it, and optionally the
+# other datagrams produced by one transmit with a single sendmmsg(2) call.
+# Anything that cannot be sent right away, and everything on other platforms,
+# goes through the asyncio transport, which queues it until the socket is
+# writable.
+#
+# sendmmsg only saves the system call entry per datagram, and filling in its
+# headers from Python costs about as much, so it is off by default. GSO also
+# saves the trip down the network stack per datagram.
+#
+# Input: asyncio reads one datagram each time the socket is readable. After it
+# has, UdpBatchReceiver reads what else is queued on the socket into buffers
+# reused from one call to the next, so QuicServer can hand a whole burst to
+# each connection at once. As with sendmmsg, reading them with one recvmmsg(2)
+# call costs more in Python than a recvfrom_into() per datagram, so it is off
+# by default.
+
+SOL_UDP = 17
+UDP_SEGMENT = 103
+# limits of the kernel for one GSO send
+GSO_MAX_SEGMENTS = 64
+GSO_MAX_BYTES = 65000
+# datagrams per sendmmsg call, at most UIO_MAXIOV, and bytes they are copied
+# into for the call
+SENDMMSG_MAX = 1024
+SENDMMSG_BYTES = 1 << 20
+# encoded peer addresses kept
+ADDRESS_CACHE_SIZE = 4096
+# datagrams per recvmmsg call and the size of each receive buffer, larger than
+# any datagram a QUIC peer sends on a 1500 byte MTU path; longer ones are dropped
+RECV_BATCH = 64
+RECV_DATAGRAM_SIZE = 2048
+# datagrams read per wakeup, past it the rest waits for the next one so that
+# the other callbacks of the loop get to run
+RECV_MAX_DATAGRAMS = 256
+# struct sockaddr_storage
+SOCKADDR_SIZE = 128
+
+# errors meaning the kernel or the interface cannot do GSO after all
+_GSO_ERRORS = (errno.EIO, errno.EINVAL, errno.EOPNOTSUPP)
+
+# (host, port) or (host, port, flowinfo, scope_id), as aioquic has them
+NetworkAddress = Tuple[Any, ...]
+
+
+class _iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _msghdr), ("msg_len", ctypes.c_uint)]
+
+
+def _libc_function(name: str):
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        return getattr(ctypes.CDLL(None, use_errno=True), name)
+    except (AttributeError, OSError):
+        return None
+
+
+_sendmmsg = _libc_function("sendmmsg")
+if _sendmmsg is not None:
+    _sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    _sendmmsg.restype = ctypes.c_int
+
+_recvmmsg = _libc_function("recvmmsg")
+if _recvmmsg is not None:
+    _recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    _recvmmsg.restype = ctypes.c_int
+
+_IOVEC_SIZE = ctypes.sizeof(_iovec)
+_MMSGHDR_SIZE = ctypes.sizeof(_mmsghdr)
+_MSG_IOV_OFFSET = _msghdr.msg_iov.offset
+_MSG_NAMELEN_OFFSET = _msghdr.msg_namelen.offset
+# msg_namelen, msg_flags and msg_len of a struct mmsghdr, read in one go
+_MMSG_RESULT = struct.Struct("=I%dxi%dxI" % (
+    _msghdr.msg_flags.offset - _MSG_NAMELEN_OFFSET - 4,
+    _mmsghdr.msg_len.offset - _msghdr.msg_flags.offset - 4))
+
+
+def _buffer(size: int) -> Tuple[bytearray, int]:
+    # a bytearray and its address, valid as long as the bytearray is not resized
+    buffer = bytearray(size)
+    return buffer, ctypes.addressof((ctypes.c_char * size).from_buffer(buffer))
+
+
+def encode_sockaddr(family: int, addr: NetworkAddress) -> bytes:
+    # struct sockaddr_in or sockaddr_in6 of a numeric address
+    if family == socket.AF_INET6:
+        host = addr[0] if ":" in addr[0] else "::ffff:" + addr[0]
+        flowinfo = addr[2] if len(addr) > 2 else 0
+        scope_id = addr[3] if len(addr) > 3 else 0
+        return (struct.pack("=H", family) + struct.pack("!HI", addr[1], flowinfo)
+                + socket.inet_pton(socket.AF_INET6, host) + struct.pack("=I", scope_id))
+    return struct.pack("=H", family) + struct.pack("!H", addr[1]) + socket.inet_pton(socket.AF_INET, addr[0]) + bytes(8)
+
+
+def decode_sockaddr(raw: bytes) -> NetworkAddress:
+    # the address of a struct sockaddr_in or sockaddr_in6, as socket.recvfrom() has it
+    family, = struct.unpack_from("=H", raw)
+    if family == socket.AF_INET6:
+        port, flowinfo = struct.unpack_from("!HI", raw, 2)
+        scope_id, = struct.unpack_from("=I", raw, 24)
+        host = socket.inet_ntop(socket.AF_INET6, raw[8:24])
+        if scope_id:
+            host = socket.getnameinfo((host, port, flowinfo, scope_id), socket.NI_NUMERICHOST)[0]
+        return host, port, flowinfo, scope_id
+    port, = struct.unpack_from("!H", raw, 2)
+    return socket.inet_ntop(socket.AF_INET, raw[4:8]), port
+
+
+def gso_supported(sock: socket.socket) -> bool:
+    try:
+        sock.getsockopt(SOL_UDP, UDP_SEGMENT)
+    except OSError:
+        return False
+    return True
+
+
+class UdpBatchSender:
+    """
+    Sends the datagrams of a transport in batches, see send(). Created with
+    create(), which returns None where batching is not available.
+    """
+    def __init__(self, transport: asyncio.DatagramTransport, gso: bool = True, sendmmsg: bool = False) -> None:
+        sock = transport.get_extra_info("socket")
+        self._transport = transport
+        # a socket of our own on the same file, the one of the transport
+        # does not allow sendmsg()
+        self._sock = socket.fromfd(sock.fileno(), sock.family, sock.type)
+        self._sock.setblocking(False)
+        self._fd = self._sock.fileno()
+        self._family = sock.family
+        # peer address: (struct sockaddr, its address, its length)
+        self._addresses: Dict[NetworkAddress, Tuple[ctypes.Array, int, int]] = {}
+        self.gso = gso and gso_supported(self._sock)
+        self.sendmmsg = sendmmsg and _sendmmsg is not None
+
+        if self.sendmmsg:
+            # the headers of a sendmmsg call, filled in with struct rather than
+            # through ctypes attributes, and the datagrams copied next to each other
+            self._msgs, self._msgs_addr = _buffer(SENDMMSG_MAX * _MMSGHDR_SIZE)
+            self._iovs, self._iovs_addr = _buffer(SENDMMSG_MAX * _IOVEC_SIZE)
+            self._data, self._data_addr = _buffer(SENDMMSG_BYTES)
+            for i in range(SENDMMSG_MAX):
+                struct.pack_into("@PN", self._msgs, i * _MMSGHDR_SIZE + _MSG_IOV_OFFSET,
+                                 self._iovs_addr + i * _IOVEC_SIZE, 1)
+
+        # datagrams sent, system calls made for them, datagrams handed to the transport
+        self.datagrams = 0
+        self.syscalls = 0
+        self.fallbacks = 0
+
+    @classmethod
+    def create(cls, transport: asyncio.DatagramTransport, gso: bool = True,
+               sendmmsg: bool = False) -> Optional["UdpBatchSender"]:
+        sock = transport.get_extra_info("socket")
+        if not sys.platform.startswith("linux") or sock is None or sock.family not in (socket.AF_INET, socket.AF_INET6):
+            return None
+        sender = cls(transport, gso, sendmmsg)
+        if not sender.gso and not sender.sendmmsg:
+            sender.close()
+            return None
+        return sender
+
+    def close(self) -> None:
+        self._sock.close()
+
+    def send(self, datagrams: List[Tuple[bytes, NetworkAddress]]) -> None:
+        if self._transport.get_write_buffer_size():
+            # datagrams are still queued in the transport, they go first
+            sent = 0
+        else:
+            sent = self._send(datagrams)
+        if sent < len(datagrams):
+            self._fallback(datagrams[sent:])
+
+    def _send(self, datagrams: List[Tuple[bytes, NetworkAddress]]) -> int:
+        # returns how many datagrams, from the first, were sent
+        i = 0
+        batch_start = 0
+        while i < len(datagrams):
+            run_end = self._gso_run(datagrams, i) if self.gso else i + 1
+            if run_end - i == 1:
+                i += 1
+                continue
+
+            sent = self._send_batch(datagrams, batch_start, i)
+            if sent < i:
+                return sent
+            try:
+                self._send_gso(datagrams, i, run_end)
+            except OSError as exc:
+                if exc.errno not in _GSO_ERRORS:
+                    return i
+                self.gso = False
+                batch_start = i
+                continue
+            i = batch_start = run_end
+
+        return self._send_batch(datagrams, batch_start, len(datagrams))
+
+    def _gso_run(self, datagrams: List[Tuple[bytes, NetworkAddress]], start: int) -> int:
+        # end of the datagrams from start that can be sent as one GSO buffer:
+        # same peer, same size, only the last one may be shorter
+        data, addr = datagrams[start]
+        size = len(data)
+        total = size
+        end = start + 1
+        while end < len(datagrams) and end - start < GSO_MAX_SEGMENTS:
+            data, next_addr = datagrams[end]
+            if next_addr != addr or len(data) > size or total + len(data) > GSO_MAX_BYTES:
+                break
+            total += len(data)
+            end += 1
+            if len(data) < size:
+                break
+        return end
+
+    def _send_gso(self, datagrams: List[Tuple[bytes, NetworkAddress]], start: int, end: int) -> None:
+        addr = datagrams[start][1]
+        size = len(datagrams[start][0])
+        self._sock.sendmsg([data for data, _ in datagrams[start:end]],
+                           [(SOL_UDP, UDP_SEGMENT, struct.pack("=H", size))], 0, addr)
+        self.datagrams += end - start
+        self.syscalls += 1
+
+    def _send_batch(self, datagrams: List[Tuple[bytes, NetworkAddress]], start: int, end: int) -> int:
+        # sends datagrams[start:end] with sendmmsg, or one at a time, returns
+        # the end of those sent
+        if not self.sendmmsg:
+            for i in range(start, end):
+                try:
+                    self._sock.sendto(*datagrams[i])
+                except OSError:
+                    return i
+                self.datagrams += 1
+                self.syscalls += 1
+            return end
+
+        while start < end:
+            n = 0
+            offset = 0
+            while start + n < end and n < SENDMMSG_MAX:
+                data, addr = datagrams[start + n]
+                size = len(data)
+                if offset + size > SENDMMSG_BYTES:
+                    if n:
+                        break
+                    # larger than the whole buffer, cannot be a UDP datagram
+                    return start
+                self._data[offset:offset + size] = data
+                struct.pack_into("@PN", self._iovs, n * _IOVEC_SIZE, self._data_addr + offset, size)
+                _, name_addr, name_len = self._address(addr)
+                struct.pack_into("@PI", self._msgs, n * _MMSGHDR_SIZE, name_addr, name_len)
+                offset += size
+                n += 1
+            sent = _sendmmsg(self._fd, self._msgs_addr, n, 0)
+            self.syscalls += 1
+            if sent <= 0:
+                break
+            self.datagrams += sent
+            start += sent
+        return start
+
+    def _address(self, addr: NetworkAddress) -> Tuple[ctypes.Array, int, int]:
+        name = self._addresses.get(addr)
+        if name is None:
+            if len(self._addresses) >= ADDRESS_CACHE_SIZE:
+                self._addresses.clear()
+            raw = encode_sockaddr(self._family, addr)
+            sockaddr = (ctypes.c_char * len(raw)).from_buffer_copy(raw)
+            name = self._addresses[addr] = (sockaddr, ctypes.addressof(sockaddr), len(raw))
+        return name
+
+    def _fallback(self, datagrams: List[Tuple[bytes, NetworkAddress]]) -> None:
+        self.fallbacks += len(datagrams)
+        for data, addr in datagrams:
+            self._transport.sendto(data, addr)
+
+
+class UdpBatchReceiver:
+    """
+    Reads the datagrams queued on the socket of a transport in batches, see
+    receive(). Created with create(), which returns None where the socket
+    cannot be shared with the transport.
+    """
+    def __init__(self, transport: asyncio.DatagramTransport, recvmmsg: bool = False,
+                 batch: int = RECV_BATCH, size: int = RECV_DATAGRAM_SIZE) -> None:
+        sock = transport.get_extra_info("socket")
+        self._sock = socket.fromfd(sock.fileno(), sock.family, sock.type)
+        self._sock.setblocking(False)
+        self._fd = self._sock.fileno()
+        self._size = size
+        # raw struct sockaddr to address
+        self._addresses: Dict[bytes, NetworkAddress] = {}
+        self.recvmmsg = recvmmsg and _recvmmsg is not None
+
+        # the receive buffers, reused for every call
+        self._batch = batch
+        self._data, data_addr = _buffer(batch * size)
+        self._view = memoryview(self._data)
+        if self.recvmmsg:
+            self._msgs, self._msgs_addr = _buffer(batch * _MMSGHDR_SIZE)
+            self._iovs, iovs_addr = _buffer(batch * _IOVEC_SIZE)
+            self._names, names_addr = _buffer(batch * SOCKADDR_SIZE)
+            self._names_view = memoryview(self._names)
+            for i in range(batch):
+                struct.pack_into("@PN", self._iovs, i * _IOVEC_SIZE, data_addr + i * size, size)
+                struct.pack_into("@PI", self._msgs, i * _MMSGHDR_SIZE, names_addr + i * SOCKADDR_SIZE, SOCKADDR_SIZE)
+                struct.pack_into("@PN", self._msgs, i * _MMSGHDR_SIZE + _MSG_IOV_OFFSET,
+                                 iovs_addr + i * _IOVEC_SIZE, 1)
+
+        # datagrams read, system calls made for them, datagrams dropped by
+        # recvmmsg as too long
+        self.datagrams = 0
+        self.syscalls = 0
+        self.truncated = 0
+
+    @classmethod
+    def create(cls, transport: asyncio.DatagramTransport, recvmmsg: bool = False) -> Optional["UdpBatchReceiver"]:
+        sock = transport.get_extra_info("socket")
+        if sys.platform == "win32" or sock is None or sock.family not in (socket.AF_INET, socket.AF_INET6):
+            return None
+        return cls(transport, recvmmsg)
+
+    def close(self) -> None:
+        self._sock.close()
+
+    def receive(self, limit: int = RECV_MAX_DATAGRAMS) -> List[Tuple[bytes, NetworkAddress]]:
+        # the datagrams queued on the socket, at most limit of them, without waiting
+        datagrams: List[Tuple[bytes, NetworkAddress]] = []
+        while len(datagrams) < limit:
+            want = min(self._batch, limit - len(datagrams))
+            if self.recvmmsg:
+                got = self._receive_batch(datagrams, want)
+            else:
+                got = self._receive_each(datagrams, want)
+            if got < want:
+                break
+        return datagrams
+
+    def _receive_batch(self, datagrams: List[Tuple[bytes, NetworkAddress]], want: int) -> int:
+        count = _recvmmsg(self._fd, self._msgs_addr, want, socket.MSG_DONTWAIT, None)
+        self.syscalls += 1
+        if count <= 0:
+            return 0
+        names = self._names_view
+        for i in range(count):
+            offset = i * _MMSGHDR_SIZE + _MSG_NAMELEN_OFFSET
+            name_len, flags, length = _MMSG_RESULT.unpack_from(self._msgs, offset)
+            # the kernel has set msg_namelen to the length of the address
+            struct.pack_into("=I", self._msgs, offset, SOCKADDR_SIZE)
+            if flags & socket.MSG_TRUNC:
+                self.truncated += 1
+                continue
+            start = i * self._size
+            name = i * SOCKADDR_SIZE
+            datagrams.append((bytes(self._view[start:start + length]), self._address(bytes(names[name:name + name_len]))))
+        self.datagrams += count
+        return count
+
+    def _receive_each(self, datagrams: List[Tuple[bytes, NetworkAddress]], want: int) -> int:
+        # without recvmmsg, one recvfrom_into per datagram into the first buffer.
+        # A datagram cut short here fails authentication and is dropped by QUIC.
+        buffer = self._view[:self._size]
+        for i in range(want):
+            self.syscalls += 1
+            try:
+                length, addr = self._sock.recvfrom_into(buffer)
+            except OSError:
+                return i
+            self.datagrams += 1
+            datagrams.append((bytes(buffer[:length]), addr))
+        return want
+
+    def _address(self, raw: bytes) -> NetworkAddress:
+        addr = self._addresses.get(raw)
+        if addr is None:
+            if len(self._addresses) >= ADDRESS_CACHE_SIZE:
+                self._addresses.clear()
+            addr = self._addresses[raw] = decode_sockaddr(raw)
+        return addr
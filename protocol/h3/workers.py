@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import os
+import signal
+import socket
+from typing import Callable, Dict, List, Optional, Tuple
+
+from aioquic.quic.connection import NetworkAddress, QuicConnection
+
+from .udp import RECV_MAX_DATAGRAMS, decode_sockaddr, encode_sockaddr
+
+logger = logging.getLogger("workers")
+
+# A server run as several worker processes on one port with SO_REUSEPORT. The
+# kernel spreads the datagrams over the workers by the client's address, so a
+# connection stays with the worker that got its first datagram until the
+# client's address changes, after NAT rebinding or a migration. Then its
+# datagrams can land on another worker. The first byte of every connection ID
+# a worker issues is its number, and a worker that does not have the
+# connection of a short header datagram forwards it to the worker named by
+# its destination connection ID, over a Unix datagram socket.
+
+MAX_WORKERS = 256
+# a forwarded datagram: length of the address, struct sockaddr, datagram
+FORWARD_MAX_BYTES = 1 + 128 + 65536
+
+
+def worker_cid(worker_id: int, length: int) -> bytes:
+    return bytes([worker_id]) + os.urandom(length - 1)
+
+
+class WorkerQuicConnection(QuicConnection):
+    """
+    A server side QuicConnection whose connection IDs start with the number of
+    the worker it belongs to.
+    """
+    def __init__(self, *args, worker_id: int, **kwargs) -> None:
+        self._worker_id = worker_id
+        super().__init__(*args, **kwargs)
+        # nothing has been sent yet, the first connection ID can still change
+        first = self._host_cids[0]
+        first.cid = worker_cid(worker_id, len(first.cid))
+        self.host_cid = first.cid
+        self._local_initial_source_connection_id = first.cid
+
+    def _replenish_connection_ids(self) -> None:
+        start = len(self._host_cids)
+        super()._replenish_connection_ids()
+        for connection_id in self._host_cids[start:]:
+            connection_id.cid = worker_cid(self._worker_id, len(connection_id.cid))
+
+
+class WorkerRouter:
+    """
+    The sockets workers forward datagrams to each other with. Created before
+    forking, then bound to its worker in each process with bind().
+    """
+    def __init__(self, workers: int) -> None:
+        if not 0 < workers <= MAX_WORKERS:
+            raise ValueError("between 1 and %d workers, not %d" % (MAX_WORKERS, workers))
+        self.workers = workers
+        self.worker_id: Optional[int] = None
+        # (read end, write end) of each worker
+        self._sockets: List[Tuple[socket.socket, socket.socket]] = []
+        for _ in range(workers):
+            pair = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+            for sock in pair:
+                sock.setblocking(False)
+            self._sockets.append(pair)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+        # datagrams sent to other workers, received from them, dropped as
+        # their socket was full
+        self.forwarded = 0
+        self.received = 0
+        self.dropped = 0
+
+    def bind(self, worker_id: int) -> None:
+        self.worker_id = worker_id
+        for i, (reader, _) in enumerate(self._sockets):
+            if i != worker_id:
+                reader.close()
+
+    def owner(self, cid: bytes) -> Optional[int]:
+        # the worker that issued a connection ID, None when no worker did
+        if not cid or cid[0] >= self.workers:
+            return None
+        return cid[0]
+
+    def start(self, datagram_received: Callable[[bytes, NetworkAddress], None]) -> None:
+        # hands the datagrams forwarded to this worker to datagram_received
+        self._loop = asyncio.get_event_loop()
+        self._loop.add_reader(self._sockets[self.worker_id][0].fileno(), self._read, datagram_received)
+
+    def forward(self, worker_id: int, data: bytes, addr: NetworkAddress) -> None:
+        name = encode_sockaddr(socket.AF_INET6 if len(addr) == 4 else socket.AF_INET, addr)
+        try:
+            self._sockets[worker_id][1].send(bytes([len(name)]) + name + data)
+        except OSError:
+            self.dropped += 1
+            return
+        self.forwarded += 1
+
+    def close(self) -> None:
+        if self._loop is not None:
+            self._loop.remove_reader(self._sockets[self.worker_id][0].fileno())
+            self._loop = None
+        for reader, writer in self._sockets:
+            reader.close()
+            writer.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {"forwarded": self.forwarded, "received": self.received, "dropped": self.dropped}
+
+    def _read(self, datagram_received: Callable[[bytes, NetworkAddress], None]) -> None:
+        sock = self._sockets[self.worker_id][0]
+        for _ in range(RECV_MAX_DATAGRAMS):
+            try:
+                message = sock.recv(FORWARD_MAX_BYTES)
+            except BlockingIOError:
+                return
+            name_end = 1 + message[0]
+            self.received += 1
+            datagram_received(message[name_end:], decode_sockaddr(message[1:name_end]))
+
+
+def fork_workers(count: int, run: Callable[[int], None]) -> None:
+    # runs run(worker_id) in count child processes and returns once they have
+    # all exited. SIGTERM to the parent is passed on, in the children it
+    # raises KeyboardInterrupt like SIGINT does.
+    children: Dict[int, int] = {}
+    for worker_id in range(count):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+            code = 0
+            try:
+                run(worker_id)
+            except KeyboardInterrupt:
+                pass
+            except BaseException:
+                logger.exception("worker %d failed", worker_id)
+                code = 1
+            finally:
+                logging.shutdown()
+                os._exit(code)
+        children[pid] = worker_id
+
+    def stop(signum, frame) -> None:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    while children:
+        try:
+            pid, status = os.wait()
+        except KeyboardInterrupt:
+            # the terminal sent SIGINT to the children too
+            continue
+        worker_id = children.pop(pid, None)
+        if worker_id is not None and os.WIFEXITED(status) and os.WEXITSTATUS(status):
+            logger.warning("worker %d exited with status %d", worker_id, os.WEXITSTATUS(status))
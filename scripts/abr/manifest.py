@@ -10,6 +10,9 @@ from threading import Thread
 from subprocess import call
 from typing import Optional
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from adaptive.manifest import Manifest
+
 start_time = time.time()
 
 source = 'Big_Buck_Bunny_1080_10s_20MB.mp4'
@@ -189,15 +192,18 @@ def prepare_mpd(
     with open(filename, 'w') as f:
         json.dump(manifest, f, indent=4)
 
+    # same manifest in the binary format, memory mapped by the server and the player
+    Manifest.from_dict(manifest).save_binary(os.path.splitext(filename)[0] + '.bin')
+
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--prefix', '-p', help='Prefix')
-    parser.add_argument('--seg_duration', '-sd', help='segment duration in s')
-    parser.add_argument('--start_number', '-sn', help='Start number')
-    parser.add_argument('--total_duration', '-td', help='Total duration in seconds')
-    parser.add_argument('--timescale', '-ts', help='Timescale is time in ms')
-    parser.add_argument('--total_representation', '-tr', help='Total number of representation')
+    parser.add_argument('--seg_duration', '-sd', type=int, help='segment duration in s')
+    parser.add_argument('--start_number', '-sn', type=int, help='Start number')
+    parser.add_argument('--total_duration', '-td', type=int, help='Total duration in seconds')
+    parser.add_argument('--timescale', '-ts', type=int, help='Timescale is time in ms')
+    parser.add_argument('--total_representation', '-tr', type=int, help='Total number of representation')
     parser.add_argument('--action', required=True, help='Action to be performed by the script. Possible actions are: encode, segmentation, mpd')
     parser.add_argument('--fps', help="Frames per second to use for re-encoding")
     parser.add_argument('-i', '--input',
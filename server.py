@@ -21,6 +21,43 @@ from aioquic.h3.connection import H3_ALPN, H3Connection
 from servers.h3_server import SessionTicketStore, HttpServerProtocol
 
 from protocol.h3.server import start_server
+from protocol.h3.workers import WorkerRouter, fork_workers
+
+
+def run(args, configuration: QuicConfiguration, router: Optional[WorkerRouter] = None) -> None:
+    ticket_store = SessionTicketStore()
+
+    if uvloop is not None:
+        uvloop.install()
+    loop = asyncio.get_event_loop()
+    server = loop.run_until_complete(
+        start_server(
+            args.host,
+            args.port,
+            configuration=configuration,
+            create_protocol=HttpServerProtocol,
+            session_ticket_fetcher=ticket_store.pop,
+            session_ticket_handler=ticket_store.add,
+            retry=args.retry,
+            batch_send=args.batch_send,
+            sendmmsg=args.sendmmsg,
+            batch_recv=args.batch_recv,
+            recvmmsg=args.recvmmsg,
+            recv_buffer=args.recv_buffer,
+            coalesce=args.coalesce,
+            timer_wheel=args.timer_wheel,
+            router=router,
+        )
+    )
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    worker = "" if router is None else "worker %d: " % router.worker_id
+    if server.coalescer is not None:
+        logging.info("%scoalesced transmits: %s", worker, server.coalescer.stats())
+    if router is not None:
+        logging.info("%sdatagrams passed between workers: %s", worker, router.stats())
 
 
 if __name__ == "__main__":
@@ -73,6 +110,47 @@ if __name__ == "__main__":
     parser.add_argument(
         "--retry", action="store_true", help="send a retry for new connections",
     )
+    parser.add_argument(
+        "--batch-send",
+        action="store_true",
+        help="send runs of datagrams to a client as one UDP GSO buffer (Linux only)",
+    )
+    parser.add_argument(
+        "--sendmmsg",
+        action="store_true",
+        help="with --batch-send, send the other datagrams of a transmit with one sendmmsg call",
+    )
+    parser.add_argument(
+        "--batch-recv",
+        action="store_true",
+        help="read the datagrams queued on the socket together and transmit once per connection",
+    )
+    parser.add_argument(
+        "--recvmmsg",
+        action="store_true",
+        help="with --batch-recv, read them with recvmmsg calls (Linux only)",
+    )
+    parser.add_argument(
+        "--recv-buffer",
+        type=int,
+        help="size of the socket receive buffer (SO_RCVBUF) in bytes",
+    )
+    parser.add_argument(
+        "--coalesce",
+        action="store_true",
+        help="transmit once per event loop iteration for all the connections with something to send",
+    )
+    parser.add_argument(
+        "--timer-wheel",
+        action="store_true",
+        help="keep the timers of all the connections in one timer wheel instead of a loop handle each",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="run this many worker processes on the port with SO_REUSEPORT (defaults to 1)",
+    )
     parser.add_argument(
         "-v", "--verbose", action="store_true", help="increase logging verbosity"
     )
@@ -110,23 +188,15 @@ if __name__ == "__main__":
 
     configuration.load_cert_chain(args.certificate, args.private_key)
 
-    ticket_store = SessionTicketStore()
+    if args.workers > 1:
+        # each worker has its own session tickets, a client resumes only with
+        # the worker that issued its ticket
+        router = WorkerRouter(args.workers)
 
-    if uvloop is not None:
-        uvloop.install()
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(
-        start_server(
-            args.host,
-            args.port,
-            configuration=configuration,
-            create_protocol=HttpServerProtocol,
-            session_ticket_fetcher=ticket_store.pop,
-            session_ticket_handler=ticket_store.add,
-            retry=args.retry,
-        )
-    )
-    try:
-        loop.run_forever()
-    except KeyboardInterrupt:
-        pass
+        def run_worker(worker_id: int) -> None:
+            router.bind(worker_id)
+            run(args, configuration, router)
+
+        fork_workers(args.workers, run_worker)
+    else:
+        run(args, configuration)
@@ -191,7 +191,7 @@ class HttpServerProtocol(QuicFactorySocket):
                     scope=scope,
                     stream_ended=event.stream_ended,
                     stream_id=event.stream_id,
-                    transmit=self.transmit,
+                    transmit=self.transmit if self._coalescer is None else self._transmit_soon,
                 )
             self._handlers[event.stream_id] = handler
             asyncio.ensure_future(handler.run_asgi(application))
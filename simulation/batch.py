@@ -0,0 +1,155 @@
+# Runs the simulator for every (trace, ABR rule, buffer size) combination on a
+# process pool. Each finished session is appended to a JSON lines results file
+# as soon as it completes, sessions already in the file are skipped, so an
+# interrupted sweep picks up where it stopped. A QoE summary per rule and
+# network class (the trace directory, 3Glogs or 4Glogs) is printed at the end.
+
+import argparse
+import json
+import logging
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from glob import glob
+from types import SimpleNamespace
+
+from adaptive import ABR_RULES, Manifest, select_abr_algorithm
+from simulation.simulator import simulate
+
+logger = logging.getLogger("ABR batch")
+
+# per segment lists are left out of the results file
+SUMMARY_KEYS = ['avg_bitrate', 'avg_bitrate_change', 'change_count', 'rebuffer_time', 'rebuffer_count',
+                'startup_delay', 'total_time_played', 'MPC_QOE']
+
+_manifest = None
+_manifest_file = None
+
+
+def _init_worker(manifest_file):
+    global _manifest, _manifest_file
+    _manifest = Manifest.load(manifest_file)
+    _manifest_file = manifest_file
+
+
+def run_job(trace, abr, buffer_size):
+    perf = simulate(_manifest, abr, trace, buffer_size, manifest_file=_manifest_file)
+    result = {k: perf[k] for k in SUMMARY_KEYS}
+    result.update(trace=trace, network=network_class(trace), abr=abr, buffer_size=buffer_size)
+    return result
+
+
+def network_class(trace):
+    return os.path.basename(os.path.dirname(trace))
+
+
+def job_key(result):
+    return (result['trace'], result['abr'], float(result['buffer_size']))
+
+
+def load_results(path):
+    # a line cut short by an interruption is dropped and its job runs again
+    results = []
+    if not os.path.exists(path):
+        return results
+    with open(path) as f:
+        for line in f:
+            try:
+                results.append(json.loads(line))
+            except ValueError:
+                continue
+    return results
+
+
+def run_batch(manifest_file, traces, algorithms, buffer_sizes, results_file, workers=None):
+    results = load_results(results_file)
+    done = set(job_key(r) for r in results)
+    jobs = [(trace, abr, float(buffer_size))
+            for trace in traces for abr in algorithms for buffer_size in buffer_sizes
+            if (trace, abr, float(buffer_size)) not in done]
+    logger.info("%d sessions done, %d to run", len(done), len(jobs))
+
+    if 'FastMPC' in algorithms and jobs:
+        # build the decision table once, before the workers race to do it
+        select_abr_algorithm(Manifest.load(manifest_file), SimpleNamespace(abr='FastMPC', manifest_file=manifest_file))
+
+    # rewrite the file without any partial line before appending to it
+    with open(results_file, "w") as output:
+        for r in results:
+            output.write(json.dumps(r) + "\n")
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(manifest_file,)) as pool:
+            futures = [pool.submit(run_job, *job) for job in jobs]
+            try:
+                for i, future in enumerate(as_completed(futures), 1):
+                    result = future.result()
+                    output.write(json.dumps(result) + "\n")
+                    output.flush()
+                    results.append(result)
+                    if i % 100 == 0 or i == len(futures):
+                        logger.info("%d/%d sessions", i, len(futures))
+            except KeyboardInterrupt:
+                for future in futures:
+                    future.cancel()
+                raise
+
+    return results
+
+
+def summarize(results):
+    # mean of every summary metric per (abr, network class)
+    groups = defaultdict(list)
+    for r in results:
+        groups[(r['abr'], r['network'])].append(r)
+
+    rows = []
+    for (abr, network), group in sorted(groups.items()):
+        n = len(group)
+        rows.append({
+            'abr': abr,
+            'network': network,
+            'sessions': n,
+            'avg_bitrate': sum(r['avg_bitrate'] for r in group) / n,
+            'switches': sum(r['change_count'] for r in group) / n,
+            'rebuffer_time': sum(r['rebuffer_time'] for r in group) / n,
+            'startup_delay': sum(r['startup_delay'] for r in group) / n,
+            'qoe': sum(r['MPC_QOE'] for r in group) / n,
+        })
+    return rows
+
+
+def format_table(rows):
+    lines = ['{:<10} {:<10} {:>8} {:>12} {:>9} {:>13} {:>10} {:>14}'.format(
+        'abr', 'network', 'sessions', 'quality', 'switches', 'rebuffer_s', 'startup_s', 'qoe')]
+    for r in rows:
+        lines.append('{:<10} {:<10} {:>8} {:>12.2f} {:>9.1f} {:>13.2f} {:>10.3f} {:>14.1f}'.format(
+            r['abr'], r['network'], r['sessions'], r['avg_bitrate'], r['switches'],
+            r['rebuffer_time'], r['startup_delay'], r['qoe']))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate every ABR rule over every network trace")
+    parser.add_argument("--manifest-file", type=str, default="htdocs/bbb_m.json", help="Path to the custom manifest file")
+    parser.add_argument("--traces", type=str, nargs="+", default=sorted(glob("traces/*/*.json")),
+                        help="network trace files (default: traces/*/*.json)")
+    parser.add_argument("--abr", type=str, nargs="+", choices=ABR_RULES, default=ABR_RULES, help="ABR rules to run")
+    parser.add_argument("-b", "--buffer-size", type=float, nargs="+", default=[10, 30, 60],
+                        help="buffer sizes for video playback")
+    parser.add_argument("-o", "--output", type=str, default="abr_results.jsonl",
+                        help="results file, existing sessions in it are not run again")
+    parser.add_argument("-j", "--jobs", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="increase logging verbosity")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format="%(asctime)s %(levelname)s %(name)s %(message)s",
+        level=logging.DEBUG if args.verbose else logging.INFO,
+    )
+
+    results = run_batch(args.manifest_file, args.traces, args.abr, args.buffer_size, args.output, args.jobs)
+    print(format_table(summarize(results)))
+
+
+if __name__ == "__main__":
+    main()
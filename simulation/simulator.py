@@ -0,0 +1,292 @@
+# Trace driven, discrete event simulation of a DASH session.
+#
+# Replays a network trace (traces/3Glogs, traces/4Glogs) against an ABR rule
+# and a manifest without any transport: the time to download a segment is
+# computed from the trace bandwidth, and the playback buffer is advanced by that
+# time. The accounting follows DashClient, and the result has the same keys as
+# its perf_parameters, MPC_QOE included. Like the player, it counts the
+# bitrate of a segment as its quality index, and the change from no previous
+# segment (0) to the first one.
+
+import argparse
+import json
+import logging
+import os
+from collections import deque, namedtuple
+from pprint import pformat
+from types import SimpleNamespace
+
+import config
+from adaptive import ABR_RULES, Manifest, select_abr_algorithm
+from adaptive.throughput import PREDICTORS
+
+logger = logging.getLogger("ABR simulator")
+
+# time in s, bandwidth in kbps, latency in ms
+NetworkPeriod = namedtuple('NetworkPeriod', 'time bandwidth latency')
+
+
+def load_trace(path):
+    with open(path) as f:
+        periods = json.load(f)
+    return [NetworkPeriod(time=p['duration_ms'] / 1000, bandwidth=p['bandwidth_kbps'], latency=p['latency_ms'])
+            for p in periods]
+
+
+class NetworkTrace:
+    '''
+    A network following a trace, restarting from the beginning once it runs out.
+    Every request waits for the latency of the period it starts in, then its bytes
+    are sent at the bandwidth of each period in turn.
+    '''
+    def __init__(self, periods):
+        if not any(p.bandwidth > 0 and p.time > 0 for p in periods):
+            raise ValueError("trace has no period with bandwidth")
+        self.periods = periods
+        self.index = 0
+        self.offset = 0.0 # time spent in the current period
+
+    def advance(self, duration):
+        # the network moves on while the client is idle
+        while duration > 0:
+            left = self.periods[self.index].time - self.offset
+            if duration < left:
+                self.offset += duration
+                return
+            duration -= left
+            self.index = (self.index + 1) % len(self.periods)
+            self.offset = 0.0
+
+    def latency(self):
+        # in s, of the current period
+        return self.periods[self.index].latency / 1000
+
+    def download(self, size):
+        # returns the time in s to download size bytes
+        latency = self.latency()
+        self.advance(latency)
+        return latency + self.transfer(size)
+
+    def transfer(self, size):
+        # returns the time in s to send size bytes, latency left out
+        elapsed = 0.0
+        remaining = size * 8 / 1000 # kbits
+        while True:
+            period = self.periods[self.index]
+            left = period.time - self.offset
+            can_send = period.bandwidth * left
+            if remaining <= can_send:
+                duration = remaining / period.bandwidth
+                self.offset += duration
+                return elapsed + duration
+            remaining -= can_send
+            elapsed += left
+            self.index = (self.index + 1) % len(self.periods)
+            self.offset = 0.0
+
+
+class Simulator:
+    '''
+    Up to prefetch segment requests are in flight at once, as DashClient does
+    with --prefetch. Their responses share the link in request order: the
+    bytes of a request start flowing one latency after it is sent, or once the
+    link is done with the requests before it, whichever comes last.
+    '''
+    def __init__(self, manifest, abr, trace, buffer_size=60, prefetch=1):
+        if prefetch < 1:
+            raise ValueError("prefetch must be at least 1, not %d" % prefetch)
+        self.manifest = Manifest.coerce(manifest)
+        self.abr = abr
+        self.network = trace if isinstance(trace, NetworkTrace) else NetworkTrace(trace)
+        self.totalBuffer = float(buffer_size)
+        self.prefetch = prefetch
+        self.segment_Duration = self.manifest.segment_duration
+
+        self.perf_parameters = {}
+        self.perf_parameters['startup_delay'] = 0
+        self.perf_parameters['total_time_elapsed'] = 0
+        self.perf_parameters['bitrate_change'] = []
+        self.perf_parameters['prev_rate'] = 0
+        self.perf_parameters['change_count'] = 0
+        self.perf_parameters['rebuffer_time'] = 0.0
+        self.perf_parameters['avg_bitrate'] = 0.0
+        self.perf_parameters['avg_bitrate_change'] = 0.0
+        self.perf_parameters['rebuffer_count'] = 0
+        self.perf_parameters['tput_observed'] = []
+
+    def run(self):
+        perf = self.perf_parameters
+        self.now = 0.0
+        self.link_time = 0.0 # time up to which the trace has been played
+        self.currBuffer = 0.0
+        self.playing = False
+
+        # the manifest download gives the first throughput sample
+        manifest_size = len(json.dumps(self.manifest.to_dict()))
+        elapsed = self.network.download(manifest_size)
+        self.now = self.link_time = elapsed
+        latest_tput = manifest_size * 8 / 1000 / elapsed
+        total_bytes = manifest_size
+        busy_time = elapsed
+
+        # (segment, quality, size, request time, completion time), in request order
+        inflight = deque()
+        # (completion time, size) of the responses received, for the window throughput
+        completed = deque()
+        total_segments = self.manifest.total_segments
+        segment = 0
+        while segment < total_segments or inflight:
+            room = self.totalBuffer - self.currBuffer - len(inflight) * self.segment_Duration >= self.segment_Duration
+            if segment < total_segments and len(inflight) < self.prefetch and room:
+                playback_stats = {}
+                playback_stats["lastTput_kbps"] = latest_tput
+                playback_stats["currBuffer"] = self.currBuffer
+                playback_stats["segment_Idx"] = segment
+
+                quality = self.abr.NextSegmentQualityIndex(playback_stats)
+                if quality is None or quality < 0:
+                    quality = 0
+                size = self.manifest.segment_size(segment, quality)
+                if not inflight:
+                    busy_since = self.now
+                inflight.append((segment, quality, size, self.now, self.request(size)))
+                segment += 1
+                continue
+
+            if not inflight:
+                # wait for room in the buffer, playback drains it meanwhile
+                self.play(self.currBuffer - (self.totalBuffer - self.segment_Duration))
+                continue
+
+            if self.playing and segment < total_segments and len(inflight) < self.prefetch:
+                # room for one more request may free up before the next response
+                room_level = self.totalBuffer - (len(inflight) + 1) * self.segment_Duration
+                if 0 <= room_level and self.now + self.currBuffer - room_level < inflight[0][4]:
+                    self.play(self.currBuffer - room_level)
+                    continue
+
+            segment_idx, quality, size, requested, completion = inflight.popleft()
+            self.play(completion - self.now)
+            if not inflight:
+                busy_time += self.now - busy_since
+            total_bytes += size
+
+            # throughput of the link over the lifetime of the request, the
+            # responses of the other requests received meanwhile included
+            completed.append((completion, size))
+            while completed[0][0] <= requested:
+                completed.popleft()
+            latest_tput = sum(s for _, s in completed) * 8 / 1000 / (completion - requested)
+
+            if not self.playing:
+                self.playing = True
+                perf['startup_delay'] = self.now
+            self.currBuffer += self.segment_Duration
+
+            # QOE parameters update
+            perf['bitrate_change'].append((segment_idx + 1, quality))
+            perf['tput_observed'].append((segment_idx + 1, size * 8 / 1000 / (completion - requested)))
+            perf['avg_bitrate'] += quality
+            perf['avg_bitrate_change'] += abs(quality - perf['prev_rate'])
+
+            # a switch is a change of quality from the previous segment
+            if len(perf['bitrate_change']) > 1 and perf['bitrate_change'][-2][1] != quality:
+                perf['change_count'] += 1
+            perf['prev_rate'] = quality
+
+        # play out what is left in the buffer
+        self.now += self.currBuffer
+        perf['total_time_elapsed'] = self.now
+        perf['total_time_played'] = self.now
+        # kbps while at least one request was in flight
+        perf['tput_aggregate_kbps'] = total_bytes * 8 / 1000 / busy_time
+
+        perf['avg_bitrate'] /= total_segments
+        if total_segments > 1:
+            perf['avg_bitrate_change'] /= (total_segments - 1)
+        perf['MPC_QOE'] = qoe(perf)
+        return perf
+
+    def request(self, size):
+        # sends a request now, returns the time its response is complete
+        if self.link_time < self.now:
+            self.network.advance(self.now - self.link_time)
+            self.link_time = self.now
+        start = max(self.now + self.network.latency(), self.link_time)
+        self.network.advance(start - self.link_time)
+        self.link_time = start + self.network.transfer(size)
+        return self.link_time
+
+    def play(self, duration):
+        # the client clock moves on by duration, playback drains the buffer
+        if self.playing:
+            if duration > self.currBuffer:
+                self.perf_parameters['rebuffer_time'] += duration - self.currBuffer
+                self.perf_parameters['rebuffer_count'] += 1
+                self.currBuffer = 0.0
+            else:
+                self.currBuffer -= duration
+        self.now += duration
+
+
+def qoe(perf):
+    # same as the player
+    return perf['avg_bitrate'] - (config.LAMBDA * perf['avg_bitrate_change']) \
+        - (config.MU * perf['rebuffer_time']) - (config.MU * perf['startup_delay'])
+
+
+def simulate(manifest, abr, trace, buffer_size=60, predictor=None, manifest_file=None, fastmpc_table=None, prefetch=1):
+    '''
+    Runs one session. abr is an ABR rule name as taken by --abr or a BasicABR
+    instance, trace a list of NetworkPeriod or the path of a trace file.
+    '''
+    manifest = Manifest.coerce(manifest)
+    if isinstance(abr, str):
+        args = SimpleNamespace(abr=abr, predictor=predictor, manifest_file=manifest_file or config.MANIFEST_FILE,
+                               fastmpc_table=fastmpc_table)
+        abr = select_abr_algorithm(manifest, args)
+        if abr is None:
+            raise ValueError("Unknown ABR rule '%s'" % args.abr)
+    if isinstance(trace, str):
+        trace = load_trace(trace)
+    return Simulator(manifest, abr, trace, buffer_size, prefetch).run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trace driven ABR simulator")
+    parser.add_argument("traces", type=str, nargs="+", help="network trace files")
+    parser.add_argument("--manifest-file", type=str, default="htdocs/bbb_m.json", help="Path to the custom manifest file")
+    parser.add_argument("--abr", choices=ABR_RULES, default="tputRule", help="ABR rule to download video")
+    parser.add_argument("--predictor", choices=sorted(PREDICTORS),
+                        help="throughput predictor fed to the ABR rule (default: the rule's own)")
+    parser.add_argument("--fastmpc-table", type=str,
+                        help="FastMPC decision table, built in the user cache directory when not given")
+    parser.add_argument("-b", "--buffer-size", type=float, default=60, help="Buffer size for video playback")
+    parser.add_argument("--prefetch", type=int, default=1, help="segment requests in flight at once")
+    parser.add_argument("--output", type=str, help="write the results as JSON lines to this file")
+    parser.add_argument("-v", "--verbose", action="store_true", help="increase logging verbosity")
+    args = parser.parse_args()
+    if args.prefetch < 1:
+        parser.error("--prefetch must be at least 1")
+
+    logging.basicConfig(
+        format="%(asctime)s %(levelname)s %(name)s %(message)s",
+        level=logging.DEBUG if args.verbose else logging.INFO,
+    )
+
+    manifest = Manifest.load(args.manifest_file)
+
+    output = open(args.output, "a") if args.output else None
+    for trace in args.traces:
+        perf = simulate(manifest, args.abr, trace, args.buffer_size, args.predictor, args.manifest_file,
+                        args.fastmpc_table, args.prefetch)
+        logger.info("%s %s", args.abr, os.path.basename(trace))
+        logger.info(pformat({k: v for k, v in perf.items() if k not in ('bitrate_change', 'tput_observed')}))
+        if output is not None:
+            output.write(json.dumps(dict(perf, trace=trace, abr=args.abr, buffer_size=args.buffer_size)) + "\n")
+    if output is not None:
+        output.close()
+
+
+if __name__ == "__main__":
+    main()
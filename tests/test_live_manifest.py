@@ -0,0 +1,70 @@
+import unittest
+
+import numpy as np
+
+from adaptive import BBA2, Bola
+from adaptive.manifest import LiveChannel, Manifest
+
+WINDOW = 5
+
+
+def static_manifest(segments=40):
+    sizes = [[1000 * (s % 7 + 1) * (q + 1) for q in range(3)] for s in range(segments)]
+    return Manifest(0, segments, 1, 1, [1000, 2000, 4000], ['360', '480', '720'], sizes)
+
+
+class LiveManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.channel = LiveChannel(static_manifest(), WINDOW, 0)
+        self.client = Manifest.from_dict(self.channel.snapshot(10))
+
+    def test_update_within_window(self):
+        rows = self.client.apply_update(self.channel.update(12, self.client.sequence))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(self.client.sequence, 12)
+        self.assertEqual(self.client.start_number + len(self.client), 12)
+        self.assertEqual(self.client.window_start, 0)
+
+    def test_falling_behind_the_window(self):
+        update = self.channel.update(30, self.client.sequence)
+        self.assertEqual(update['first_segment'], 30 - WINDOW)
+
+        rows = self.client.apply_update(update)
+        self.assertEqual(self.client.sequence, 30)
+        self.assertEqual(self.client.start_number + len(self.client), 30)
+        self.assertEqual(len(rows), 30 - 10)
+        # the segments that left the window are skipped, the rest are the channel's
+        self.assertEqual(self.client.start_number + self.client.window_start, 30 - WINDOW)
+        np.testing.assert_array_equal(self.client.segment_size_bytes[self.client.window_start:],
+                                      update['segment_size_bytes'])
+
+        # and the next update is incremental again
+        rows = self.client.apply_update(self.channel.update(31, self.client.sequence))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(self.client.sequence, 31)
+        self.assertEqual(self.client.start_number + self.client.window_start, 30 - WINDOW)
+
+    def test_rows_map_to_source_segments(self):
+        # the channel has looped over the 40 segments and the window starts
+        # past the loop, the files to download follow the source segments
+        client = Manifest.from_dict(self.channel.snapshot(43))
+        self.assertEqual(client.start_number, 43 - WINDOW)
+        client.apply_update(self.channel.update(47, client.sequence))
+        source = self.channel.manifest
+        for row in range(len(client)):
+            segment = client.source_segment(row)
+            self.assertEqual(segment, (client.start_number + row) % len(source))
+            np.testing.assert_array_equal(client.segment_size_bytes[row], source.segment_size_bytes[segment])
+
+    def test_rules_extended_past_a_gap(self):
+        rules = [Bola(self.client), BBA2(self.client)]
+        rows = self.client.apply_update(self.channel.update(30, self.client.sequence))
+        for rule in rules:
+            rule.extendSegments(rows)
+            self.assertEqual(len(rule.segmentSizes), len(self.client))
+            stats = {'lastTput_kbps': 3000, 'currBuffer': 10, 'segment_Idx': self.client.window_start}
+            self.assertIn(rule.NextSegmentQualityIndex(stats), range(3))
+
+
+if __name__ == "__main__":
+    unittest.main()
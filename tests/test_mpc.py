@@ -0,0 +1,46 @@
+import itertools
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from adaptive.fastmpc import FastMPC
+from adaptive.manifest import Manifest
+from adaptive.mpc import MPC, MPC_SOLVER_DP, MPC_SOLVER_EXHAUSTIVE, QoEEvaluator, plan_qoe
+
+MANIFEST = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'htdocs', 'bbb_m.json')
+
+
+class MPCTest(unittest.TestCase):
+    def setUp(self):
+        self.manifest = Manifest.load(MANIFEST)
+
+    def decisions(self, rule, tput_kbps, buffer_level):
+        rule.estimateThroughput = lambda stats: stats['lastTput_kbps']
+        return rule.NextSegmentQualityIndex({'lastTput_kbps': tput_kbps, 'currBuffer': buffer_level,
+                                             'segment_Idx': 10})
+
+    def test_spare_buffer_is_not_rewarded(self):
+        # with the buffer well above the download times rebuffering is 0
+        # whatever the plan, the highest quality the throughput sustains wins
+        rules = [MPC(self.manifest, solver=MPC_SOLVER_EXHAUSTIVE), MPC(self.manifest, solver=MPC_SOLVER_DP)]
+        with tempfile.TemporaryDirectory() as cache:
+            rules.append(FastMPC(self.manifest, os.path.join(cache, 'table.fastmpc')))
+            for rule in rules:
+                for tput_kbps in (27000, 100000):
+                    for buffer_level in (10, 30):
+                        self.assertGreater(self.decisions(rule, tput_kbps, buffer_level), 0)
+
+    def test_evaluator_matches_scalar_loop(self):
+        evaluator = QoEEvaluator(self.manifest.bitrates_kbps, self.manifest.segment_duration_ms, 3)
+        sizes = np.asarray(self.manifest.segment_size_bytes[20:23], dtype=np.float64)
+        for prev_bitrate, buffer_level, tput_pred in itertools.product((0, 4000), (0, 2, 20), (1000, 30000)):
+            scores = evaluator.scores(prev_bitrate, buffer_level, tput_pred, sizes)
+            for i, combo in enumerate(evaluator.combos):
+                self.assertEqual(scores[i], plan_qoe(self.manifest.bitrates_kbps, self.manifest.segment_duration_ms,
+                                                     combo, prev_bitrate, buffer_level, tput_pred, sizes))
+
+
+if __name__ == "__main__":
+    unittest.main()